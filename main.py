@@ -3,18 +3,23 @@ import sys
 
 sys.path.append("src")
 
+import argparse
 import logging
 import os
 import shutil
-from typing import Union
+from typing import (Optional, Union)
 
 from telegram import Update
 from telegram.ext import CallbackContext
 
 from constants import (USERSTATE, MESSAGE_DIVIDER)
+import storage
+import journal
 from bot import Bot
-from user import (UserManager, User)
+from user import (UserManager, User, DEFAULT_INDEX_FILE, DEFAULT_EVENTS_FILE)
 from utils import utils
+from utils import log
+from utils import log_rotation
 from utils.log import Log
 from stages.admin import AdminConsole
 from stages.authenticate import Authenticate
@@ -32,9 +37,22 @@ FRESH_START = CONFIG["RUNTIME"]["FRESH_START"] if not LIVE_MODE else False
 BOT_TOKEN = CONFIG["BOT_TOKENS"]["LIVE"] if LIVE_MODE else CONFIG["BOT_TOKENS"]["TEST"]
 
 
-def main():
+def main(migrate_users: bool = False, migrate_workers: Optional[int] = None):
 
-    setup()
+    # Never clear the users that are about to be migrated
+    setup(fresh_start=FRESH_START and not migrate_users)
+
+    logging_config = CONFIG.get("LOGGING") or {}
+    if logging_config.get("ASYNC", False):
+        log.start_async_logging(
+            logging_config.get("QUEUE_SIZE", 10000),
+            logging_config.get("WHEN_FULL", "drop") == "block")
+    for code, every in (logging_config.get("SAMPLE") or {}).items():
+        log.set_sampling(code, every)
+    log_rotation.set_rotation(
+        logging_config.get("ROTATE_MAX_BYTES", 0),
+        logging_config.get("ROTATE_INTERVAL", 0.0),
+        logging_config.get("COMPRESS", True))
 
     # Main application logger
     logger = Log(
@@ -48,7 +66,8 @@ def main():
     user_manager.init(
         logger=logger,
         log_user_logs_to_app_logs=("LOG_USER_TO_APP_LOGS" in CONFIG
-                                   and CONFIG["LOG_USER_TO_APP_LOGS"]))
+                                   and CONFIG["LOG_USER_TO_APP_LOGS"]),
+        config=CONFIG)
 
     bot = Bot()
     bot.init(token=BOT_TOKEN,
@@ -154,33 +173,83 @@ def main():
     )
     # ---------------------------------------------------------------------------- #
 
+    # Migrate the userdata of every user to the latest schema (registered by the stages above) and exit
+    if migrate_users:
+        user_manager.migrate_users(
+            migrate_workers or (CONFIG.get("USERS") or {}).get("MIGRATE_WORKERS", 4))
+        user_manager.quit()
+        stop_logging(logger)
+        return
+
     # Start Bot
     logger.info(False, "")
     logger.info(False, "Initializing...")
     logger.info(False, "")
 
     bot.start(live_mode=LIVE_MODE)
+    stop_logging(logger)
 
 
-def setup():
+def stop_logging(logger: Log):
+    """
+    Writes any log records still queued (LOGGING:ASYNC) and closes the application logs.
+
+    :return: None
+    """
+    if log.PIPELINE and log.PIPELINE.dropped:
+        logger.warning("LOG_RECORDS_DROPPED",
+                       f"{log.PIPELINE.dropped} log records were dropped because the logging queue was full.")
+    log.stop_async_logging()
+    log_rotation.wait_for_compression()
+    logger.quit()
+
+
+def setup(fresh_start: Optional[bool] = None):
     """
     Creates the neccesary runtime directories if missing (logs).
-    If FRESH_START is True, then it will clear existing files from last run (logs/* and users/*).
+    If fresh_start (defaults to FRESH_START) is True, then it will clear existing files from last run (logs/*, the event log, users/*, the SQLite \
+        database if that storage backend is in use, the user manifest, index and snapshot and the journal).
 
     :return: None
     """
     utils.get_dir_or_create(os.path.join("logs"))
-    if FRESH_START:
+    if fresh_start is None:
+        fresh_start = FRESH_START
+    if fresh_start:
         users_directory = os.path.join("users")
 
+        # Shard directories are removed as a whole with STORAGE:LAYOUT sharded
         for chatid in os.listdir(users_directory):
             user_directory = os.path.join(users_directory, chatid)
             if os.path.isdir(user_directory):
                 shutil.rmtree(user_directory)
 
-        if os.path.isfile(LOG_FILE):
-            os.remove(LOG_FILE)
+        storage_config = CONFIG.get("STORAGE") or {}
+        sqlite_file = storage_config.get(
+            "SQLITE_FILE", storage.DEFAULT_SQLITE_FILE)
+        utils.remove_files(
+            [sqlite_file, f"{sqlite_file}-wal", f"{sqlite_file}-shm"])
+        utils.remove_files([
+            storage_config.get("MANIFEST_FILE", storage.DEFAULT_MANIFEST_FILE),
+            storage_config.get("SNAPSHOT_FILE", storage.DEFAULT_SNAPSHOT_FILE),
+            (CONFIG.get("USERS") or {}).get("INDEX_FILE", DEFAULT_INDEX_FILE),
+            *journal.journal_files(storage_config.get("JOURNAL_FILE", journal.DEFAULT_JOURNAL_FILE)),
+            storage_config.get("JOURNAL_ARCHIVE_FILE") or journal.DEFAULT_JOURNAL_ARCHIVE_FILE
+        ])
+
+        log_rotation.remove_log(LOG_FILE)
+        log_rotation.remove_log((CONFIG.get("LOGGING") or {}).get(
+            "EVENTS_FILE", DEFAULT_EVENTS_FILE))
 
 
 if __name__ == "__main__":
-    main()
+    PARSER = argparse.ArgumentParser()
+    PARSER.add_argument(
+        "--migrate-users", action="store_true",
+        help="Migrate the userdata of every user to the latest schema version and exit.")
+    PARSER.add_argument(
+        "-w", type=int, help="Number of users to migrate in parallel. Defaults to USERS:MIGRATE_WORKERS.",
+        default=None, required=False)
+    ARGS = PARSER.parse_args()
+
+    main(ARGS.migrate_users, ARGS.w)
@@ -3,17 +3,27 @@ sys.path.append("src")
 
 import os
 
-from utils.utils import (load_yaml_file, dump_to_yaml_file)
+import storage
+from ban_list import (BanList, DEFAULT_BAN_LOG_FILE)
+from utils.utils import load_yaml_file
 
 users_directory = os.path.join("users")
 banned_users_file = os.path.join(users_directory, "banned_users.yaml")
-banned_users = load_yaml_file(banned_users_file) or []
+
+config_yaml_file = os.path.join("config.yaml")
+config = load_yaml_file(config_yaml_file) if os.path.isfile(
+    config_yaml_file) else {}
+user_storage = storage.from_config(
+    users_directory, (config or {}).get("STORAGE"))
 
 if __name__ == "__main__":
-    for chatid in os.listdir(users_directory):
-        user_directory = os.path.join(users_directory, chatid)
+    banned_users = BanList(
+        banned_users_file,
+        ((config or {}).get("USERS") or {}).get("BAN_LOG_FILE", DEFAULT_BAN_LOG_FILE),
+        compact_every=sys.maxsize)
 
-        if os.path.isdir(user_directory) and chatid not in banned_users:
-            banned_users.append(chatid)
+    for chatid in user_storage.list_chatids():
+        banned_users.ban(chatid)
 
-    dump_to_yaml_file(banned_users, banned_users_file)
+    # Written as a whole instead of logging every ban
+    banned_users.compact()
@@ -0,0 +1,139 @@
+import sys
+sys.path.append("src")
+
+import os
+import time
+import random
+import datetime
+import argparse
+from typing import (Any, Callable, Dict, List)
+
+import yaml
+
+from utils import utils
+
+# ----------------------------- USING THIS SCRIPT ---------------------------- #
+# Compares the speed and size of the formats supported for user files
+# (STORAGE:FORMAT in config.yaml) on realistic userdata documents.
+#
+# $ python scripts/benchmark_serializers.py -c 20 -r 200
+#
+# If ctf/challenges exists, the challenges in it are used to build the progress in ctf_state.
+# Otherwise placeholder challenges are generated (see create_placeholder_challenges).
+#
+# `yaml (python)` is the pure-Python PyYAML implementation that was used before
+# the libyaml bindings were picked up automatically.
+# ---------------------------------------------------------------------------- #
+
+CHALLENGES_DIRECTORY = os.path.join("ctf", "challenges")
+
+
+def load_challenges(number_of_challenges: int) -> List[Dict[str, Any]]:
+    challenges = []
+
+    if os.path.isdir(CHALLENGES_DIRECTORY):
+        for name in sorted(os.listdir(CHALLENGES_DIRECTORY)):
+            challenge_yaml_file = os.path.join(
+                CHALLENGES_DIRECTORY, name, "challenge.yaml")
+            if os.path.isfile(challenge_yaml_file):
+                challenges.append(utils.load_yaml_file(challenge_yaml_file))
+
+    if challenges:
+        return challenges
+
+    for idx in range(number_of_challenges):
+        challenges.append({
+            "description": "Lorem ipsum dolor, sit amet consectetur adipisicing elit. " * 4,
+            "additional_info": None if idx % 2 else "Flag format: flag@XXXXXX",
+            "answer": f"flag@{idx:06d}",
+            "points": random.choice([20, 40, 60, 100]),
+            "difficulty": random.randint(1, 3),
+            "time_based": 1800 if idx % 5 == 0 else False,
+            "one_try": idx % 4 == 0,
+            "multiple_choices": ["Choice A", "Choice B", "Choice C", "Choice D"] if idx % 3 == 0 else None,
+            "hints": [{"deduction": 5, "text": "Lorem ipsum dolor sit amet."} for _ in range(idx % 3)],
+            "files": ["https://www.youtube.com/watch?v=dQw4w9WgXcQ"],
+        })
+    return challenges
+
+
+def create_user_data(challenges: List[Dict[str, Any]]) -> Dict[str, Any]:
+    # Same structure as Ctf.init_users_data, with some progress made
+    ctf_state = {
+        "total_score": 0,
+        "last_score_update": datetime.datetime.now(),
+        "challenges": {}
+    }
+
+    for idx, challenge in enumerate(challenges):
+        if random.random() < 0.2:
+            continue  # never opened
+
+        ctf_state["challenges"].update({f"{idx + 1}-Challenge": {
+            "attempts": random.randint(0, 3),
+            "completed": random.random() < 0.5,
+            "hints_used": [hint_number for hint_number, _ in enumerate(challenge["hints"])
+                           if random.random() < 0.5],
+            "total_hints_deduction": 0,
+            "start_time": datetime.datetime.now() if type(challenge["time_based"]) is int else None,
+            "end_time": None,
+        }})
+
+    return {
+        "name": "Bob",
+        "username": "Bob",
+        "group": "group-1",
+        "guardian_state": {"teams": ["A", "B"], "teams.history": [], "teams_str": "A, B", "options_picked": [0, 1, 2]},
+        "ctf_state": ctf_state,
+    }
+
+
+def time_it(function: Callable[[], Any], repeats: int) -> float:
+    start_time = time.perf_counter()
+    for _ in range(repeats):
+        function()
+    return (time.perf_counter() - start_time) / repeats * 1_000_000
+
+
+def benchmark(user_data: Dict[str, Any], repeats: int) -> None:
+    serializers = {
+        "yaml (python)": (
+            lambda: yaml.dump(user_data, Dumper=yaml.SafeDumper),
+            lambda payload: yaml.load(payload, Loader=yaml.SafeLoader)),
+        f"yaml ({'libyaml' if utils.YamlDumper is not yaml.SafeDumper else 'python'})": (
+            lambda: utils.serialize(user_data, "yaml"),
+            lambda payload: utils.deserialize(payload, "yaml")),
+        "json": (
+            lambda: utils.serialize(user_data, "json"),
+            lambda payload: utils.deserialize(payload, "json")),
+        "pickle": (
+            lambda: utils.serialize(user_data, "pickle"),
+            lambda payload: utils.deserialize(payload, "pickle")),
+    }
+
+    print(f"{'FORMAT':<16}{'DUMP (us)':>12}{'LOAD (us)':>12}{'SIZE (bytes)':>14}")
+    for name, (dump, load) in serializers.items():
+        payload = dump()
+        assert load(payload) == user_data, f"{name} did not round-trip the userdata"
+
+        dump_time = time_it(dump, repeats)
+        load_time = time_it(lambda: load(payload), repeats)
+        size = len(payload.encode() if isinstance(payload, str) else payload)
+        print(f"{name:<16}{dump_time:>12.1f}{load_time:>12.1f}{size:>14}")
+
+
+if __name__ == "__main__":
+    PARSER = argparse.ArgumentParser()
+    PARSER.add_argument(
+        "-c", type=int,
+        help="Number of placeholder challenges to generate if ctf/challenges does not exist. Defaults to 20.",
+        default=20, required=False)
+    PARSER.add_argument(
+        "-r", type=int,
+        help="Number of times each format is dumped and loaded. Defaults to 200.",
+        default=200, required=False)
+    ARGS = PARSER.parse_args()
+
+    challenges = load_challenges(ARGS.c)
+    print(f"Benchmarking userdata with {len(challenges)} challenges ({ARGS.r} repeats)...\n")
+    benchmark(create_user_data(challenges), ARGS.r)
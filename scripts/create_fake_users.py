@@ -5,13 +5,16 @@ import os
 import logging
 import random
 import shutil
+import json
 import datetime
 import argparse
 import string
-from typing import List
+from typing import (Dict, List)
 
+import storage
+from ban_list import BanList
 from bot import Bot
-from user import User, UserManager
+from user import (User, UserManager, DEFAULT_EVENTS_FILE)
 from stages.ctf import Ctf
 from utils.log import Log
 from utils import utils
@@ -35,9 +38,16 @@ TEMP_LOG_FILE = os.path.join("logs", "create_fake_users.log")
 users_directory = os.path.join("users")
 banned_users_yaml_file = os.path.join(users_directory, "banned_users.yaml")
 
-banned_chatids = utils.load_yaml_file(banned_users_yaml_file) or []
-chatids = [chatid for chatid in os.listdir(
-    users_directory) if os.path.isdir(os.path.join(users_directory, chatid))]
+config_yaml_file = os.path.join("config.yaml")
+config = utils.load_yaml_file(config_yaml_file) if os.path.isfile(
+    config_yaml_file) else {}
+
+events_file = ((config or {}).get("LOGGING") or {}).get(
+    "EVENTS_FILE", DEFAULT_EVENTS_FILE)
+
+banned_chatids = BanList(banned_users_yaml_file)
+chatids = storage.from_config(
+    users_directory, (config or {}).get("STORAGE")).list_chatids()
 
 
 def override_init(self, logger: Log) -> None:
@@ -66,7 +76,8 @@ class Emulator:
         self.user_manager: UserManager = UserManager()
         self.user_manager.init(
             logger=self.logger,
-            log_user_logs_to_app_logs=False)
+            log_user_logs_to_app_logs=False,
+            config=config)
 
         self.ctf: Ctf = Ctf(
             stage_id="ctf",
@@ -99,11 +110,20 @@ class Emulator:
         self.logger.quit()
         os.remove(TEMP_LOG_FILE)
 
-    def create_log_line(self, name: str, time: str, log: str) -> None:
+    def create_log_line(self, name: str, time: str, log: str, **event) -> None:
         fake_user: User = self.fake_users.get(name)
         with open(fake_user.log_file, 'a', encoding="utf-8") as log_file:
             log_file.write(f"{time} {log}" + "\n")
 
+        # Same event as the one logged by the ctf stage (see Log.event)
+        with open(events_file, 'a', encoding="utf-8") as stream:
+            stream.write(json.dumps({
+                "ts": self.fake_time.get(name).timestamp(),
+                "chatid": fake_user.chatid,
+                "challenge_id": self.challenges[event["challenge"] - 1]["id"],
+                **event
+            }) + "\n")
+
     def set_score(self, name: str, score: int) -> None:
         fake_user: User = self.fake_users.get(name)
         fake_user.data.get("ctf_state").update({"total_score": score})
@@ -119,6 +139,14 @@ class Emulator:
 
         return fake_user.data.get("ctf_state").get("total_score")
 
+    def get_challenge_progress(self, name: str, challenge_number: int) -> Dict:
+        fake_user: User = self.fake_users.get(name)
+
+        return self.ctf.get_challenge_progress(
+            fake_user.data.get("ctf_state"),
+            self.challenges[challenge_number]["id"],
+            create=True)
+
     def attempt_challenge(self, name: str, challenge_number: int) -> None:
         fake_user: User = self.fake_users.get(name)
 
@@ -128,17 +156,20 @@ class Emulator:
             name,
             self.fast_forward_time(name, multiplier=6),
             f"[INFO] $CODE::USER_CTF_WRONG_ANSWER_{challenge_number} "
-            f"|| User:{chatid} @flag@ got the answer WRONG for Challenge {challenge_number}")
+            f"|| User:{chatid} @flag@ got the answer WRONG for Challenge {challenge_number}",
+            code=f"USER_CTF_WRONG_ANSWER_{challenge_number}", action="WRONG_ANSWER",
+            challenge=challenge_number + 1,
+            score=fake_user.data.get("ctf_state").get("total_score"))
 
     def complete_challenge(self, name: str, challenge_number: int) -> None:
         fake_user: User = self.fake_users.get(name)
 
         chatid = fake_user.chatid
-        ctf_state = fake_user.data.get("ctf_state")
+        challenge_progress = self.get_challenge_progress(name, challenge_number)
 
-        challenge_info = ctf_state.get("challenges")[challenge_number]
-        challenge_score = challenge_info["points"]
-        total_deductions = challenge_info["total_hints_deduction"]
+        challenge_score = self.challenges[challenge_number]["points"]
+        total_deductions = challenge_progress["total_hints_deduction"]
+        challenge_progress.update({"completed": True})
 
         current_total_score = self.add_score(
             name, challenge_score - total_deductions)
@@ -147,18 +178,19 @@ class Emulator:
             self.fast_forward_time(name, multiplier=7),
 
             f"[INFO] $CODE::USER_CTF_CORRECT_ANSWER_{challenge_number} "
-            f"|| User:{chatid} @{current_total_score}@ got the answer CORRECT for Challenge {challenge_number}")
+            f"|| User:{chatid} @{current_total_score}@ got the answer CORRECT for Challenge {challenge_number}",
+            code=f"USER_CTF_CORRECT_ANSWER_{challenge_number}", action="CORRECT_ANSWER",
+            challenge=challenge_number + 1, score=current_total_score)
 
     def view_hint(self, name: str, challenge_number: int, hint_number: int) -> None:
         fake_user: User = self.fake_users.get(name)
 
         chatid = fake_user.chatid
-        ctf_state = fake_user.data.get("ctf_state")
+        challenge_progress = self.get_challenge_progress(name, challenge_number)
 
-        challenge_info = ctf_state.get("challenges")[challenge_number]
-        challenge_score = challenge_info["points"]
-        hint_deduction = challenge_info["hints"][hint_number]["deduction"]
-        challenge_info["total_hints_deduction"] += hint_deduction
+        hint_deduction = self.challenges[challenge_number]["hints"][hint_number]["deduction"]
+        challenge_progress["hints_used"].append(hint_number)
+        challenge_progress["total_hints_deduction"] += hint_deduction
 
         fake_user.save_to_file()
         self.create_log_line(
@@ -166,7 +198,9 @@ class Emulator:
             self.fast_forward_time(name, multiplier=3),
 
             f"[INFO] $CODE::USER_CTF_VIEW_HINT_{challenge_number}_{hint_number} "
-            f"|| User:{chatid} has revealed hint {hint_number} for Challenge {challenge_number}")
+            f"|| User:{chatid} has revealed hint {hint_number} for Challenge {challenge_number}",
+            code=f"USER_CTF_VIEW_HINT_{challenge_number}_{hint_number}", action="VIEW_HINT",
+            challenge=challenge_number + 1, hint=hint_number + 1)
 
     def fast_forward_time(self, name: str, multiplier: int = 5) -> str:
         random_minutes = (random.random() + 0.2) * 5
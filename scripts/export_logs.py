@@ -130,14 +130,27 @@ import sys
 sys.path.append("src")
 
 import os
+import json
+import datetime
 import argparse
 import re
-from typing import (List, Dict, Any, Callable, Union, Optional)
+from typing import (List, Dict, Any, Callable, Union, Optional, Set, Tuple)
 
+import storage
+from user import DEFAULT_EVENTS_FILE
+from utils import log_rotation
 from utils.utils import (load_yaml_file, get_dir_or_create)
 
 
 EXPORTS_DIRECTORY = get_dir_or_create("exports")
+
+CONFIG_YAML_FILE = os.path.join("config.yaml")
+CONFIG = load_yaml_file(CONFIG_YAML_FILE) if os.path.isfile(
+    CONFIG_YAML_FILE) else {}
+user_storage = storage.from_config(
+    os.path.join("users"), (CONFIG or {}).get("STORAGE"))
+EVENTS_FILE = ((CONFIG or {}).get("LOGGING") or {}).get(
+    "EVENTS_FILE", DEFAULT_EVENTS_FILE)
 LOGS_PATTERNS = {
     "date": r"\b[0-9]+-[0-9]+-[0-9]+",
     "time": r"\b[0-9]+:[0-9]+:[0-9]+",
@@ -161,19 +174,16 @@ def extract_data_type_from_line(data_type: str, log_line: str) -> Optional[str]:
 def get_users(chatid_specificer: str, group_specifier: str) -> Dict:
     users = {}
 
-    users_directory = os.path.join("users")
-    for chatid in os.listdir(users_directory):
+    for chatid in user_storage.list_chatids():
         if chatid_specificer and chatid.lower() != chatid_specificer.lower():
             continue
 
-        user_directory = os.path.join(users_directory, chatid)
+        user_directory = user_storage.user_directory(chatid)
         if os.path.isdir(user_directory):
-            user_data_yaml = os.path.join(user_directory, f"{chatid}.yaml")
             user_log_file = os.path.join(user_directory, f"{chatid}.log")
 
-            if os.path.isfile(user_data_yaml) and os.path.isfile(user_log_file):
-                user_logs = None
-                user_data = load_yaml_file(user_data_yaml)
+            if user_storage.exists(chatid) and log_rotation.has_log(user_log_file):
+                user_data = user_storage.load(chatid)
 
                 if user_data is not None:
                     extracted_data_fields = {}
@@ -203,30 +213,109 @@ def get_users(chatid_specificer: str, group_specifier: str) -> Dict:
                     if group_specifier and group.lower() != group_specifier.lower():
                         continue
 
-                    with open(user_log_file, 'r') as stream:
-                        user_logs = list((line.rstrip()
-                                         for line in stream.readlines()))
-
                     users.update({
                         chatid: {
                             "group": group,
 
                             "relevant_data": extracted_data_fields,
 
-                            "logs": user_logs,
                             "data": user_data,
 
                             "log_file": user_log_file,
-                            "data_yaml_file": user_data_yaml,
                         }
                     })
 
     return users
 
 
-def export_log_files(export_file_name: str, chatid_specificer: str, group_specifier: str) -> None:
+def is_in_time_range(timestamp: float, since: Optional[float], until: Optional[float]) -> bool:
+    return (since is None or timestamp >= since) and (until is None or timestamp <= until)
+
+
+def read_actions_from_log_file(log_file: str, since: Optional[float] = None,
+                               until: Optional[float] = None) -> List[Tuple[str, str, int, int]]:
+    # Returns (time, action, challenge number, score) for every relevant line of a user log file
+    actions = []
+
+    # Rotated segments outside of [since, until] are skipped without being read
+    for line in log_rotation.read_lines(log_file, since, until):
+        line = line.rstrip()
+
+        if since is not None or until is not None:
+            log_date_time = extract_data_type_from_line("date_time", line)
+            if log_date_time and not is_in_time_range(
+                    datetime.datetime.strptime(log_date_time, "%Y-%m-%d %H:%M:%S").timestamp(), since, until):
+                continue
+
+        log_time = extract_data_type_from_line("time", line)
+
+        challenge_number = None
+        score = 0
+        action_keyword = extract_data_type_from_line("action_code", line)
+
+        if action_keyword:
+            action_keys = action_keyword.split("_")
+
+            if "WRONG_ANSWER" in action_keyword or "CORRECT_ANSWER" in action_keyword:
+                challenge_number = int(action_keys[4]) + 1
+                if "CORRECT" in action_keyword:
+                    score = int(extract_data_type_from_line("score", line))
+                    action_keyword = "CORRECT_ANSWER"
+                else:
+                    action_keyword = "WRONG_ANSWER"
+            elif "VIEW_HINT" in action_keyword:
+                challenge_number = int(action_keys[4]) + 1
+                action_keyword = f"VIEW_HINT_{int(action_keys[-1]) + 1}"
+            elif "CREATING_NEW_USER" in action_keyword:
+                action_keyword = "INIT_USER"
+                challenge_number = 0
+
+            actions.append((log_time, action_keyword, challenge_number, score))
+
+    return actions
+
+
+def read_actions_from_events_file(events_file: str, chatids: Set[str], since: Optional[float] = None,
+                                  until: Optional[float] = None) -> Dict[str, List[Tuple[str, str, int, int]]]:
+    # Same as read_actions_from_log_file but for every user at once, from the events logged with Log.event
+    actions = {}
+
+    for line in log_rotation.read_lines(events_file, since, until):
+        try:
+            event = json.loads(line)
+        except ValueError:
+            continue
+
+        chatid = event.get("chatid")
+        if chatid not in chatids or not is_in_time_range(event["ts"], since, until):
+            continue
+
+        log_time = datetime.datetime.fromtimestamp(
+            event["ts"]).strftime("%H:%M:%S")
+        action_keyword = event.get("action")
+
+        if action_keyword in ("CORRECT_ANSWER", "WRONG_ANSWER"):
+            score = event["score"] if action_keyword == "CORRECT_ANSWER" else 0
+            actions.setdefault(chatid, []).append(
+                (log_time, action_keyword, event["challenge"], score))
+        elif action_keyword == "VIEW_HINT":
+            actions.setdefault(chatid, []).append(
+                (log_time, f"VIEW_HINT_{event['hint']}", event["challenge"], 0))
+        elif action_keyword == "INIT_USER":
+            actions.setdefault(chatid, []).append(
+                (log_time, action_keyword, 0, 0))
+
+    return actions
+
+
+def export_log_files(export_file_name: str, chatid_specificer: str, group_specifier: str,
+                     since: Optional[float] = None, until: Optional[float] = None) -> None:
     users = get_users(chatid_specificer, group_specifier)
 
+    # Users without events (e.g logged before the events file existed) are read from their log files instead
+    actions_by_chatid = read_actions_from_events_file(
+        EVENTS_FILE, set(users), since, until)
+
     cached_scores = {}  # A useful mapping dictionary to cache new score for next iterations
 
     # logs_by_time : A dictionary with key:time, value: array of logs
@@ -240,47 +329,30 @@ def export_log_files(export_file_name: str, chatid_specificer: str, group_specif
     for chatid, user in users.items():
         cached_scores.update({chatid: 0})
 
-        for line in user["logs"]:
-            log_time = extract_data_type_from_line("time", line)
-
-            challenge_number = None
-            score = 0
-            action_keyword = extract_data_type_from_line("action_code", line)
-
-            if action_keyword:
-                action_keys = action_keyword.split("_")
-
-                if "WRONG_ANSWER" in action_keyword or "CORRECT_ANSWER" in action_keyword:
-                    challenge_number = int(action_keys[4]) + 1
-                    if "CORRECT" in action_keyword:
-                        score = int(extract_data_type_from_line("score", line))
-                        cached_scores[chatid] = score
-                        action_keyword = "CORRECT_ANSWER"
-                    else:
-                        action_keyword = "WRONG_ANSWER"
-                elif "VIEW_HINT" in action_keyword:
-                    challenge_number = int(action_keys[4]) + 1
-                    action_keyword = f"VIEW_HINT_{int(action_keys[-1]) + 1}"
-                elif "CREATING_NEW_USER" in action_keyword:
-                    action_keyword = "INIT_USER"
-                    challenge_number = 0
-
-                if challenge_number:
-                    if not log_time in logs_by_time:
-                        chatids_by_time.update({log_time: []})
-                        logs_by_time.update({log_time: []})
-                        scores_by_time.update({log_time: {}})
-
-                    relevant_data_str = ','.join(
-                        user["relevant_data"].values())
-
-                    logs_by_time[log_time].append(
-                        f"{relevant_data_str},{action_keyword},{challenge_number},{max(score, cached_scores[chatid])}"
-                    )
-
-                    chatids_by_time[log_time].append(chatid)
-                    if score != 0 or challenge_number == "INIT":
-                        scores_by_time[log_time].update({chatid: score})
+        actions = actions_by_chatid.get(chatid)
+        if not any(challenge_number for _, _, challenge_number, _ in actions or []):
+            actions = read_actions_from_log_file(user["log_file"], since, until)
+
+        for log_time, action_keyword, challenge_number, score in actions:
+            if action_keyword == "CORRECT_ANSWER":
+                cached_scores[chatid] = score
+
+            if challenge_number:
+                if not log_time in logs_by_time:
+                    chatids_by_time.update({log_time: []})
+                    logs_by_time.update({log_time: []})
+                    scores_by_time.update({log_time: {}})
+
+                relevant_data_str = ','.join(
+                    user["relevant_data"].values())
+
+                logs_by_time[log_time].append(
+                    f"{relevant_data_str},{action_keyword},{challenge_number},{max(score, cached_scores[chatid])}"
+                )
+
+                chatids_by_time[log_time].append(chatid)
+                if score != 0 or challenge_number == "INIT":
+                    scores_by_time[log_time].update({chatid: score})
 
     cached_scores = {}
     for time in sorted(chatids_by_time):
@@ -325,6 +397,17 @@ if __name__ == "__main__":
         "-g", type=str,
         help="Specify a group to export logs from.",
         default="", required=False)
+    PARSER.add_argument(
+        "--since", type=str,
+        help="Only export logs from this time on (e.g 2022-05-20 or \"2022-05-20 13:00:00\").",
+        default="", required=False)
+    PARSER.add_argument(
+        "--until", type=str,
+        help="Only export logs up to this time (e.g 2022-05-20 or \"2022-05-20 18:00:00\").",
+        default="", required=False)
     ARGS = PARSER.parse_args()
 
-    export_log_files(ARGS.o, ARGS.u, ARGS.g)
+    export_log_files(
+        ARGS.o, ARGS.u, ARGS.g,
+        datetime.datetime.fromisoformat(ARGS.since).timestamp() if ARGS.since else None,
+        datetime.datetime.fromisoformat(ARGS.until).timestamp() if ARGS.until else None)
@@ -0,0 +1,182 @@
+import sys
+sys.path.append("src")
+
+import json
+import time
+import argparse
+import threading
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import (BaseHTTPRequestHandler, ThreadingHTTPServer)
+from typing import (Any, Dict, List, Optional)
+from urllib.parse import parse_qs
+
+from webhook import SECRET_TOKEN_HEADER
+
+# ----------------------------- USING THIS SCRIPT ---------------------------- #
+# Runs a local fake of the Telegram Bot API to test the bot in webhook mode
+# (WEBHOOK in config.yaml) without Telegram.
+#
+# Point the bot to it in config.yaml and start the bot first:
+#
+#   BOT:
+#     API_URL: http://127.0.0.1:8081/bot
+#   WEBHOOK:
+#     ENABLED: true
+#     URL: http://127.0.0.1:8443/telegram
+#
+# $ python scripts/fake_telegram_server.py -p 8081 -c 20 -u 5
+#
+# Once the bot sets its webhook, `/start` is sent -u times from each of -c chats
+# (chats in parallel), and the responses of the webhook are reported along with
+# the number of messages the bot sent back.
+# ---------------------------------------------------------------------------- #
+
+FAKE_BOT = {"id": 1, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"}
+
+# Bot API methods that return the sent / edited message
+MESSAGE_METHODS = ("sendmessage", "editmessagetext", "editmessagereplymarkup", "sendphoto",
+                   "senddocument", "sendsticker", "forwardmessage")
+
+
+class FakeTelegramServer(ThreadingHTTPServer):
+    def __init__(self, port: int):
+        super().__init__(("127.0.0.1", port), FakeBotApiHandler)
+        self.webhook: Optional[Dict[str, Any]] = None
+        self.webhook_set = threading.Event()
+
+        self.lock = threading.Lock()
+        self.calls: Dict[str, int] = {}
+        self.message_id = 0
+
+    def call(self, method: str, params: Dict[str, Any]) -> Any:
+        with self.lock:
+            self.calls.update({method: self.calls.get(method, 0) + 1})
+
+            if method == "getme":
+                return FAKE_BOT
+            if method == "setwebhook":
+                self.webhook = params
+                self.webhook_set.set()
+                return True
+            if method in MESSAGE_METHODS:
+                self.message_id += 1
+                return {
+                    "message_id": self.message_id,
+                    "date": int(time.time()),
+                    "chat": {"id": int(params.get("chat_id") or 0), "type": "private"},
+                    "from": FAKE_BOT,
+                    "text": params.get("text", "")
+                }
+            return True
+
+
+class FakeBotApiHandler(BaseHTTPRequestHandler):
+    server: FakeTelegramServer
+
+    def do_POST(self) -> None:
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        content_type = self.headers.get("Content-Type") or ""
+
+        params: Dict[str, Any] = {}
+        if content_type.startswith("application/json") and body:
+            params = json.loads(body)
+        elif content_type.startswith("application/x-www-form-urlencoded"):
+            params = {key: values[0] for key, values in parse_qs(body.decode()).items()}
+
+        # /bot<token>/<method>
+        method = self.path.rsplit("/", 1)[-1].lower()
+        response = json.dumps({"ok": True, "result": self.server.call(method, params)}).encode()
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    do_GET = do_POST
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+def make_start_update(update_id: int, chatid: int) -> Dict[str, Any]:
+    user = {"id": chatid, "is_bot": False, "first_name": f"User{chatid}"}
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chatid, "type": "private", "first_name": user["first_name"]},
+            "from": user,
+            "text": "/start",
+            "entities": [{"type": "bot_command", "offset": 0, "length": 6}]
+        }
+    }
+
+
+def post_update(url: str, secret_token: str, update: Dict[str, Any]) -> int:
+    request = urllib.request.Request(url, data=json.dumps(update).encode(), method="POST", headers={
+        "Content-Type": "application/json",
+        SECRET_TOKEN_HEADER: secret_token
+    })
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def send_updates(url: str, secret_token: str, chats: int, updates_per_chat: int) -> None:
+    statuses: Dict[int, int] = {}
+    latencies: List[float] = []
+    lock = threading.Lock()
+
+    def send_chat_updates(chat_number: int) -> None:
+        chatid = 100000 + chat_number
+        for idx in range(updates_per_chat):
+            started_at = time.perf_counter()
+            status = post_update(url, secret_token, make_start_update(
+                chat_number * updates_per_chat + idx + 1, chatid))
+            with lock:
+                latencies.append(time.perf_counter() - started_at)
+                statuses.update({status: statuses.get(status, 0) + 1})
+
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=min(chats, 32)) as executor:
+        list(executor.map(send_chat_updates, range(chats)))
+    elapsed = time.perf_counter() - started_at
+
+    latencies.sort()
+    print(f"Sent {len(latencies)} updates in {elapsed:.2f}s ({len(latencies) / elapsed:.0f} updates/s).")
+    print(f"Webhook responses: {statuses}")
+    print(f"Latency p50: {latencies[len(latencies) // 2] * 1000:.1f}ms, "
+          f"p99: {latencies[int(len(latencies) * 0.99)] * 1000:.1f}ms")
+
+    rejected = post_update(url, "wrong-secret-token", make_start_update(0, 100000))
+    print(f"Update with a wrong secret token: {rejected} (expected 403)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-p", type=int, default=8081,
+                        help="Port of the fake Bot API server. Defaults to 8081.")
+    parser.add_argument("-c", type=int, default=20,
+                        help="Number of chats sending updates. Defaults to 20.")
+    parser.add_argument("-u", type=int, default=5,
+                        help="Number of updates sent by each chat. Defaults to 5.")
+    args = parser.parse_args()
+
+    server = FakeTelegramServer(args.p)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Fake Bot API listening on http://127.0.0.1:{args.p}/bot, waiting for the bot to set its webhook...")
+
+    server.webhook_set.wait()
+    print(f"""Webhook set to {server.webhook["url"]}.""")
+    send_updates(server.webhook["url"], server.webhook.get("secret_token") or "", args.c, args.u)
+
+    # Leaves some time for the bot to answer the last updates
+    time.sleep(2)
+    print(f"Bot API calls made by the bot: {server.calls}")
+    server.shutdown()
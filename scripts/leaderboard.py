@@ -40,66 +40,68 @@ import json
 import argparse
 from typing import (List, Dict, Any, Callable, Union)
 
+import storage
 from utils.utils import load_yaml_file
 
 users_directory = os.path.join("users")
 leaderboard_export_file = os.path.join("exports", "exported_leaderboard.csv")
 
+config_yaml_file = os.path.join("config.yaml")
+config = load_yaml_file(config_yaml_file) if os.path.isfile(
+    config_yaml_file) else {}
+user_storage = storage.from_config(
+    users_directory, (config or {}).get("STORAGE"))
+
 
 def update_leaderboard(max_leaderboard_view: int) -> List[List[Union[int, List[Dict[str, str]]]]]:
 
     scoring_dict = {}
     scoring_list = []
 
-    for chatid in os.listdir(users_directory):
-        user_directory = os.path.join(users_directory, chatid)
-
-        if os.path.isdir(user_directory):
-            user_yaml_file = os.path.join(user_directory, f"{chatid}.yaml")
-
-            if os.path.isfile(user_yaml_file):
-                user_data = load_yaml_file(user_yaml_file)
+    for chatid in user_storage.list_chatids():
+        if user_storage.exists(chatid):
+            user_data = user_storage.load(chatid)
 
-                if user_data is not None:
-                    ctf_state = user_data.get("ctf_state")
+            if user_data is not None:
+                ctf_state = user_data.get("ctf_state")
 
-                    if ctf_state:
-                        user_total_score = str(ctf_state["total_score"])
+                if ctf_state:
+                    user_total_score = str(ctf_state["total_score"])
 
-                        if int(user_total_score) > -1:
-                            if user_total_score not in scoring_dict:
-                                scoring_dict.update({user_total_score: []})
+                    if int(user_total_score) > -1:
+                        if user_total_score not in scoring_dict:
+                            scoring_dict.update({user_total_score: []})
 
-                            extracted_data_fields = {}
-                            for data_field_label, default_data_field in RELEVANT_DATA_FIELDS.items():
-                                data_path: str
-                                default_constructor: Callable[[*Any], Any]
-                                default_value: Any
+                        extracted_data_fields = {}
+                        for data_field_label, default_data_field in RELEVANT_DATA_FIELDS.items():
+                            data_path: str
+                            default_constructor: Callable[[*Any], Any]
+                            default_value: Any
 
-                                data_path, default_constructor, default_value = default_data_field
+                            data_path, default_constructor, default_value = default_data_field
 
-                                data_field_value: Union[Any,
-                                                        Dict[str, Any]] = user_data
+                            data_field_value: Union[Any,
+                                                    Dict[str, Any]] = user_data
 
-                                split_paths: List[str] = data_path.split(':')
-                                for i, path in enumerate(split_paths):
-                                    data_field_value = data_field_value.get(
-                                        path,
-                                        default_constructor(default_value) if i == len(
-                                            split_paths) - 1 else {}
-                                    )
+                            split_paths: List[str] = data_path.split(':')
+                            for i, path in enumerate(split_paths):
+                                data_field_value = data_field_value.get(
+                                    path,
+                                    default_constructor(default_value) if i == len(
+                                        split_paths) - 1 else {}
+                                )
 
-                                extracted_data_fields.update(
-                                    {data_field_label: str(data_field_value)})
+                            extracted_data_fields.update(
+                                {data_field_label: str(data_field_value)})
 
-                            scoring_dict[user_total_score].append(
-                                {
-                                    "name": extracted_data_fields.get("name", "name-not-valid-in-extracted-data"),
-                                    "relevant_data": extracted_data_fields,
-                                    "chatid": chatid,
-                                    "last_score_update": ctf_state.get("last_score_update")
-                                }
-                            )
+                        scoring_dict[user_total_score].append(
+                            {
+                                "name": extracted_data_fields.get("name", "name-not-valid-in-extracted-data"),
+                                "relevant_data": extracted_data_fields,
+                                "chatid": chatid,
+                                "last_score_update": ctf_state.get("last_score_update")
+                            }
+                        )
 
     for total_score, users in scoring_dict.items():
         users.sort(key=lambda a: a["last_score_update"])
@@ -200,7 +202,7 @@ if __name__ == "__main__":
         help="If set to any value, the leaderboard.json file will not be generated.")
     ARGS = PARSER.parse_args()
 
-    max_leaderboard_view = ARGS.n or len(os.listdir(users_directory)) - 2
+    max_leaderboard_view = ARGS.n or len(user_storage.list_chatids())
 
     print("Leaderboard.py is now running... (Press CTRL + C to stop)")
     while True:
@@ -0,0 +1,73 @@
+import sys
+sys.path.append("src")
+
+import os
+import argparse
+
+import storage
+from utils.utils import load_yaml_file
+
+# ----------------------------- USING THIS SCRIPT ---------------------------- #
+# Moves every user directory from one layout of the users directory to another
+# and rebuilds the manifest of users (users/manifest.txt).
+#
+#   flat:    users/[chatid]/
+#   sharded: users/ab/cd/[chatid]/
+#
+# $ python scripts/migrate_users_layout.py -l sharded
+#
+# Stop the bot before running this script, then set the layout in config.yaml:
+#
+#   STORAGE:
+#     LAYOUT: sharded
+# ---------------------------------------------------------------------------- #
+
+users_directory = os.path.join("users")
+
+config_yaml_file = os.path.join("config.yaml")
+config = load_yaml_file(config_yaml_file) if os.path.isfile(
+    config_yaml_file) else {}
+storage_config = (config or {}).get("STORAGE") or {}
+
+
+def migrate_users_layout(from_layout: str, to_layout: str) -> None:
+    assert from_layout != to_layout, f"Users are already in the {to_layout} layout."
+
+    migrated, failed = 0, 0
+
+    for chatid in storage.scan_chatids(users_directory, from_layout):
+        from_directory = storage.user_directory(users_directory, chatid, from_layout)
+        to_directory = storage.user_directory(users_directory, chatid, to_layout)
+
+        if os.path.exists(to_directory):
+            print(f"Failed to migrate User:{chatid}, {to_directory} already exists")
+            failed += 1
+            continue
+
+        # Also removes the shard directories left empty
+        os.renames(from_directory, to_directory)
+        migrated += 1
+
+    # Rebuilt from the users directory by the storage backend
+    manifest_file = storage_config.get("MANIFEST_FILE", storage.DEFAULT_MANIFEST_FILE)
+    if os.path.isfile(manifest_file):
+        os.remove(manifest_file)
+    storage.FileStorage(users_directory, layout=to_layout, manifest_file=manifest_file)
+
+    print(f"Migrated: {migrated} | Failed: {failed}")
+    print(f"Remember to set STORAGE:LAYOUT to {to_layout} in config.yaml.")
+
+
+if __name__ == "__main__":
+    PARSER = argparse.ArgumentParser()
+    PARSER.add_argument(
+        "-l", type=str, choices=storage.STORAGE_LAYOUTS,
+        help="Layout to move the user directories to.",
+        required=True)
+    PARSER.add_argument(
+        "-f", type=str, choices=storage.STORAGE_LAYOUTS,
+        help="Current layout of the user directories. Defaults to STORAGE:LAYOUT in config.yaml.",
+        default=storage_config.get("LAYOUT", "flat"), required=False)
+    ARGS = PARSER.parse_args()
+
+    migrate_users_layout(ARGS.f, ARGS.l)
@@ -0,0 +1,70 @@
+import sys
+sys.path.append("src")
+
+import os
+import argparse
+
+from storage import (YamlStorage, SqliteStorage, DEFAULT_SQLITE_FILE)
+from utils.utils import load_yaml_file
+
+# ----------------------------- USING THIS SCRIPT ---------------------------- #
+# Imports every existing user in the users directory (users/[chatid]/[chatid].yaml)
+# into the SQLite storage backend.
+#
+# $ python scripts/migrate_users_to_sqlite.py -o users/users.db
+#
+# Then set the storage backend in config.yaml:
+#
+#   STORAGE:
+#     BACKEND: sqlite
+#     SQLITE_FILE: users/users.db
+#
+# The yaml files are left untouched so that you can switch back if needed.
+# ---------------------------------------------------------------------------- #
+
+users_directory = os.path.join("users")
+
+config_yaml_file = os.path.join("config.yaml")
+config = load_yaml_file(config_yaml_file) if os.path.isfile(
+    config_yaml_file) else {}
+layout = ((config or {}).get("STORAGE") or {}).get("LAYOUT", "flat")
+
+
+def migrate_users(database_file: str, overwrite: bool = False) -> None:
+    yaml_storage = YamlStorage(users_directory, layout=layout)
+    sqlite_storage = SqliteStorage(users_directory, database_file, layout=layout)
+
+    migrated, skipped, failed = 0, 0, 0
+
+    for chatid in yaml_storage.list_chatids():
+        if not yaml_storage.exists(chatid):
+            continue
+
+        if sqlite_storage.exists(chatid) and not overwrite:
+            skipped += 1
+            continue
+
+        user_data = yaml_storage.load(chatid)
+        if user_data is not None and sqlite_storage.save(chatid, user_data):
+            migrated += 1
+        else:
+            print(f"Failed to migrate User:{chatid}")
+            failed += 1
+
+    sqlite_storage.close()
+
+    print(f"Migrated: {migrated} | Skipped (already exists): {skipped} | Failed: {failed}")
+
+
+if __name__ == "__main__":
+    PARSER = argparse.ArgumentParser()
+    PARSER.add_argument(
+        "-o", type=str,
+        help=f"Path to the SQLite database file. Defaults to {DEFAULT_SQLITE_FILE}.",
+        default=DEFAULT_SQLITE_FILE, required=False)
+    PARSER.add_argument(
+        "--overwrite", action="store_true",
+        help="Overwrite users that already exist in the SQLite database.")
+    ARGS = PARSER.parse_args()
+
+    migrate_users(ARGS.o, ARGS.overwrite)
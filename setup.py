@@ -74,6 +74,10 @@ if __name__ == "__main__":
         users_directory, "banned_users.yaml")
     with open(banned_users_yaml_file, "w") as file:
         file.writelines([""])
+    banned_users_log_file = os.path.join(
+        users_directory, "banned_users.log")
+    if os.path.isfile(banned_users_log_file):
+        os.remove(banned_users_log_file)
     # ------------------------------------- - ------------------------------------ #
 
     # ---------------------------- Creating python env --------------------------- #
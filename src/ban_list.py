@@ -0,0 +1,215 @@
+import os
+import json
+import time
+import datetime
+import threading
+from typing import (Iterator, List, Optional, Set)
+
+from utils import utils
+
+DEFAULT_BAN_LIST_FILE = os.path.join("users", "banned_users.yaml")
+DEFAULT_BAN_LOG_FILE = os.path.join("users", "banned_users.log")
+
+
+class BanList():
+    """
+    This object represents the set of banned chatids.
+
+    The ban list is made of the compacted list of banned chatids (`banned_users.yaml`) and an \
+        append-only log of the bans / unbans made since (one JSON line per change). Banning or \
+        unbanning a user only appends a line to the log, which is folded back into the list \
+        every `compact_every` changes and when the ban list is closed.
+
+    ---
+
+    Parameters:
+        - ban_list_file (:obj:`str`): Optional. Path to the list of banned chatids. \
+            Defaults to `users/banned_users.yaml`.
+        - ban_log_file (:obj:`str`): Optional. Path to the log of bans / unbans. \
+            Defaults to `users/banned_users.log`.
+        - compact_every (:obj:`int`): Optional. Number of logged changes after which the log is \
+            compacted. Defaults to 100.
+        - refresh_interval (:obj:`float`): Optional. Minimum number of seconds between two checks \
+            for changes made by other processes. Defaults to 1 second.
+        - logger (:class:`Log`): Optional. Logging object to report read/write errors to.
+
+    ---
+
+    Notes:
+        Both files are reloaded if their mtime changed since they were last read or written by this \
+            object, so edits made by other processes (e.g `scripts/ban_all_users.py` or editing \
+            `banned_users.yaml` by hand) are picked up without re-reading them on every check.
+
+        Membership checks are O(1):
+
+            >>> ban_list = BanList()
+                ban_list.ban("CHATID")
+                "CHATID" in ban_list # True
+
+    ---
+
+    Attributes:
+        - chatids (:class:`Set[str]`): The banned chatids.
+        - logged_changes (:obj:`int`): Number of changes in the log since the last compaction.
+    """
+
+    def __init__(self, ban_list_file: str = DEFAULT_BAN_LIST_FILE,
+                 ban_log_file: str = DEFAULT_BAN_LOG_FILE,
+                 compact_every: int = 100,
+                 refresh_interval: float = 1.0,
+                 logger=utils.DEFAULT_LOG):
+        self.ban_list_file = ban_list_file
+        self.ban_log_file = ban_log_file
+        self.compact_every = compact_every
+        self.refresh_interval = refresh_interval
+        self.logger = logger
+
+        self.lock = threading.RLock()
+        self.chatids: Set[str] = set()
+        self.logged_changes = 0
+        self.mtimes = (None, None)
+        self.checked_at = 0.0
+
+        self.__load()
+
+    @staticmethod
+    def mtime_of(file_path: str) -> Optional[float]:
+        return os.path.getmtime(file_path) if os.path.isfile(file_path) else None
+
+    def __current_mtimes(self):
+        return self.mtime_of(self.ban_list_file), self.mtime_of(self.ban_log_file)
+
+    def __load(self) -> None:
+        with self.lock:
+            banned_users = utils.load_yaml_file(
+                self.ban_list_file, self.logger) if os.path.isfile(self.ban_list_file) else False
+            if banned_users or isinstance(banned_users, List):
+                self.chatids = set(str(chatid) for chatid in banned_users)
+            else:
+                self.logger.warning("BAN_LIST_CORRUPTED_OR_MISSING",
+                                    "Creating and overwriting to an empty list.")
+                self.chatids = set()
+                utils.dump_to_yaml_file([], self.ban_list_file, self.logger)
+
+            self.logged_changes = 0
+            if os.path.isfile(self.ban_log_file):
+                with open(self.ban_log_file, 'r', encoding="utf-8") as stream:
+                    for line_number, line in enumerate(stream, 1):
+                        if not line.strip():
+                            continue
+                        try:
+                            change = json.loads(line)
+                        except ValueError:
+                            self.logger.error("BAN_LOG_CORRUPTED_LINE",
+                                              f"Skipping unreadable line {line_number} of {self.ban_log_file}.")
+                            continue
+
+                        if change["action"] == "ban":
+                            self.chatids.add(change["chatid"])
+                        else:
+                            self.chatids.discard(change["chatid"])
+                        self.logged_changes += 1
+
+            self.mtimes = self.__current_mtimes()
+            self.checked_at = time.monotonic()
+
+    def refresh(self, force: bool = False) -> bool:
+        """
+        Reloads the ban list if it was changed by another process.
+
+        Unless `force` is set, this only checks the files once every `refresh_interval` seconds.
+
+        ---
+
+        Returns:
+            (:obj:`bool`): Returns whether the ban list was reloaded.
+        """
+
+        if not force and time.monotonic() - self.checked_at < self.refresh_interval:
+            return False
+
+        with self.lock:
+            self.checked_at = time.monotonic()
+            if self.__current_mtimes() == self.mtimes:
+                return False
+
+            self.__load()
+        self.logger.info("BAN_LIST_RELOADED",
+                         f"Ban list was changed externally, {len(self.chatids)} users are banned.")
+        return True
+
+    def __contains__(self, chatid: str) -> bool:
+        self.refresh()
+        return chatid in self.chatids
+
+    def __iter__(self) -> Iterator[str]:
+        self.refresh()
+        return iter(list(self.chatids))
+
+    def __len__(self) -> int:
+        self.refresh()
+        return len(self.chatids)
+
+    def __log_change(self, action: str, chatid: str) -> None:
+        with open(self.ban_log_file, 'a', encoding="utf-8") as stream:
+            stream.write(json.dumps({
+                "ts": datetime.datetime.now().isoformat(),
+                "action": action,
+                "chatid": chatid
+            }) + "\n")
+        self.logged_changes += 1
+        self.mtimes = self.__current_mtimes()
+
+        if self.logged_changes >= self.compact_every:
+            self.compact()
+
+    def ban(self, chatid: str) -> bool:
+        """
+        Bans a chatid.
+
+        Returns whether the chatid was not already banned.
+        """
+
+        with self.lock:
+            self.refresh(force=True)
+            if chatid in self.chatids:
+                return False
+
+            self.chatids.add(chatid)
+            self.__log_change("ban", chatid)
+            return True
+
+    def unban(self, chatid: str) -> bool:
+        """
+        Unbans a chatid.
+
+        Returns whether the chatid was banned.
+        """
+
+        with self.lock:
+            self.refresh(force=True)
+            if chatid not in self.chatids:
+                return False
+
+            self.chatids.discard(chatid)
+            self.__log_change("unban", chatid)
+            return True
+
+    def compact(self) -> None:
+        """
+        Writes the banned chatids to the ban list file and empties the log.
+        """
+
+        with self.lock:
+            if not utils.dump_to_yaml_file(sorted(self.chatids), self.ban_list_file, self.logger):
+                return
+
+            utils.remove_files([self.ban_log_file], self.logger)
+            self.logged_changes = 0
+            self.mtimes = self.__current_mtimes()
+
+    def close(self) -> None:
+        with self.lock:
+            self.refresh(force=True)
+            if self.logged_changes:
+                self.compact()
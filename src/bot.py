@@ -1,13 +1,21 @@
+import secrets
+import threading
 from typing import (Any, Callable, Dict, List, Union, Optional)
+from urllib.parse import urlparse
 
 import telegram
 from telegram import (CallbackQuery, ParseMode, ReplyMarkup, Update)
 from telegram.ext import (Updater, CommandHandler, ConversationHandler,
-                          CallbackQueryHandler, MessageHandler, CallbackContext)
+                          CallbackQueryHandler, MessageHandler,
+                          CallbackContext, Job)
 
 from constants import USERSTATE
 from user import (UserManager, User)
-from utils.log import Log
+from utils.log import (Log, Lazy)
+from chat_scheduler import ChatScheduler
+from outbound import (OutboundScheduler, PRIORITY_CALLBACK_ANSWER, PRIORITY_MESSAGE, DEFAULT_STOP_TIMEOUT,
+                      call_with_fallback)
+from webhook import (WebhookServer, wait_for_stop_signal)
 from stage import (Stage, LetUserChoose, GetInputFromUser,
                    GetInfoFromUser, EndConversation)
 
@@ -57,6 +65,12 @@ class Bot(object):
             provides a frontend to python-telegram-bot.
         - dispatcher (:class:`Dispatcher`): Dispatcher object from python-telegram-bot \
             that dispatches updates to its registered handlers.
+        - scheduler (:class:`ChatScheduler`): Runs the handlers of the conversation on a pool \
+            of workers, in order for each chat.
+        - outbound (:class:`OutboundScheduler`|:obj:`None`): Sends messages within Telegram's rate \
+            limits if enabled (`OUTBOUND:ENABLED`), else None (@Bot.send).
+        - jobs_lock (:class:`threading.Lock`): Guards the jobs of users (`context.user_data["jobs"]`) \
+            scheduled with @Bot.run_repeating.
 
         - command_handlers (:class:`Dict[str, CommandHandler]`): Dict of command handlers \
             registered as entry-points for the ConversationHandler.
@@ -277,7 +291,7 @@ class Bot(object):
 
         if next_stage and user and (not user.is_banned or next_stage_id == self.end_stage.stage_id):
             user.logger.info("PROCEED_NEXT_STAGE",
-                             f"User:{user.chatid} is moving on from: {current_stage_id} to: {next_stage_id}")
+                             Lazy("User:{} is moving on from: {} to: {}".format, user.chatid, current_stage_id, next_stage_id))
             return next_stage.stage_entry(update, context)
         else:
             if not user:
@@ -286,7 +300,7 @@ class Bot(object):
                 pass
             elif not next_stage:
                 user.logger.error("NEXT_STAGE_MISSING",
-                                  f"User:{user.chatid} is proceeding to unknown next stage: {next_stage_id}. Current stage: {current_stage_id}")
+                                  Lazy("User:{} is proceeding to unknown next stage: {}. Current stage: {}".format, user.chatid, next_stage_id, current_stage_id))
 
                 self.edit_or_reply_message(
                     update, context,
@@ -346,26 +360,9 @@ class Bot(object):
         """
 
         user: User = context.user_data.get("user")
+        chatid = user.chatid if user else str(update.effective_chat.id if update.effective_chat else None)
 
-        try:
-            if update.callback_query and not reply_message:
-                update.callback_query.message.edit_text(
-                    text=text,
-                    reply_markup=reply_markup,
-                    parse_mode=parse_mode,
-                    disable_web_page_preview=True
-                )
-            elif update.message:
-                update.message.reply_text(
-                    text=text,
-                    reply_markup=reply_markup,
-                    parse_mode=parse_mode,
-                    disable_web_page_preview=True
-                )
-            else:
-                raise Exception(
-                    "Unknown message type, defaulting to normal message (implemenetating below)")
-        except:
+        def send_message() -> None:
             if user:
                 context.bot.send_message(user.chatid, text,
                                          reply_markup=reply_markup,
@@ -374,6 +371,156 @@ class Bot(object):
                 self.logger.error("UNKNOWN_TARGET_USER",
                                   "Unknown user to reply message to.")
 
+        if update.callback_query and not reply_message:
+            message = update.callback_query.message
+            self.send(chatid, lambda: message.edit_text(
+                text=text,
+                reply_markup=reply_markup,
+                parse_mode=parse_mode,
+                disable_web_page_preview=True
+            ), fallback=send_message)
+        elif update.message:
+            self.send(chatid, lambda: update.message.reply_text(
+                text=text,
+                reply_markup=reply_markup,
+                parse_mode=parse_mode,
+                disable_web_page_preview=True
+            ), fallback=send_message)
+        else:
+            # Unknown message type, defaulting to normal message
+            self.send(chatid, send_message)
+
+    def send(self, chatid: str, send: Callable[[], Any],
+             priority: int = PRIORITY_MESSAGE,
+             fallback: Optional[Callable[[], Any]] = None) -> None:
+        """
+        Helper function to make an outbound call to Telegram (send / edit a message, answer a callback query, ...).
+
+        ---
+
+        Parameters:
+            - chatid (:obj:`str`): Chatid of the chat the call is made to.
+            - send (:class:`Callable`): Function that makes the call.
+            - priority (:obj:`int`): Optional. `PRIORITY_CALLBACK_ANSWER` or `PRIORITY_MESSAGE` (from \
+                outbound.py). Defaults to `PRIORITY_MESSAGE`.
+            - fallback (:class:`Callable`): Optional. Function called instead if the call fails.
+
+        ---
+
+        Returns:
+            (:obj:`None`)
+
+        ---
+
+        Notes:
+            If `OUTBOUND:ENABLED` is set, the call is queued and made later by `Bot.outbound` \
+                within Telegram's rate limits, so the return value of the call is not available. \
+                Otherwise it is made right away.
+
+        ---
+
+        Example:
+            >>> self.bot.send(user.chatid, lambda: query.message.edit_reply_markup())
+        """
+
+        if self.outbound:
+            self.outbound.submit(chatid, send, priority, fallback)
+        else:
+            call_with_fallback(send, fallback, self.logger)
+
+    def run_repeating(self,
+                      update: Update, context: CallbackContext,
+                      callback: Callable[[Update, CallbackContext, Job], None],
+                      interval: float,
+                      state: USERSTATE,
+                      first: Optional[float] = None) -> Job:
+        """
+        Helper function to call `callback` every `interval` seconds on behalf of the user of `update`, \
+            without holding a worker thread in between (e.g countdowns).
+
+        ---
+
+        Parameters:
+            - update (:class:`Update`): Update passed from the caller function.
+            - context (:class:`CallbackContext`): Context passed from the caller function.
+            - callback (:class:`Callable[[Update, CallbackContext, Job], None]`): Function called with \
+                `update`, `context` and the job.
+            - interval (:obj:`float`): Number of seconds between two calls.
+            - state (:class:`USERSTATE`): State of the conversation that the job belongs to (the state \
+                returned by the caller function).
+            - first (:obj:`float`): Optional. Number of seconds before the first call. Defaults to `interval`.
+
+        ---
+
+        Returns:
+            (:class:`Job`): The scheduled job, stop it with @Bot.remove_job.
+
+        ---
+
+        Notes:
+            Calls are run by `Bot.scheduler` in order with the updates of the chat, so `callback` \
+                can edit the message of `update` like a handler would. The User in `context.user_data` \
+                is refreshed (@Bot.refresh_user) before each call, as it may have been evicted since.
+
+            The job is removed as soon as a handler of the user moves the conversation to another \
+                state (see @Bot.finish_handler), so `callback` is never called once the user has moved on. \
+                Handlers that keep the conversation in `state` (or that ignore the update) leave it running.
+
+        ---
+
+        Example:
+            >>> def tick(update: Update, context: CallbackContext, job: Job) -> None:
+                    ...
+                    bot.remove_job(context, job)
+
+                bot.run_repeating(update, context, tick, interval=1, state=self.SOME_STATE)
+                return self.SOME_STATE
+        """
+
+        chat = ChatScheduler.chat_of(update)
+
+        def run_callback(job: Job) -> None:
+            # The user may have moved on while this call was queued
+            if not job.removed:
+                # Not called through the conversation, so the scheduler does not refresh the user
+                self.refresh_user(update, context)
+                callback(update, context, job)
+
+        with self.jobs_lock:
+            job = self.updater.job_queue.run_repeating(
+                lambda job_context: self.scheduler.submit(
+                    chat, lambda: run_callback(job_context.job)),
+                interval=interval,
+                first=first,
+                context=state,
+                name=f"{getattr(callback, '__name__', 'job')}:{chat}"
+            )
+            context.user_data.setdefault("jobs", []).append(job)
+        return job
+
+    def remove_job(self, context: CallbackContext, job: Job) -> None:
+        """
+        Helper function to stop a job scheduled with @Bot.run_repeating.
+
+        ---
+
+        Parameters:
+            - context (:class:`CallbackContext`): Context passed to the job's callback.
+            - job (:class:`Job`): The job to stop.
+
+        ---
+
+        Returns:
+            (:obj:`None`)
+        """
+
+        with self.jobs_lock:
+            if not job.removed:
+                job.schedule_removal()
+            jobs: List[Job] = context.user_data.get("jobs", [])
+            if job in jobs:
+                jobs.remove(job)
+
     def let_user_choose(self,
                         stage_id: str,
                         choice_text: str,
@@ -725,8 +872,8 @@ class Bot(object):
         if update.message and update.message.text:
             chatid = str(update.message.chat_id)
 
-            cached_user: User = context.user_data.get("user")
-            user: User = cached_user or self.user_manager.new_user(chatid)
+            # Always goes through UserManager as the cached user may have been evicted
+            user: User = self.user_manager.new_user(chatid)
 
             if user:
                 context.user_data.clear()
@@ -748,6 +895,59 @@ class Bot(object):
             self.logger.error("USER_MESSAGE_INVALID",
                               f"Unknown user has entered a message with no valid update")
 
+    def refresh_user(self, update: Update, context: CallbackContext) -> None:
+        """
+        Keeps the User cached in `context.user_data` resident.
+
+        Called by `Bot.scheduler` on the worker thread right before each handler of the conversation \
+            (and each call of @Bot.run_repeating), so that loading an evicted user never holds up the \
+            dispatcher. Marks the user as recently \
+            used and replaces the cached User if it has been evicted since (`USERS:MAX_RESIDENT`).
+
+        ---
+
+        Parameters:
+            - update (:class:`Update`): Incoming update.
+            - context (:class:`CallbackContext`): CallbackContext for the update.
+
+        ---
+
+        Returns:
+            (:obj:`None`)
+        """
+
+        cached_user: Union[User, None] = context.user_data.get("user")
+        if cached_user:
+            context.user_data.update(
+                {"user": self.user_manager.new_user(cached_user.chatid)})
+
+    def finish_handler(self, state: USERSTATE, update: Update, context: CallbackContext) -> None:
+        """
+        Removes the jobs of the user (@Bot.run_repeating) that belong to another state than the one \
+            the conversation is now in.
+
+        Called by `Bot.scheduler` on the worker thread right after each handler of the conversation.
+
+        ---
+
+        Parameters:
+            - state (:class:`USERSTATE`): State returned by the handler (None if the state is unchanged).
+            - update (:class:`Update`): Incoming update.
+            - context (:class:`CallbackContext`): CallbackContext for the update.
+
+        ---
+
+        Returns:
+            (:obj:`None`)
+        """
+
+        if state is None:
+            return
+
+        for job in list(context.user_data.get("jobs", [])):
+            if job.context != state:
+                self.remove_job(context, job)
+
     def add_command_handler(self, command: str,
                             callback: Callable[[Update, CallbackContext], USERSTATE],
                             add_as_fallback: Optional[bool] = False,
@@ -918,8 +1118,88 @@ class Bot(object):
         self.logger.info(False, "Bot is now listening!")
         self.logger.info(False, '-')
 
-        self.updater.start_polling(drop_pending_updates=live_mode)
-        self.updater.idle()
+        webhook_config: Dict[str, Any] = self.config.get("WEBHOOK") or {}
+        try:
+            if webhook_config.get("ENABLED", False):
+                self.__run_webhook(webhook_config, drop_pending_updates=live_mode)
+            else:
+                self.updater.start_polling(drop_pending_updates=live_mode)
+                self.updater.idle()
+        finally:
+            # Pending saves are still written if the bot fails to start (e.g the webhook cannot be set)
+            self.scheduler.shutdown()
+            if self.outbound:
+                self.outbound.stop(self.outbound_stop_timeout)
+            self.user_manager.quit()
+
+    def __run_webhook(self, webhook_config: Dict[str, Any], drop_pending_updates: bool = False) -> None:
+        """
+        Internal private function to receive updates through a webhook (`WEBHOOK` in config.yaml) \
+            until the process is stopped, instead of polling for them.
+
+        ---
+
+        Parameters:
+            - webhook_config (:class:`Dict[str, Any]`): The `WEBHOOK` section of config.yaml.
+            - drop_pending_updates (:obj:`bool`): Optional. Whether to drop the updates sent while \
+                the bot was offline. Defaults to False.
+
+        ---
+
+        Returns:
+            (:obj:`None`)
+
+        ---
+
+        Notes:
+            Telegram is told to post updates to `WEBHOOK:URL`, which must reach the embedded server \
+                listening on `WEBHOOK:LISTEN`:`WEBHOOK:PORT` (usually through a reverse proxy that \
+                terminates TLS).
+
+            If no `WEBHOOK:SECRET_TOKEN` is configured, a random one is generated on every start.
+        """
+
+        url: str = webhook_config["URL"]
+        workers: int = webhook_config.get("WORKERS", 4)
+        secret_token: str = webhook_config.get(
+            "SECRET_TOKEN") or secrets.token_urlsafe(32)
+
+        server = WebhookServer(
+            listen=webhook_config.get("LISTEN", "0.0.0.0"),
+            port=webhook_config.get("PORT", 8443),
+            url_path=webhook_config.get("PATH") or urlparse(url).path or "/",
+            secret_token=secret_token,
+            update_queue=self.dispatcher.update_queue,
+            bot=self.updater.bot,
+            workers=workers,
+            logger=self.logger
+        )
+
+        dispatcher_thread = threading.Thread(
+            target=self.dispatcher.start, name="dispatcher")
+        dispatcher_thread.start()
+        if self.updater.job_queue:
+            self.updater.job_queue.start()
+        server.start()
+
+        # Everything started above is stopped even if the webhook fails to be set, else the
+        # dispatcher thread would keep the process alive
+        try:
+            self.updater.bot.set_webhook(
+                url=url,
+                max_connections=workers,
+                drop_pending_updates=drop_pending_updates,
+                api_kwargs={"secret_token": secret_token}
+            )
+
+            wait_for_stop_signal()
+        finally:
+            self.logger.info(False, "Stopping webhook...")
+            server.stop()
+            if self.updater.job_queue:
+                self.updater.job_queue.stop()
+            self.dispatcher.stop()
+            dispatcher_thread.join()
 
     def init(self, token: str, logger: Log, config: Dict[str, Any]) -> None:
         """
@@ -961,7 +1241,8 @@ class Bot(object):
         self.logger: Log = logger
         self.token: str = token
 
-        updater = Updater(token)
+        # BOT:API_URL points the bot to another Bot API server (e.g scripts/fake_telegram_server.py)
+        updater = Updater(token, base_url=config["BOT"].get("API_URL"))
         dispatcher = updater.dispatcher
 
         self.stages: Dict[str, Stage] = {}
@@ -999,6 +1280,34 @@ class Bot(object):
 
         self.behavior_remove_inline_markup = self.bot_config["REMOVE_INLINE_KEYBOARD_MARKUP"]
 
+        # Handlers of each chat run in order, different chats in parallel
+        scheduler_config: Dict[str, Any] = config.get("SCHEDULER") or {}
+        self.scheduler = ChatScheduler(
+            workers=scheduler_config.get("WORKERS", 4),
+            max_pending=scheduler_config.get("MAX_PENDING", 1000),
+            max_pending_per_chat=scheduler_config.get(
+                "MAX_PENDING_PER_CHAT", 10),
+            stats_interval=scheduler_config.get("STATS_INTERVAL", 60.0),
+            logger=logger)
+        self.scheduler.attach(dispatcher, prepare=self.refresh_user,
+                              finish=self.finish_handler)
+        # Guards the jobs of users (Bot.run_repeating) between the job queue and the handlers
+        self.jobs_lock = threading.Lock()
+
+        # Messages are sent from background threads within Telegram's rate limits if enabled
+        outbound_config: Dict[str, Any] = config.get("OUTBOUND") or {}
+        self.outbound: Optional[OutboundScheduler] = OutboundScheduler(
+            senders=outbound_config.get("SENDERS", 4),
+            global_rate=outbound_config.get("GLOBAL_RATE", 25.0),
+            global_burst=outbound_config.get("GLOBAL_BURST", 30.0),
+            chat_rate=outbound_config.get("CHAT_RATE", 1.0),
+            chat_burst=outbound_config.get("CHAT_BURST", 3.0),
+            max_jitter=outbound_config.get("MAX_JITTER", 1.0),
+            logger=logger
+        ) if outbound_config.get("ENABLED", False) else None
+        self.outbound_stop_timeout: float = outbound_config.get(
+            "STOP_TIMEOUT", DEFAULT_STOP_TIMEOUT)
+
         answer_query = telegram.CallbackQuery.answer
 
         def override_answer(query: CallbackQuery,
@@ -1006,24 +1315,22 @@ class Bot(object):
                             do_nothing: bool = False,
                             *args) -> None:
             chatid = str(query.message.chat_id)
-            user: User = self.user_manager.users.get(chatid)
+            # Answered from handlers, on a worker thread where the user was just resolved (@Bot.refresh_user)
+            user: User = self.user_manager.new_user(chatid)
             if query.id not in user.answered_callback_queries:
-                if self.behavior_remove_inline_markup:
-                    try:
-                        if not do_nothing:
-                            if keep_message:
-                                if keep_message is True:
-                                    query.message.edit_reply_markup()
-                                else:
-                                    query.message.edit_text(keep_message)
-                            else:
-                                if keep_message == "":
-                                    query.message.delete()
-                                else:
-                                    query.message.edit_text("💭 Loading...")
-                    except Exception as e:
-                        self.logger.error(False, e)
-                answer_query(query, *args)
+                if self.behavior_remove_inline_markup and not do_nothing:
+                    if keep_message:
+                        if keep_message is True:
+                            self.send(chatid, lambda: query.message.edit_reply_markup())
+                        else:
+                            self.send(chatid, lambda: query.message.edit_text(keep_message))
+                    else:
+                        if keep_message == "":
+                            self.send(chatid, lambda: query.message.delete())
+                        else:
+                            self.send(chatid, lambda: query.message.edit_text("💭 Loading..."))
+                self.send(chatid, lambda: answer_query(query, *args),
+                          priority=PRIORITY_CALLBACK_ANSWER)
                 user.answered_callback_queries.append(query.id)
         telegram.CallbackQuery.answer = override_answer
 
@@ -0,0 +1,239 @@
+import string
+from typing import (Any, Callable, Dict, List, Optional, Tuple)
+
+from telegram import Update
+from telegram.ext import (CallbackQueryHandler, CallbackContext, Dispatcher)
+
+from constants import USERSTATE
+
+# Telegram rejects inline buttons with more than 64 bytes of callback_data
+MAX_CALLBACK_DATA_BYTES = 64
+
+# Every character of encoded callback_data is one of these (one byte each)
+ALPHABET = string.ascii_uppercase + string.ascii_lowercase + string.digits + "-_"
+ALPHABET_INDEX = {character: value for value, character in enumerate(ALPHABET)}
+
+ROUTE_CODE_LENGTH = 2  # up to 4096 routes
+MAX_ARG_DIGITS = 6  # args from 0 to 64**6 - 1
+
+
+def encode_int(value: int, width: int = 0) -> str:
+    digits = ""
+    while value or not digits:
+        value, digit = divmod(value, len(ALPHABET))
+        digits = ALPHABET[digit] + digits
+    return digits.rjust(width, ALPHABET[0])
+
+
+def decode_int(digits: str) -> int:
+    value = 0
+    for character in digits:
+        value = value * len(ALPHABET) + ALPHABET_INDEX[character]
+    return value
+
+
+class CallbackCodec:
+    """
+    This object encodes the (stage_id, action, args) of inline buttons into compact callback_data.
+
+    Each (stage_id, action) is registered once and interned as a 2 character route code, and \
+        each arg (a non-negative int) is packed as one length character followed by its base 64 \
+        digits:
+
+        >>> codec.register("ctf", "view_hint", 2)   # "AB"
+            codec.encode("ctf", "view_hint", 3, 0)  # "AB" + "BD" + "BA" = "ABBDBA"
+            codec.decode("ABBDBA")                  # ("AB", [3, 0])
+
+    ---
+
+    Notes:
+        Registering a route raises ValueError if its callback_data could exceed 64 bytes, so long \
+            stage ids or actions can never produce buttons that Telegram rejects.
+
+        Route codes are given in registration order, so buttons sent before a restart still decode \
+            to the same route as long as the stages are set up in the same order.
+    """
+
+    def __init__(self):
+        self.codes: Dict[Tuple[str, str], str] = {}
+        # route code -> (stage_id, action, number of args)
+        self.routes: Dict[str, Tuple[str, str, int]] = {}
+
+    def register(self, stage_id: str, action: str, number_of_args: int = 0) -> str:
+        """
+        Registers a route (if not registered yet) and returns its code.
+        """
+
+        code = self.codes.get((stage_id, action))
+        if code is not None:
+            if self.routes[code][2] != number_of_args:
+                raise ValueError(
+                    f"{stage_id}:{action} is already registered with {self.routes[code][2]} args.")
+            return code
+
+        max_size = ROUTE_CODE_LENGTH + number_of_args * (1 + MAX_ARG_DIGITS)
+        if max_size > MAX_CALLBACK_DATA_BYTES:
+            raise ValueError(
+                f"{stage_id}:{action} has too many args, its callback_data could be {max_size} bytes "
+                f"(max {MAX_CALLBACK_DATA_BYTES}).")
+        if len(self.routes) >= len(ALPHABET) ** ROUTE_CODE_LENGTH:
+            raise ValueError("Too many callback routes registered.")
+
+        code = encode_int(len(self.routes), ROUTE_CODE_LENGTH)
+        self.codes[(stage_id, action)] = code
+        self.routes[code] = (stage_id, action, number_of_args)
+        return code
+
+    def encode(self, stage_id: str, action: str, *args: int) -> str:
+        code = self.codes.get((stage_id, action))
+        if code is None:
+            raise KeyError(f"{stage_id}:{action} is not a registered callback route.")
+        if len(args) != self.routes[code][2]:
+            raise ValueError(
+                f"{stage_id}:{action} takes {self.routes[code][2]} args, got {len(args)}.")
+
+        data = code
+        for arg in args:
+            if not 0 <= arg < len(ALPHABET) ** MAX_ARG_DIGITS:
+                raise ValueError(f"{stage_id}:{action} arg {arg} is out of range.")
+            digits = encode_int(arg)
+            data += ALPHABET[len(digits)] + digits
+        return data
+
+    def decode(self, data: Optional[str]) -> Optional[Tuple[str, List[int]]]:
+        """
+        Returns the (route code, args) of callback_data, or None if it is not valid callback_data \
+            of a registered route.
+        """
+
+        if not data or data[:ROUTE_CODE_LENGTH] not in self.routes:
+            return None
+
+        code = data[:ROUTE_CODE_LENGTH]
+        args = []
+        position = ROUTE_CODE_LENGTH
+        try:
+            while position < len(data):
+                length = ALPHABET_INDEX[data[position]]
+                digits = data[position + 1:position + 1 + length]
+                if not 0 < length == len(digits):
+                    return None
+                args.append(decode_int(digits))
+                position += 1 + length
+        except KeyError:
+            return None
+
+        if len(args) != self.routes[code][2]:
+            return None
+        return code, args
+
+
+# Shared by every stage so that route codes are unique across stages
+CODEC = CallbackCodec()
+
+
+def callback_data(stage_id: str, action: str, *args: int) -> str:
+    """
+    Builds the callback_data of an inline button that is handled by a `CallbackRouter`.
+
+    The route has to be registered first (@CallbackRouter.add) and args are non-negative ints.
+
+    ---
+
+    Example:
+        >>> InlineKeyboardButton("Hint 1", callback_data=callback_data("ctf", "view_hint", 3, 0))
+    """
+
+    return CODEC.encode(stage_id, action, *args)
+
+
+class CallbackRouter(CallbackQueryHandler):
+    """
+    Single CallbackQueryHandler that dispatches callback queries to the callback registered for \
+        their action.
+
+    `callback_data` (see @callback_data and `CallbackCodec`) is decoded once into (route, args) and \
+        the callback is looked up in a dict, so the cost of dispatching a callback query does not \
+        depend on the number of buttons (unlike one CallbackQueryHandler with a regex per button).
+
+    ---
+
+    Notes:
+        The args of the callback_data are converted with the `arg_types` of the route and passed \
+            to the callback in `context.args`. Callback queries whose stage and action are not \
+            registered, that have the wrong number of args or args that fail to convert (raise \
+            ValueError / IndexError) are not handled by the router.
+
+        >>> router = CallbackRouter()
+            router.add("ctf", "view_challenge", self.view_challenge, int)
+
+            def view_challenge(self, update: Update, context: CallbackContext) -> USERSTATE:
+                (challenge_number,) = context.args
+    """
+
+    def __init__(self):
+        super().__init__(self.dispatch)
+        # route code -> (callback, arg_types)
+        self.routes: Dict[str,
+                          Tuple[Callable[[Update, CallbackContext], USERSTATE], Tuple[Callable[[int], Any], ...]]] = {}
+
+    def add(self, stage_id: str, action: str,
+            callback: Callable[[Update, CallbackContext], USERSTATE],
+            *arg_types: Callable[[int], Any]) -> "CallbackRouter":
+        """
+        Routes the callback queries with callback_data built by `callback_data(stage_id, action, *args)` \
+            to `callback`.
+
+        The route takes one int arg per function in `arg_types`, which converts (or validates) it \
+            before it is passed to the callback (e.g `int`).
+        """
+
+        code = CODEC.register(stage_id, action, len(arg_types))
+        self.routes[code] = (callback, arg_types)
+        return self
+
+    def route(self, data: Optional[str]) -> Optional[Tuple[Callable, List[Any]]]:
+        decoded = CODEC.decode(data)
+        if decoded is None:
+            return None
+
+        code, args = decoded
+        route = self.routes.get(code)
+        if route is None:
+            return None
+
+        callback, arg_types = route
+
+        try:
+            return callback, [arg_type(arg) for arg_type, arg in zip(arg_types, args)]
+        except (ValueError, IndexError):
+            return None
+
+    def check_update(self, update: object) -> Optional[Tuple[Callable, List[Any]]]:
+        if isinstance(update, Update) and update.callback_query:
+            return self.route(update.callback_query.data)
+        return None
+
+    def collect_additional_context(self, context: CallbackContext, update: Update,
+                                   dispatcher: Dispatcher, check_result: Tuple[Callable, List[Any]]) -> None:
+        context.args = check_result[1]
+
+    def handle_update(self, update: Update, dispatcher: Dispatcher,
+                      check_result: Tuple[Callable, List[Any]], context: CallbackContext = None) -> Any:
+        callback, _ = check_result
+        self.collect_additional_context(context, update, dispatcher, check_result)
+
+        if self.run_async:
+            return dispatcher.run_async(callback, update, context, update=update)
+        return callback(update, context)
+
+    def dispatch(self, update: Update, context: CallbackContext) -> USERSTATE:
+        """
+        Calls the callback routed to by the callback query of `update` (if any).
+        """
+
+        check_result = self.route(update.callback_query.data)
+        if check_result:
+            callback, context.args = check_result
+            return callback(update, context)
+        return None
@@ -0,0 +1,268 @@
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import (Any, Callable, Deque, Dict, Hashable, Optional, Tuple)
+
+from telegram import Update
+from telegram.ext import (Dispatcher, DispatcherHandlerStop)
+from telegram.ext.utils.promise import Promise
+
+from utils import utils
+
+
+class ChatScheduler:
+    """
+    This object runs the handlers of updates on a bounded pool of worker threads, one function at a \
+        time per chat.
+
+    Updates of different chats run in parallel, while the functions submitted for a chat (its handler \
+        and the scheduled calls of its stages) run one at a time in the order they were submitted, so \
+        two of them never race on the `user.data` of a user. It bounds concurrency, it does not queue \
+        updates: see the notes below.
+
+    ---
+
+    Parameters:
+        - workers (:obj:`int`): Optional. Number of worker threads. Defaults to 4.
+        - max_pending (:obj:`int`): Optional. Maximum number of queued and running updates. Once \
+            reached, submitting an update blocks (the bot stops fetching updates) until a worker \
+            is done. Defaults to 1000.
+        - max_pending_per_chat (:obj:`int`): Optional. Maximum number of functions waiting behind the \
+            running function of a chat. Further functions of that chat are dropped. Defaults to 10.
+        - stats_interval (:obj:`float`): Optional. Minimum number of seconds between two \
+            `SCHEDULER_STATS` logs (0 disables them). Defaults to 60 seconds.
+        - logger (:class:`Log`): Optional. Logging object to report stats, drops and errors to.
+
+    ---
+
+    Notes:
+        `Bot` replaces the `run_async` of its dispatcher with @ChatScheduler.run_async, so the \
+            conversation handler (`run_async=True`) schedules its callbacks here instead of the \
+            dispatcher's shared thread pool:
+
+            >>> scheduler = ChatScheduler(workers=8)
+                scheduler.attach(dispatcher)
+                # ...
+                scheduler.shutdown()
+
+        The conversation handler itself drops the updates of a chat that arrive while its previous \
+            update is still pending (there are no `ConversationHandler.WAITING` handlers), so a user who \
+            double-taps a button only has the first tap handled, the second one is never queued nor \
+            handled later. The functions that do wait behind the handler of a chat are the calls \
+            scheduled for it (@Bot.run_repeating), and the handler of its next update waits behind them.
+
+        Updates without a chat (e.g inline queries) are not ordered.
+
+    ---
+
+    Attributes:
+        - pending (:obj:`int`): Number of queued and running updates.
+        - dropped (:obj:`int`): Number of functions dropped as their chat had too many queued.
+        - wait_time_avg (:obj:`float`): Moving average of the seconds updates waited before running.
+        - wait_time_max (:obj:`float`): Longest wait (in seconds) since the last stats log.
+    """
+
+    def __init__(self, workers: int = 4,
+                 max_pending: int = 1000,
+                 max_pending_per_chat: int = 10,
+                 stats_interval: float = 60.0,
+                 logger=utils.DEFAULT_LOG):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.max_pending_per_chat = max_pending_per_chat
+        self.stats_interval = stats_interval
+        self.logger = logger
+
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="ChatScheduler")
+        self.dispatcher: Optional[Dispatcher] = None
+        self.prepare: Optional[Callable[..., Any]] = None
+        self.finish: Optional[Callable[..., Any]] = None
+
+        self.condition = threading.Condition()
+        # chat -> updates waiting behind the running update of that chat (chats with nothing
+        # running are not in the dict)
+        self.chat_queues: Dict[Hashable, Deque[Tuple[float, Callable[[], Any]]]] = {}
+        self.pending = 0
+        self.dropped = 0
+        self.saturated = False
+
+        self.wait_time_avg = 0.0
+        self.wait_time_max = 0.0
+        self.stats_logged_at = time.monotonic()
+
+    def attach(self, dispatcher: Dispatcher,
+               prepare: Optional[Callable[..., Any]] = None,
+               finish: Optional[Callable[..., Any]] = None) -> None:
+        """
+        Runs the asynchronous handlers of `dispatcher` (`run_async=True`) on this scheduler.
+
+        If given, `prepare` is called with the arguments of each handler (`update, context`) on the \
+            worker thread, right before the handler runs. `finish` is called right after a handler \
+            returns, with its result followed by its arguments (`state, update, context`).
+        """
+
+        self.dispatcher = dispatcher
+        self.prepare = prepare
+        self.finish = finish
+        dispatcher.run_async = self.run_async
+
+    @staticmethod
+    def chat_of(update: Any) -> Optional[Hashable]:
+        if isinstance(update, Update) and update.effective_chat:
+            return update.effective_chat.id
+        return None
+
+    def submit(self, chat: Optional[Hashable], function: Callable[[], Any],
+               on_drop: Optional[Callable[[], Any]] = None) -> bool:
+        """
+        Queues `function` to run after the functions already submitted for `chat`.
+
+        Blocks while `max_pending` functions are queued or running.
+
+        ---
+
+        Returns:
+            (:obj:`bool`): Returns False if `function` was dropped (after calling `on_drop`) as \
+                `max_pending_per_chat` functions are already waiting for `chat`.
+        """
+
+        with self.condition:
+            chat_queue = self.chat_queues.get(chat)
+            if chat_queue is not None and len(chat_queue) >= self.max_pending_per_chat:
+                self.dropped += 1
+                dropped = True
+            else:
+                dropped = False
+
+                if self.pending >= self.max_pending and not self.saturated:
+                    self.saturated = True
+                    self.logger.warning("SCHEDULER_SATURATED",
+                                        f"{self.pending} updates are pending, waiting for the workers to catch up.")
+                while self.pending >= self.max_pending:
+                    self.condition.wait()
+                self.saturated = False
+
+                self.pending += 1
+                item = (time.monotonic(), function)
+                # chats may have been released while waiting for room
+                chat_queue = self.chat_queues.get(chat)
+                if chat is not None and chat_queue is not None:
+                    chat_queue.append(item)
+                else:
+                    if chat is not None:
+                        self.chat_queues[chat] = deque()
+                    self.executor.submit(self.__run, chat, item)
+
+        if dropped:
+            self.logger.info("SCHEDULER_DROPPED_UPDATE",
+                             f"Chat {chat} already has {self.max_pending_per_chat} updates queued.")
+            if on_drop:
+                on_drop()
+        return not dropped
+
+    def __run(self, chat: Optional[Hashable], item: Tuple[float, Callable[[], Any]]) -> None:
+        submitted_at, function = item
+        self.__record_wait(time.monotonic() - submitted_at)
+
+        try:
+            function()
+        except Exception as e:
+            self.logger.error("SCHEDULER_TASK_FAILED", f"Chat {chat}: {e}")
+
+        with self.condition:
+            self.pending -= 1
+            self.condition.notify_all()
+
+            if chat is not None:
+                chat_queue = self.chat_queues[chat]
+                if chat_queue:
+                    # Resubmitted rather than run in this thread so that other chats get a turn
+                    self.executor.submit(self.__run, chat, chat_queue.popleft())
+                else:
+                    del self.chat_queues[chat]
+
+        self.__log_stats_if_due()
+
+    def __record_wait(self, wait_time: float) -> None:
+        with self.condition:
+            self.wait_time_avg += (wait_time - self.wait_time_avg) * 0.1
+            self.wait_time_max = max(self.wait_time_max, wait_time)
+
+    def __log_stats_if_due(self) -> None:
+        if not self.stats_interval or time.monotonic() - self.stats_logged_at < self.stats_interval:
+            return
+
+        with self.condition:
+            if time.monotonic() - self.stats_logged_at < self.stats_interval:
+                return
+            self.stats_logged_at = time.monotonic()
+            self.log_stats()
+            self.wait_time_max = 0.0
+
+    def log_stats(self) -> None:
+        self.logger.info("SCHEDULER_STATS", ", ".join(
+            f"{key}: {value}" for key, value in self.stats().items()))
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns the current queue depth and wait times of the scheduler.
+        """
+
+        with self.condition:
+            return {
+                "workers": self.workers,
+                "pending": self.pending,
+                "busy_chats": len(self.chat_queues),
+                "queued": sum(len(chat_queue) for chat_queue in self.chat_queues.values()),
+                "dropped": self.dropped,
+                "wait_time_avg": round(self.wait_time_avg, 3),
+                "wait_time_max": round(self.wait_time_max, 3)
+            }
+
+    def run_async(self, func: Callable[..., Any], *args: Any, update: Any = None, **kwargs: Any) -> Promise:
+        """
+        Drop-in replacement of `Dispatcher.run_async` that schedules `func` by the chat of `update`.
+        """
+
+        promise = Promise(func, args, kwargs, update=update)
+        # An unresolved promise would keep the conversation of the chat in its previous state forever
+        self.submit(self.chat_of(update), lambda: self.__run_promise(promise),
+                    on_drop=promise.done.set)
+        return promise
+
+    def __run_promise(self, promise: Promise) -> None:
+        if self.prepare:
+            try:
+                self.prepare(*promise.args, **promise.kwargs)
+            except Exception as e:
+                self.logger.error("SCHEDULER_PREPARE_FAILED", f"Chat {self.chat_of(promise.update)}: {e}")
+        promise.run()
+        if not promise.exception:
+            if self.finish:
+                try:
+                    self.finish(promise.result(), *promise.args, **promise.kwargs)
+                except Exception as e:
+                    self.logger.error("SCHEDULER_FINISH_FAILED", f"Chat {self.chat_of(promise.update)}: {e}")
+            return
+
+        if isinstance(promise.exception, DispatcherHandlerStop):
+            self.logger.warning("SCHEDULER_HANDLER_STOP",
+                                "DispatcherHandlerStop is not supported with async handlers.")
+        elif self.dispatcher and self.dispatcher.error_handlers:
+            self.dispatcher.dispatch_error(
+                promise.update, promise.exception, promise=promise)
+        else:
+            self.logger.error("SCHEDULER_HANDLER_FAILED", promise.exception)
+
+    def shutdown(self) -> None:
+        """
+        Waits for the queued updates to be handled and stops the workers.
+        """
+
+        with self.condition:
+            while self.pending:
+                self.condition.wait()
+        self.executor.shutdown(wait=True)
+        self.log_stats()
@@ -0,0 +1,291 @@
+import os
+import json
+import time
+import threading
+from typing import (Any, Callable, Dict, List, Optional)
+
+from utils import utils
+
+DEFAULT_JOURNAL_FILE = os.path.join("users", "journal.jsonl")
+DEFAULT_JOURNAL_ARCHIVE_FILE = os.path.join("users", "journal.archive.jsonl")
+
+
+def journal_files(journal_file: str) -> List[str]:
+    """
+    Returns the files that make up a journal: the events kept by previous compactions, the segment \
+        being compacted and the journal file itself.
+    """
+
+    return [f"{journal_file}.kept", f"{journal_file}.compacting", journal_file]
+
+
+class Journal():
+    """
+    This object represents an append-only journal of user state-change events.
+
+    Instead of rewriting the userdata of a user on every change, stages record events \
+        (`hint_used`, `attempt`, `solved`, `identity_accepted`, ...) through `User.apply_event`. \
+        Each event is appended as a single JSON line to the journal file and periodically \
+        compacted into snapshots (the userdata saved by the storage backend).
+
+    ---
+
+    Parameters:
+        - journal_file (:obj:`str`): Path to the journal file.
+        - archive_file (:obj:`str`|:obj:`None`): Optional. Path to the file that compacted events are \
+            moved to. Compacted events are discarded if None.
+        - compact_every (:obj:`int`): Optional. Number of appended events after which the journal \
+            should be compacted. Defaults to 1000.
+        - logger (:class:`Log`): Optional. Logging object to report read/write errors to.
+
+    ---
+
+    Notes:
+        Every event is a JSON object with at least the following keys:
+
+            >>> {
+                    "seq": 1660000000000000000, # strictly increasing sequence number
+                    "ts": "2022-08-09T10:00:00.000000", # ISO 8601 timestamp
+                    "chatid": "CHATID",
+                    "event": "solved",
+                    # ... payload of the event
+                }
+
+        Snapshots store the `seq` of the last event they include (`User.data["_journal_seq"]`) \
+            so that replaying the journal over a snapshot never applies an event twice.
+
+        Since compacted events can be archived instead of discarded, the journal (and its archive) \
+            can be consumed directly for analytics.
+
+        Events kept by a compaction are moved to `[journal_file].kept` (see `journal_files`) so that \
+            the journal file itself is only ever appended to.
+
+    ---
+
+    Attributes:
+        - journal_file (:obj:`str`): Path to the journal file.
+        - archive_file (:obj:`str`|:obj:`None`): Path to the archive of compacted events.
+        - compact_every (:obj:`int`): Number of appended events after which the journal should be compacted.
+        - lock (:class:`threading.RLock`): Lock held while appending or rotating the journal file. Callers that \
+            need to apply an event to in-memory userdata atomically with its append should hold it as well.
+        - compaction_lock (:class:`threading.RLock`): Lock held for the whole of a compaction.
+        - tail (:class:`Dict[str, List[Dict[str, Any]]]`): Events found in the journal when it was opened that \
+            have not been replayed yet, indexed by chatid.
+        - last_seq (:obj:`int`): Sequence number of the last appended event.
+        - appended_events (:obj:`int`): Number of events appended since the last compaction.
+    """
+
+    def __init__(self, journal_file: str = DEFAULT_JOURNAL_FILE,
+                 archive_file: Optional[str] = DEFAULT_JOURNAL_ARCHIVE_FILE,
+                 compact_every: int = 1000,
+                 logger=utils.DEFAULT_LOG):
+        self.journal_file = journal_file
+        self.archive_file = archive_file
+        self.compact_every = compact_every
+        self.logger = logger
+
+        self.lock = threading.RLock()
+        self.compaction_lock = threading.RLock()
+        self.tail: Dict[str, List[Dict[str, Any]]] = {}
+        self.last_seq = 0
+        self.appended_events = 0
+
+        for event in self.read_journal(journal_file, logger):
+            self.tail.setdefault(event["chatid"], []).append(event)
+            self.last_seq = max(self.last_seq, event["seq"])
+
+        self.stream = open(journal_file, 'a', encoding="utf-8")
+
+    @staticmethod
+    def read_events(journal_file: str, logger=utils.DEFAULT_LOG) -> List[Dict[str, Any]]:
+        """
+        Returns every event in a journal file (in order of their sequence number).
+
+        Lines that cannot be decoded (for example a partially written last line after a crash) \
+            are skipped.
+        """
+
+        events = []
+        if not os.path.isfile(journal_file):
+            return events
+
+        with open(journal_file, 'r', encoding="utf-8") as stream:
+            for line_number, line in enumerate(stream, 1):
+                if not line.strip():
+                    continue
+                try:
+                    events.append(json.loads(line))
+                except ValueError:
+                    logger.error("JOURNAL_CORRUPTED_EVENT",
+                                 f"Skipping unreadable event at line {line_number} of {journal_file}.")
+
+        events.sort(key=lambda event: event["seq"])
+        return events
+
+    @classmethod
+    def read_journal(cls, journal_file: str, logger=utils.DEFAULT_LOG) -> List[Dict[str, Any]]:
+        """
+        Returns every event in the files of a journal (`journal_files`) in order of their sequence number.
+
+        Events found in more than one file (if the bot stopped in the middle of a compaction) are \
+            only returned once.
+        """
+
+        events = {}
+        for segment_file in journal_files(journal_file):
+            for event in cls.read_events(segment_file, logger):
+                events.update({event["seq"]: event})
+        return [events[seq] for seq in sorted(events)]
+
+    def next_seq(self) -> int:
+        self.last_seq = max(time.time_ns(), self.last_seq + 1)
+        return self.last_seq
+
+    def append(self, event: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Appends an event to the journal.
+
+        The `seq` of the event is assigned by the journal.
+
+        ---
+
+        Parameters:
+            - event (:class:`Dict[str, Any]`): The event to append (must contain `chatid`, `event` and `ts`).
+
+        ---
+
+        Returns:
+            (:class:`Dict[str, Any]`): Returns the appended event.
+        """
+
+        with self.lock:
+            event.update({"seq": self.next_seq()})
+            self.stream.write(json.dumps(event, default=str) + "\n")
+            self.stream.flush()
+
+            if utils.fsync_policy == "always":
+                os.fsync(self.stream.fileno())
+            elif utils.fsync_policy == "batch" and utils.fsync_batcher:
+                utils.fsync_batcher.add(self.journal_file)
+
+            self.appended_events += 1
+        return event
+
+    def pop_tail(self, chatid: str) -> List[Dict[str, Any]]:
+        """
+        Returns (and forgets) the events of a user that have not been replayed yet.
+        """
+
+        with self.lock:
+            return self.tail.pop(chatid, [])
+
+    def needs_compaction(self) -> bool:
+        return self.appended_events >= self.compact_every
+
+    @staticmethod
+    def write_events(journal_file: str, events: List[Dict[str, Any]]) -> None:
+        """
+        Atomically replaces a journal file with the given events.
+        """
+
+        temp_journal_file = f"{journal_file}.tmp"
+        with open(temp_journal_file, 'w', encoding="utf-8") as stream:
+            stream.writelines(json.dumps(event, default=str) + "\n"
+                              for event in events)
+        os.replace(temp_journal_file, journal_file)
+
+    def rotate(self) -> None:
+        """
+        Moves the journal file aside (`[journal_file].compacting`) to be compacted and starts a new one.
+
+        Callers that need to rotate the journal at a given point (e.g. while holding `lock`) should \
+            hold `compaction_lock` until they have called @Journal.compact with `rotate=False`.
+        """
+
+        kept_file, compacting_file, _ = journal_files(self.journal_file)
+        with self.compaction_lock:
+            if os.path.isfile(compacting_file):
+                # Left over by a compaction that did not finish
+                self.write_events(kept_file, self.read_events(kept_file, self.logger) +
+                                  self.read_events(compacting_file, self.logger))
+                utils.remove_files([compacting_file], self.logger)
+
+            with self.lock:
+                self.stream.close()
+                os.replace(self.journal_file, compacting_file)
+                self.stream = open(self.journal_file, 'a', encoding="utf-8")
+                self.appended_events = 0
+
+    def compact(self, keep: Optional[Callable[[Dict[str, Any]], bool]] = None,
+                rotate: bool = True) -> None:
+        """
+        Removes every event that is already part of a snapshot from the journal.
+
+        Events of users that have not been replayed yet (`Journal.tail`) are always kept, as well as \
+            the events that `keep` returns True for. The caller must have snapshotted every other event \
+            before calling this (see `UserManager.compact_journal`).
+
+        Compacted events are appended to the archive file if there is one.
+
+        ---
+
+        Parameters:
+            - keep (:class:`Callable[[Dict[str, Any]], bool]`): Optional. Returns whether an event \
+                must be kept.
+            - rotate (:obj:`bool`): Optional. Whether to rotate the journal file first. Callers that \
+                have rotated it themselves (@Journal.rotate) pass False. Defaults to True.
+
+        ---
+
+        Notes:
+            Only rotating the journal file holds `lock`. The rotated events are read, filtered and \
+                written back outside of it, so appends are never held up by a compaction.
+        """
+
+        kept_file, compacting_file, _ = journal_files(self.journal_file)
+        with self.compaction_lock:
+            if rotate:
+                self.rotate()
+
+            events = self.read_events(kept_file, self.logger) + \
+                self.read_events(compacting_file, self.logger)
+            kept_events, compacted_events = [], []
+            for event in events:
+                if event["chatid"] in self.tail or (keep and keep(event)):
+                    kept_events.append(event)
+                else:
+                    compacted_events.append(event)
+
+            if self.archive_file and compacted_events:
+                with open(self.archive_file, 'a', encoding="utf-8") as stream:
+                    stream.writelines(json.dumps(event, default=str) + "\n"
+                                      for event in compacted_events)
+
+            self.write_events(kept_file, kept_events)
+            utils.remove_files([compacting_file], self.logger)
+
+        self.logger.info("JOURNAL_COMPACTED",
+                         f"Compacted {len(compacted_events)} events from the journal ({len(kept_events)} kept).")
+
+    def close(self) -> None:
+        with self.lock:
+            self.stream.close()
+
+
+def from_config(storage_config: Optional[Dict[str, Any]] = None,
+                logger=utils.DEFAULT_LOG) -> Optional[Journal]:
+    """
+    Creates the journal described by the `STORAGE` section of `config.yaml`.
+
+    Returns None if the journal is not enabled (`STORAGE:JOURNAL`).
+    """
+
+    storage_config = storage_config or {}
+    if not storage_config.get("JOURNAL", False):
+        return None
+
+    return Journal(
+        storage_config.get("JOURNAL_FILE", DEFAULT_JOURNAL_FILE),
+        storage_config.get("JOURNAL_ARCHIVE_FILE", DEFAULT_JOURNAL_ARCHIVE_FILE),
+        storage_config.get("JOURNAL_COMPACT_EVENTS", 1000),
+        logger)
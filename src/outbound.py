@@ -0,0 +1,392 @@
+import time
+import heapq
+import random
+import threading
+from itertools import count
+from typing import (Any, Callable, Dict, Hashable, List, Optional, Tuple)
+
+from telegram.error import (RetryAfter, BadRequest, NetworkError)
+
+from utils import utils
+
+# Lower is sent first. Messages of a chat are sent in the order they were submitted.
+PRIORITY_CALLBACK_ANSWER = 0
+PRIORITY_MESSAGE = 1
+
+# Retries of calls that time out or fail with a network error
+MAX_ATTEMPTS = 3
+
+# Seconds @OutboundScheduler.stop waits for the queued calls to be sent
+DEFAULT_STOP_TIMEOUT = 5.0
+
+
+class TokenBucket:
+    """
+    Allows `rate` calls per second on average, with bursts of up to `capacity` calls.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, now: float) -> float:
+        """
+        Returns the number of seconds until a token is available (0 if one is available now).
+        """
+
+        self.refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now: float) -> None:
+        self.refill(now)
+        self.tokens -= 1
+
+    def is_full(self, now: float) -> bool:
+        self.refill(now)
+        return self.tokens >= self.capacity
+
+
+def call_with_fallback(send: Callable[[], Any], fallback: Optional[Callable[[], Any]] = None,
+                       logger=utils.DEFAULT_LOG) -> None:
+    """
+    Makes an outbound call right away, calling `fallback` instead if it fails.
+
+    Calls rejected for flooding (`RetryAfter`) do not fall back, as the fallback would be rejected too.
+    """
+
+    try:
+        send()
+    except RetryAfter as e:
+        logger.warning("OUTBOUND_RATE_LIMITED",
+                       f"Telegram asked to retry after {e.retry_after}s, the call is dropped.")
+    except Exception as e:
+        if not fallback:
+            logger.error("OUTBOUND_CALL_FAILED", e)
+            return
+        try:
+            fallback()
+        except Exception as e:
+            logger.error("OUTBOUND_CALL_FAILED", e)
+
+
+class OutboundJob:
+    def __init__(self, chat: Hashable, send: Callable[[], Any], priority: int, seq: int,
+                 fallback: Optional[Callable[[], Any]]):
+        self.chat = chat
+        self.send = send
+        self.priority = priority
+        self.seq = seq
+        self.fallback = fallback
+        self.attempts = 0
+
+    @property
+    def is_rate_limited(self) -> bool:
+        # Answering callback queries is not subject to the message limits
+        return self.priority != PRIORITY_CALLBACK_ANSWER
+
+
+class OutboundScheduler:
+    """
+    This object sends the outbound calls of the bot (messages, edits, callback answers) from \
+        background threads, within Telegram's rate limits.
+
+    Handlers submit calls and return straight away. Calls are sent:
+        - at most `global_rate` messages per second overall, in bursts of up to `global_burst`,
+        - at most `chat_rate` messages per second to a chat, in bursts of up to `chat_burst`,
+        - callback answers first (they are not rate limited), then messages,
+        - in the order they were submitted for each chat.
+
+    Calls rejected with `RetryAfter` (429) are put back at the front of their chat's queue and the \
+        chat is paused for the requested time plus some jitter, so that paused chats do not all \
+        resume at once.
+
+    ---
+
+    Parameters:
+        - senders (:obj:`int`): Optional. Number of threads making the calls. Defaults to 4.
+        - global_rate (:obj:`float`): Optional. Messages per second overall. Defaults to 25.
+        - global_burst (:obj:`float`): Optional. Burst size overall. Defaults to 30.
+        - chat_rate (:obj:`float`): Optional. Messages per second per chat. Defaults to 1.
+        - chat_burst (:obj:`float`): Optional. Burst size per chat. Defaults to 3.
+        - max_jitter (:obj:`float`): Optional. Maximum number of seconds added to `RetryAfter` delays. \
+            Defaults to 1 second.
+        - logger (:class:`Log`): Optional. Logging object to report failed calls to.
+
+    ---
+
+    Notes:
+        `fallback` is called (in place of the call, keeping its place in the chat's queue) if a call \
+            fails with anything other than `RetryAfter`, e.g. editing a message that was deleted:
+
+        >>> outbound = OutboundScheduler()
+            outbound.submit(chatid, lambda: message.edit_text("..."),
+                            fallback=lambda: bot.send_message(chatid, "..."))
+            # ...
+            outbound.stop()
+
+    ---
+
+    Attributes:
+        - sent (:obj:`int`): Number of calls made successfully.
+        - retried (:obj:`int`): Number of calls put back after a `RetryAfter` or a network error.
+        - failed (:obj:`int`): Number of calls that failed (after their fallback, if any).
+        - dropped (:obj:`int`): Number of calls still queued when @OutboundScheduler.stop gave up.
+    """
+
+    def __init__(self, senders: int = 4,
+                 global_rate: float = 25.0, global_burst: float = 30.0,
+                 chat_rate: float = 1.0, chat_burst: float = 3.0,
+                 max_jitter: float = 1.0,
+                 logger=utils.DEFAULT_LOG):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_jitter = max_jitter
+        self.logger = logger
+
+        self.condition = threading.Condition()
+        self.sequence = count()
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.chat_buckets: Dict[Hashable, TokenBucket] = {}
+
+        # chat -> heap of (priority, seq, job) waiting to be sent
+        self.chat_jobs: Dict[Hashable, List[Tuple[int, int, OutboundJob]]] = {}
+        # (priority, seq, chat) of the next job of every chat that can be sent now
+        self.ready: List[Tuple[int, int, Hashable]] = []
+        # (time, seq, chat) of chats waiting for their rate limit or a RetryAfter to pass
+        self.delayed: List[Tuple[float, int, Hashable]] = []
+        self.paused_until: Dict[Hashable, float] = {}
+
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.dropped = 0
+        self.stopping = False
+
+        self.senders = [threading.Thread(target=self.__run, name=f"outbound-{idx}", daemon=True)
+                        for idx in range(senders)]
+        for sender in self.senders:
+            sender.start()
+
+    def submit(self, chat: Hashable, send: Callable[[], Any],
+               priority: int = PRIORITY_MESSAGE,
+               fallback: Optional[Callable[[], Any]] = None) -> None:
+        """
+        Queues an outbound call to a chat.
+
+        ---
+
+        Parameters:
+            - chat (:obj:`Hashable`): Chat the call is made to (e.g chatid).
+            - send (:class:`Callable`): Makes the call (e.g `lambda: message.edit_text(...)`).
+            - priority (:obj:`int`): Optional. `PRIORITY_CALLBACK_ANSWER` or `PRIORITY_MESSAGE`. \
+                Defaults to `PRIORITY_MESSAGE`.
+            - fallback (:class:`Callable`): Optional. Call made instead if `send` fails.
+        """
+
+        with self.condition:
+            job = OutboundJob(chat, send, priority, next(self.sequence), fallback)
+            is_idle = chat not in self.chat_jobs
+            heapq.heappush(self.chat_jobs.setdefault(chat, []), (priority, job.seq, job))
+
+            if is_idle:
+                self.__schedule(chat)
+            else:
+                # The chat is queued with the priority of its previous head, a more urgent job
+                # (a callback answer) should not wait behind it
+                self.__reschedule_if_more_urgent(chat)
+            self.condition.notify()
+
+    def __reschedule_if_more_urgent(self, chat: Hashable) -> None:
+        priority, seq, job = self.chat_jobs[chat][0]
+        for idx, (ready_priority, ready_seq, ready_chat) in enumerate(self.ready):
+            if ready_chat == chat:
+                if (priority, seq) < (ready_priority, ready_seq):
+                    self.ready[idx] = (priority, seq, chat)
+                    heapq.heapify(self.ready)
+                return
+
+        # Callback answers do not wait for the rate limit of the chat (but do wait for a RetryAfter)
+        if job.is_rate_limited or self.paused_until.get(chat, 0.0) > time.monotonic():
+            return
+        for idx, (_, _, delayed_chat) in enumerate(self.delayed):
+            if delayed_chat == chat:
+                self.delayed.pop(idx)
+                heapq.heapify(self.delayed)
+                self.__schedule(chat)
+                return
+
+    def __schedule(self, chat: Hashable) -> None:
+        """
+        Puts a chat with queued jobs (and none in flight) in `ready` or `delayed`.
+        """
+
+        priority, seq, job = self.chat_jobs[chat][0]
+        now = time.monotonic()
+
+        ready_at = self.paused_until.get(chat, 0.0)
+        if job.is_rate_limited:
+            ready_at = max(ready_at, now + self.__chat_bucket(chat).wait_time(now))
+
+        if ready_at > now:
+            heapq.heappush(self.delayed, (ready_at, seq, chat))
+        else:
+            self.paused_until.pop(chat, None)
+            heapq.heappush(self.ready, (priority, seq, chat))
+
+    def __chat_bucket(self, chat: Hashable) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat)
+        if bucket is None:
+            bucket = self.chat_buckets[chat] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def __next_job(self) -> Optional[OutboundJob]:
+        """
+        Waits for the next job that can be sent. Returns None once stopped and nothing is queued.
+        """
+
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                while self.delayed and self.delayed[0][0] <= now:
+                    _, _, chat = heapq.heappop(self.delayed)
+                    self.__schedule(chat)
+
+                timeout = self.delayed[0][0] - now if self.delayed else None
+                if self.ready:
+                    priority, _, chat = self.ready[0]
+                    global_wait = self.global_bucket.wait_time(now) if priority != PRIORITY_CALLBACK_ANSWER else 0.0
+                    if not global_wait:
+                        heapq.heappop(self.ready)
+                        _, _, job = heapq.heappop(self.chat_jobs[chat])
+                        if job.is_rate_limited:
+                            self.global_bucket.take(now)
+                            self.__chat_bucket(chat).take(now)
+                        return job
+                    timeout = min(timeout, global_wait) if timeout is not None else global_wait
+                elif self.stopping and not self.delayed:
+                    return None
+
+                self.condition.wait(timeout)
+
+    def __run(self) -> None:
+        while True:
+            job = self.__next_job()
+            if job is None:
+                return
+
+            retry_after = None
+            try:
+                job.send()
+                succeeded = True
+            except RetryAfter as e:
+                retry_after = e.retry_after + random.uniform(0, self.max_jitter)
+                succeeded = False
+            except BadRequest as e:
+                # e.g the message to edit was deleted, retrying would fail the same way
+                succeeded = self.__fall_back(job, e)
+            except NetworkError as e:
+                job.attempts += 1
+                if job.attempts < MAX_ATTEMPTS:
+                    retry_after = random.uniform(0, self.max_jitter) * job.attempts
+                    succeeded = False
+                else:
+                    succeeded = self.__fall_back(job, e)
+            except Exception as e:
+                succeeded = self.__fall_back(job, e)
+
+            self.__done(job, succeeded, retry_after)
+
+    def __fall_back(self, job: OutboundJob, error: Exception) -> bool:
+        """
+        Makes the fallback call of a failed job (if any). Returns whether it succeeded.
+        """
+
+        if job.fallback:
+            fallback, job.fallback = job.fallback, None
+            try:
+                fallback()
+                return True
+            except Exception as e:
+                error = e
+
+        self.logger.error("OUTBOUND_CALL_FAILED", f"Chat {job.chat}: {error}")
+        with self.condition:
+            self.failed += 1
+        return False
+
+    def __done(self, job: OutboundJob, succeeded: bool, retry_after: Optional[float]) -> None:
+        with self.condition:
+            chat = job.chat
+            if succeeded:
+                self.sent += 1
+            if chat not in self.chat_jobs:
+                # The queue of the chat was dropped by @OutboundScheduler.stop
+                if retry_after is not None:
+                    self.dropped += 1
+                self.condition.notify_all()
+                return
+            if retry_after is not None:
+                self.retried += 1
+                self.paused_until[chat] = time.monotonic() + retry_after
+                # Keeps its place at the front of the chat's queue
+                heapq.heappush(self.chat_jobs[chat], (job.priority, job.seq, job))
+
+            if self.chat_jobs[chat]:
+                self.__schedule(chat)
+            else:
+                del self.chat_jobs[chat]
+                self.paused_until.pop(chat, None)
+                bucket = self.chat_buckets.get(chat)
+                if bucket and bucket.is_full(time.monotonic()):
+                    del self.chat_buckets[chat]
+            self.condition.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        with self.condition:
+            return {
+                "queued": sum(len(jobs) for jobs in self.chat_jobs.values()),
+                "chats": len(self.chat_jobs),
+                "sent": self.sent,
+                "retried": self.retried,
+                "failed": self.failed,
+                "dropped": self.dropped
+            }
+
+    def stop(self, timeout: Optional[float] = DEFAULT_STOP_TIMEOUT) -> None:
+        """
+        Sends the queued calls and stops the sender threads.
+
+        Calls that are still queued after `timeout` seconds (e.g. chats paused by a long `RetryAfter`) \
+            are dropped and logged as `OUTBOUND_DROPPED`, so that they never hold up the shutdown. \
+            Waits for every call if `timeout` is None.
+        """
+
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        for sender in self.senders:
+            sender.join(max(0.0, deadline - time.monotonic()) if deadline is not None else None)
+
+        with self.condition:
+            dropped = sum(len(jobs) for jobs in self.chat_jobs.values())
+            if dropped:
+                self.dropped += dropped
+                self.chat_jobs.clear()
+                self.ready.clear()
+                self.delayed.clear()
+                # Senders waiting for a delayed chat see that nothing is left and return
+                self.condition.notify_all()
+        if dropped:
+            self.logger.warning("OUTBOUND_DROPPED",
+                                f"Dropped {dropped} calls that were not sent within {timeout}s of stopping.")
+
+        self.logger.info("OUTBOUND_STATS", ", ".join(
+            f"{key}: {value}" for key, value in self.stats().items()))
@@ -9,7 +9,9 @@ from telegram.ext import (ConversationHandler, CallbackQueryHandler,
                           MessageHandler, CallbackContext, Filters)
 
 from constants import (USERSTATE, MESSAGE_DIVIDER)
+from callback_router import (CallbackRouter, callback_data)
 from utils import utils
+from utils.log import Lazy
 from user import (UserManager, User)
 
 
@@ -345,28 +347,28 @@ class LetUserChoose(Stage):
 
         self.init_users_data()
 
-        callbacks = []
         self.choice_text = choice_text
         self.keyboard = [[]]
 
-        for idx, choice in enumerate(choices):
-            def callback_wrapper(update: Update, context: CallbackContext,
-                                 choice: Dict[str, Union[str, Callable[[Update, CallbackContext], USERSTATE]]] = choice) -> USERSTATE:
-                if answer_callback_query:
-                    query = update.callback_query
-                    query.answer()
-                return choice["callback"](update, context)
+        def choice_callback(update: Update, context: CallbackContext) -> USERSTATE:
+            if answer_callback_query:
+                query = update.callback_query
+                query.answer()
+            (choice,) = context.args
+            return choice["callback"](update, context)
+
+        self.states = {
+            self.stage_id + ":confirmation": [
+                CallbackRouter().add(self.stage_id, "choice", choice_callback,
+                                     lambda idx: choices[idx])
+            ]
+        }
 
+        for idx, choice in enumerate(choices):
             if choices_per_row and idx % choices_per_row == 0:
                 self.keyboard.append([])
-            callbacks.append(CallbackQueryHandler(
-                callback_wrapper, pattern=f"^{self.stage_id}:choice:{idx}$"))
             self.keyboard[-1].append(InlineKeyboardButton(choice["text"],
-                                                          callback_data=f"{self.stage_id}:choice:{idx}"))
-
-        self.states = {
-            self.stage_id + ":confirmation": callbacks
-        }
+                                                          callback_data=callback_data(self.stage_id, "choice", idx)))
         self.bot.register_stage(self)
         # USERSTATES
         (self.CHOICE_CONFIRMATION,) = self.unpacked_states
@@ -463,21 +465,20 @@ class GetInfoFromUser(Stage):
         self.use_last_saved = use_last_saved
         self.allow_update = allow_update
 
-        self.confirm_input_pattern = f"collect:{data_label}:confirm"
-        self.retry_input_pattern = f"collect:{data_label}:retry"
-
         self.states = {
             data_label + "input_handler": [
                 MessageHandler(Filters.all, self.input_handler)
             ],
             data_label + "confirmation": [
-                CallbackQueryHandler(
-                    self.retry_input, pattern=f"^{self.retry_input_pattern}$"),
-                CallbackQueryHandler(
-                    self.confirm_input, pattern=f"^{self.confirm_input_pattern}$"),
+                CallbackRouter()
+                .add(self.stage_id, "retry", self.retry_input)
+                .add(self.stage_id, "confirm", self.confirm_input)
             ]
         }
 
+        self.confirm_input_data = callback_data(self.stage_id, "confirm")
+        self.retry_input_data = callback_data(self.stage_id, "retry")
+
         self.bot.register_stage(self)
         # USERSTATES
         (self.INPUT_HANDLER, self.INPUT_CONFIRMATION,) = self.unpacked_states
@@ -497,7 +498,7 @@ class GetInfoFromUser(Stage):
         if saved_data and self.use_last_saved:
             if self.allow_update:
                 user.logger.info("USER_DATA_INPUT_UPDATE_PROMPT",
-                                 f"User:{user.chatid} is choosing whether to update input({self.data_label})")
+                                 Lazy("User:{} is choosing whether to update input({})".format, user.chatid, self.data_label))
 
                 context.user_data.update(
                     {f"input:{self.data_label}": saved_data})
@@ -514,9 +515,9 @@ class GetInfoFromUser(Stage):
                     reply_markup=InlineKeyboardMarkup([
                         [
                             InlineKeyboardButton(
-                                "Confirm", callback_data=self.confirm_input_pattern),
+                                "Confirm", callback_data=self.confirm_input_data),
                             InlineKeyboardButton(
-                                "Edit", callback_data=self.retry_input_pattern),
+                                "Edit", callback_data=self.retry_input_data),
                         ]
                     ]),
                 )
@@ -524,11 +525,11 @@ class GetInfoFromUser(Stage):
                 return self.INPUT_CONFIRMATION
             else:
                 user.logger.info("USER_DATA_INPUT_UPDATE_FORBIDDEN",
-                                 f"User:{user.chatid} is forbidden from updating input({self.data_label}). Using old value...")
+                                 Lazy("User:{} is forbidden from updating input({}). Using old value...".format, user.chatid, self.data_label))
                 return self.stage_exit(update, context)
         else:
             user.logger.info("USER_DATA_INPUT_INIT_PROMPT",
-                             f"User:{user.chatid} is choosing input({self.data_label})")
+                             Lazy("User:{} is choosing input({})".format, user.chatid, self.data_label))
             self.bot.edit_or_reply_message(
                 update, context,
                 text=f"Please enter your <b>{self.data_label}</b>:" +
@@ -560,7 +561,7 @@ class GetInfoFromUser(Stage):
 
             if formatted_user_input:
                 user.logger.info("USER_DATA_INPUT_CONFIRMATION",
-                                 f"User:{user.chatid} entered an input({self.data_label}) of @{user_input}@")
+                                 Lazy("User:{} entered an input({}) of @{}@".format, user.chatid, self.data_label, user_input))
 
                 context.user_data.update(
                     {f"input:{self.data_label}": formatted_user_input})
@@ -571,9 +572,9 @@ class GetInfoFromUser(Stage):
                     reply_markup=InlineKeyboardMarkup([
                         [
                             InlineKeyboardButton(
-                                "Confirm", callback_data=self.confirm_input_pattern),
+                                "Confirm", callback_data=self.confirm_input_data),
                             InlineKeyboardButton(
-                                "Edit", callback_data=self.retry_input_pattern),
+                                "Edit", callback_data=self.retry_input_data),
                         ]
                     ])
                 )
@@ -581,7 +582,7 @@ class GetInfoFromUser(Stage):
                 return self.INPUT_CONFIRMATION
             else:
                 user.logger.warning("USER_DATA_INPUT_WRONG_FORMAT",
-                                    f"User:{user.chatid} entered an input({self.data_label}) of the wrong format. @{user_input}@")
+                                    Lazy("User:{} entered an input({}) of the wrong format. @{}@".format, user.chatid, self.data_label, user_input))
 
                 text = f"Your input: <b>{user_input}</b> is invalid."
                 expected_input_format = self.input_formatter(True)
@@ -600,7 +601,7 @@ class GetInfoFromUser(Stage):
 
         user: User = context.user_data.get("user")
         user.logger.info("USER_DATA_INPUT_CONFIRMED",
-                         f"User:{user.chatid} confirmed an input({self.data_label})")
+                         Lazy("User:{} confirmed an input({})".format, user.chatid, self.data_label))
         user.update_user_data(
             self.data_label, context.user_data[f"input:{self.data_label}"])
 
@@ -622,7 +623,7 @@ class GetInfoFromUser(Stage):
 
         user: User = context.user_data.get("user")
         user.logger.info("USER_DATA_INPUT_RETRY",
-                         f"User:{user.chatid} retrying an input({self.data_label})")
+                         Lazy("User:{} retrying an input({})".format, user.chatid, self.data_label))
 
         self.bot.edit_or_reply_message(
             update, context,
@@ -657,6 +658,9 @@ class EndConversation(Stage):
             query.answer()
 
         user: User = context.user_data.get("user")
+        if user:
+            # Persist any pending saves now that the user is leaving the conversation (/stop, exit, ...)
+            self.user_manager.flush(user.chatid)
 
         self.final_callback(update, context)
         if self.goodbye_message:
@@ -667,11 +671,11 @@ class EndConversation(Stage):
 
         if user and not user.is_banned:
             user.logger.info("USER_REACHED_END_OF_CONVERSATION",
-                             f"User:{user.chatid} has reached the end of the conversation")
+                             Lazy("User:{} has reached the end of the conversation".format, user.chatid))
 
         elif user and user.is_banned:
             user.logger.error("USER_BANNED",
-                              f"User:{user.chatid} is a banned user.")
+                              Lazy("User:{} is a banned user.".format, user.chatid))
             self.bot.edit_or_reply_message(
                 update, context,
                 text="Unfortunately, it appears you have been <b>banned</b>.\n\n"
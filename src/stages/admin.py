@@ -1,10 +1,11 @@
-from typing import (Dict, Union)
+from typing import Union
 
 from telegram import (InlineKeyboardButton, InlineKeyboardMarkup, Update)
 from telegram.ext import (CallbackQueryHandler, CallbackContext)
 
 from constants import USERSTATE
 from user import User
+from utils.log import Lazy
 from stage import Stage
 
 
@@ -141,11 +142,11 @@ class AdminConsole(Stage):
 
         if user.chatid in self.bot.admin_chatids:
             user.logger.info("USER_IS_ADMIN_USER",
-                             f"User:{user.chatid} is an  admin, loading admin console")
+                             Lazy("User:{} is an  admin, loading admin console".format, user.chatid))
             return self.load_admin(update, context)
         else:
             user.logger.info("USER_IS_NORMAL_USER",
-                             f"User:{user.chatid} does not have admin privilege, skipping admin console")
+                             Lazy("User:{} does not have admin privilege, skipping admin console".format, user.chatid))
             return self.stage_exit(update, context)
 
     def stage_exit(self, update: Update, context: CallbackContext) -> USERSTATE:
@@ -243,8 +244,7 @@ class AdminConsole(Stage):
                            None] = self.user_manager.get_from_chatid(chatid)
 
         if target_user:
-            target_user.data.update({"username": ""})
-            target_user.save_to_file()
+            target_user.update_user_data("username", "")
         else:
             self.log_user_not_found(
                 chatid=chatid,
@@ -268,13 +268,9 @@ class AdminConsole(Stage):
         return self.load_admin(update, context)
 
     def reset_all_users(self, update: Update, context: CallbackContext) -> USERSTATE:
-        users: Dict[str, User] = self.user_manager.get_users()
-
-        for chatid, user in users.items():
-            user: User
-
-            user: User = user
-            user.reset_user()
+        # Goes through the index as not every user is resident
+        for chatid in self.user_manager.get_index():
+            self.user_manager.reset_user(chatid)
 
         return self.load_admin(update, context)
 
@@ -1,4 +1,4 @@
-from typing import List
+from typing import (Any, Dict, List)
 
 from telegram import (InlineKeyboardButton, InlineKeyboardMarkup, Update)
 from telegram.ext import (CallbackQueryHandler, CallbackContext)
@@ -6,6 +6,7 @@ from telegram.ext import (CallbackQueryHandler, CallbackContext)
 from constants import (USERSTATE, MESSAGE_DIVIDER)
 from user import User
 from utils import utils
+from utils.log import Lazy
 from stage import Stage
 
 # ---------------------------------- CONFIG ---------------------------------- #
@@ -96,8 +97,18 @@ class Authenticate(Stage):
     def init_users_data(self) -> None:
         self.user_manager.add_data_field("name", "")
         self.user_manager.add_data_field("group", "")
+
+        self.user_manager.add_event_reducer(
+            "identity_accepted", self.apply_identity_accepted)
         return super().init_users_data()
 
+    def apply_identity_accepted(self, user_data: Dict[str, Any], event: Dict[str, Any]) -> None:
+        user_data.update({
+            "name": event["name"],
+            "username": event["username"],
+            "group": event["group"]
+        })
+
     def stage_entry(self, update: Update, context: CallbackContext) -> USERSTATE:
         query = update.callback_query
         if query:
@@ -126,7 +137,7 @@ class Authenticate(Stage):
         passcodes = self.bot.user_passcodes
         if sanitized_input in passcodes:
             user.logger.info(f"USER_AUTHENTICATE_CORRECT_PASSCODE",
-                             f"User:{user.chatid} has entered a valid passcode")
+                             Lazy("User:{} has entered a valid passcode".format, user.chatid))
 
             lookup, is_lookup_an_array = passcodes[sanitized_input], isinstance(
                 passcodes[sanitized_input], List)
@@ -152,7 +163,7 @@ class Authenticate(Stage):
 
         else:
             user.logger.info(f"USER_AUTHENTICATE_WRONG_PASSCODE",
-                             f"User:{user.chatid} has tried an invalid passcode: @{sanitized_input}@")
+                             Lazy("User:{} has tried an invalid passcode: @{}@".format, user.chatid, sanitized_input))
 
             self.bot.edit_or_reply_message(
                 update, context,
@@ -197,20 +208,14 @@ class Authenticate(Stage):
 
         user: User = context.user_data.get("user")
         user.logger.info(f"USER_AUTHENTICATE_ACCEPT_IDENTITY",
-                         f"User:{user.chatid} has accepted the identity: @{pending_name}@")
+                         Lazy("User:{} has accepted the identity: @{}@".format, user.chatid, pending_name))
 
-        user.update_user_data(
-            "name",
-            pending_name
+        user.apply_event(
+            "identity_accepted",
+            name=pending_name,
             # pending_name if not self.bot.anonymous_user_passcodes else "anonymous"
-        )
-        user.update_user_data(
-            "username",
-            pending_name if not self.bot.anonymous_user_passcodes else ""
-        )
-        user.update_user_data(
-            "group",
-            context.user_data.pop("pending_group")
+            username=pending_name if not self.bot.anonymous_user_passcodes else "",
+            group=context.user_data.pop("pending_group")
         )
 
         return self.stage_exit(update, context)
@@ -224,7 +229,7 @@ class Authenticate(Stage):
 
         user: User = context.user_data.get("user")
         user.logger.info(f"USER_AUTHENTICATE_DECLINE_IDENTITY",
-                         f"User:{user.chatid} has declined the identity: @{pending_name}@")
+                         Lazy("User:{} has declined the identity: @{}@".format, user.chatid, pending_name))
 
         return self.bot.proceed_next_stage(
             current_stage_id=self.stage_id,
@@ -238,7 +243,7 @@ class Authenticate(Stage):
 
         user: User = context.user_data.get("user")
         user.logger.info(f"USER_AUTHENTICATE_CONFIRM_IDENTITY",
-                         f"User:{user.chatid} has confirmed the accepted identity")
+                         Lazy("User:{} has confirmed the accepted identity".format, user.chatid))
 
         self.bot.edit_or_reply_message(
             update, context,
@@ -1,28 +1,43 @@
 import os
 import copy
-import time
 import datetime
 import re
 import functools
 import operator
-from typing import (List, Dict)
+from typing import (Any, List, Dict)
 
 from telegram import (InlineKeyboardButton,
                       InlineKeyboardMarkup, Update)
-from telegram.ext import (CallbackQueryHandler,
-                          MessageHandler, CallbackContext, Filters)
+from telegram.ext import (MessageHandler, CallbackContext, Filters, Job)
 
 from constants import (USERSTATE, MESSAGE_DIVIDER)
+from callback_router import (CallbackRouter, callback_data)
 from user import User
 from utils import utils
+from utils.log import Lazy
 from stage import Stage
 
 MAX_LEADERBOARD_VIEW = 10
 
+# Seconds counted down before revealing a time-based challenge
+REVEAL_COUNTDOWN = 5
+
+# Progress of a user for a single challenge (each value in ctf_state["challenges"])
+DEFAULT_CHALLENGE_PROGRESS = {
+    "attempts": 0,
+    "completed": False,
+    "hints_used": [],  # hint numbers
+    "total_hints_deduction": 0,
+    "start_time": None,  # time_based challenges only
+    "end_time": None,
+}
+
 
 class Ctf(Stage):
     def __init__(self, stage_id: str, next_stage_id: str, bot):
-        self.challenges = []
+        # Shared catalog of challenges, see load_challenges
+        self.challenges: List[Dict[str, Any]] = []
+        self.challenges_by_id: Dict[str, Dict[str, Any]] = {}
 
         self.directory = os.path.join("ctf")
         self.challenges_directory = os.path.join(self.directory, "challenges")
@@ -36,53 +51,27 @@ class Ctf(Stage):
         self.load_challenges()
         self.init_users_data()
 
-        menu_view_callbacks = [
-            CallbackQueryHandler(
-                self.view_leaderboard, pattern="^ctf_view_leaderboard$"),
-            CallbackQueryHandler(
-                self.stage_exit, pattern="^ctf_exit$")
-        ]
-        challenge_view_callbacks = [CallbackQueryHandler(
-            self.load_menu, pattern="^ctf_return_to_menu$")]
-        retry_challenge_callbacks = [CallbackQueryHandler(
-            self.load_menu, pattern="^ctf_return_to_menu$")]
-
-        for idx_c, challenge in enumerate(self.challenges):
-            menu_view_callbacks.append(
-                CallbackQueryHandler(
-                    self.view_challenge, pattern=f"^ctf_menu_view_challenge_{idx_c}$")
-            )
-            challenge_view_callbacks.extend([
-                CallbackQueryHandler(
-                    self.submit_answer, pattern=f"^ctf_submit_answer_{idx_c}$")
-            ])
-            retry_challenge_callbacks.extend([
-                CallbackQueryHandler(
-                    self.submit_answer, pattern=f"^ctf_submit_answer_{idx_c}$"),
-                CallbackQueryHandler(
-                    self.view_challenge, pattern=f"^ctf_return_to_challenge_{idx_c}$")
-            ])
-
-            if challenge["multiple_choices"]:
-                for idx_a, _ in enumerate(challenge["multiple_choices"]):
-                    challenge_view_callbacks.append(
-                        CallbackQueryHandler(
-                            self.submit_choice_answer, pattern=f"^ctf_select_choice_{idx_a}:{idx_c}$")
-                    )
-
-            for idx_h, _ in enumerate(challenge["hints"]):
-                challenge_view_callbacks.append(
-                    CallbackQueryHandler(
-                        self.reveal_hint, pattern=f"^ctf_view_hint_{idx_h}:{idx_c}$")
-                )
-
+        # One router per state, callback_data is "ctf:<action>[:<challenge number>[:<hint/choice number>]]"
+        challenge = self.to_challenge_number
         self.states = {
-            "MENU": menu_view_callbacks,
-            "CHALLENGE_VIEW": challenge_view_callbacks,
-            "LEADERBOARD_VIEW": [CallbackQueryHandler(self.load_menu, pattern="^ctf_return_to_menu$")],
+            "MENU": [CallbackRouter()
+                     .add(self.stage_id, "view_challenge", self.view_challenge, challenge)
+                     .add(self.stage_id, "view_leaderboard", self.view_leaderboard)
+                     .add(self.stage_id, "exit", self.stage_exit)],
+            "CHALLENGE_VIEW": [CallbackRouter()
+                               .add(self.stage_id, "submit_answer", self.submit_answer, challenge)
+                               .add(self.stage_id, "select_choice", self.submit_choice_answer, challenge, int)
+                               .add(self.stage_id, "view_hint", self.reveal_hint, challenge, int)
+                               .add(self.stage_id, "return_to_menu", self.load_menu)],
+            "LEADERBOARD_VIEW": [CallbackRouter()
+                                 .add(self.stage_id, "return_to_menu", self.load_menu)],
             "SUBMIT_CHALLENGE": [MessageHandler(Filters.all, self.handle_answer)],
-            "CHALLENGE_SUCCESS": [CallbackQueryHandler(self.load_menu, pattern="^ctf_return_to_menu$")],
-            "CHALLENGE_WRONG": retry_challenge_callbacks
+            "CHALLENGE_SUCCESS": [CallbackRouter()
+                                  .add(self.stage_id, "return_to_menu", self.load_menu)],
+            "CHALLENGE_WRONG": [CallbackRouter()
+                                .add(self.stage_id, "submit_answer", self.submit_answer, challenge)
+                                .add(self.stage_id, "return_to_challenge", self.view_challenge, challenge)
+                                .add(self.stage_id, "return_to_menu", self.load_menu)]
         }
 
         self.bot.register_stage(self)
@@ -95,73 +84,116 @@ class Ctf(Stage):
         ) = self.unpacked_states
 
     def init_users_data(self) -> None:
+        # Data fields related to CTF in user.data (ctf_state)
+        # Only the progress of the user is stored, the challenges themselves are read
+        # from the shared catalog (self.challenges) when needed.
         ctf_state = {
             "total_score": 0,
             "last_score_update": datetime.datetime.now(),
-            "challenges": []
+            "challenges": {}  # see DEFAULT_CHALLENGE_PROGRESS, indexed by challenge id
         }
+        self.user_manager.add_data_field("ctf_state", ctf_state)
 
-        for challenge in self.challenges:
-            challenge_data = copy.deepcopy(challenge)
-
-            challenge_data.update({"attempts": 0})
-            challenge_data.update({"completed": False})
-            challenge_data.update({"total_hints_deduction": 0})
+        # State-change events of ctf_state (see User.apply_event)
+        self.user_manager.add_event_reducer(
+            "challenge_started", self.apply_challenge_started)
+        self.user_manager.add_event_reducer(
+            "hint_used", self.apply_hint_used)
+        self.user_manager.add_event_reducer(
+            "attempt", self.apply_attempt)
+        self.user_manager.add_event_reducer(
+            "solved", self.apply_solved)
+
+        # Upgrades of ctf_state saved by previous versions (see UserManager.add_migration)
+        self.user_manager.add_migration(1, self.migrate_challenges_progress)
+
+        # Used by the leaderboard so that it does not need every user to be loaded
+        self.user_manager.add_index_field(
+            "username", lambda user_data: user_data.get("username"))
+        self.user_manager.add_index_field(
+            "ctf_total_score", lambda user_data: user_data["ctf_state"]["total_score"])
+        return super().init_users_data()
 
-            if type(challenge_data["time_based"]) is int:
-                challenge_data["time_based"] = {
-                    "limit": int(challenge_data["time_based"]),
-                    "start_time": False,
-                    "end_time": False
-                }
-            else:
-                challenge_data["time_based"] = None
-
-            max_hints_deduction = 0
-            for hint in challenge_data["hints"]:
-                hint.update({"used": False})
-                max_hints_deduction += hint["deduction"]
-
-            challenge_data.update({"max_hints_deduction": max_hints_deduction})
-            ctf_state["challenges"].append(challenge_data)
-
-            # Data fields related to CTF in user.data (ctf_state)
-            # "ctf_state" :
-            {
-                "challenges": [],  # see structure for each challenge below
-                "total_score": 0,
-                "last_score_update": None,
+    def get_challenge_progress(self, ctf_state: Dict[str, Any], challenge_id: str,
+                               create: bool = False) -> Dict[str, Any]:
+        challenges_progress = ctf_state["challenges"]
+        if challenge_id in challenges_progress:
+            return challenges_progress[challenge_id]
+
+        # Challenges that were never opened by the user are not stored
+        progress = copy.deepcopy(DEFAULT_CHALLENGE_PROGRESS)
+        if create:
+            challenges_progress.update({challenge_id: progress})
+            # Stored as a copy that tracks changes (see UserData)
+            progress = challenges_progress[challenge_id]
+        return progress
+
+    def get_challenge_id(self, challenge: Any) -> str:
+        # Events journaled before challenges had an id refer to them by their number
+        return self.challenges[challenge]["id"] if type(challenge) is int else challenge
+
+    def migrate_challenges_progress(self, user_data: Dict[str, Any]) -> None:
+        # Userdata saved before ctf_state only stored progress holds a copy of every challenge
+        ctf_state = user_data.get("ctf_state")
+        if not ctf_state or not isinstance(ctf_state["challenges"], list):
+            return
+
+        challenges_progress = {}
+        legacy_challenges = ctf_state["challenges"]
+
+        for challenge, legacy_challenge in zip(self.challenges, legacy_challenges):
+            time_based = legacy_challenge.get("time_based") or {}
+            progress = {
+                "attempts": legacy_challenge.get("attempts", 0),
+                "completed": legacy_challenge.get("completed", False),
+                "hints_used": [idx for idx, hint in enumerate(legacy_challenge.get("hints", []))
+                               if hint.get("used")],
+                "total_hints_deduction": legacy_challenge.get("total_hints_deduction", 0),
+                "start_time": time_based.get("start_time") or None,
+                "end_time": time_based.get("end_time") or None,
             }
-
-            # Challenge format for users (each challenge in challenges : [])
-            {
-                "description": "Lorem ipsum?",
-                "additional_info": "",
-                "answer": "",
-
-                "points": 0,
-                "difficulty": 1,
-
-                "attempts": 0,
-                "completed": False,
-                "total_hints_deduction": 0,
-                "max_hints_deduction": 0,
-                "hints": [{"deduction": 0, "text": "Lorem ipsum", "used": False}],
-                "files": ["www.link.com"],
-                "one_try": True,
-                "time_based": {
-                    "limit": 1800,
-                    "start_time": False,
-                    "end_time": False,
-                } or False,
-                "multiple_choices": [
-                    "Choice A",
-                    "Choice B",
-                    "choice C", ...
-                ] or False
-            }
-        self.user_manager.add_data_field("ctf_state", ctf_state)
-        return super().init_users_data()
+            if progress != DEFAULT_CHALLENGE_PROGRESS:
+                challenges_progress.update({challenge["id"]: progress})
+        ctf_state.update({"challenges": challenges_progress})
+
+    def apply_challenge_started(self, user_data: Dict[str, Any], event: Dict[str, Any]) -> None:
+        progress = self.get_challenge_progress(
+            user_data["ctf_state"], self.get_challenge_id(event["challenge"]), True)
+        progress.update(
+            {"start_time": datetime.datetime.fromisoformat(event["ts"])})
+
+    def apply_hint_used(self, user_data: Dict[str, Any], event: Dict[str, Any]) -> None:
+        challenge_id = self.get_challenge_id(event["challenge"])
+        progress = self.get_challenge_progress(
+            user_data["ctf_state"], challenge_id, True)
+
+        if event["hint"] not in progress["hints_used"]:
+            deduction = event.get("deduction")
+            if deduction is None:
+                deduction = self.challenges_by_id[challenge_id]["hints"][event["hint"]]["deduction"]
+
+            progress["hints_used"].append(event["hint"])
+            progress.update(
+                {"total_hints_deduction": progress["total_hints_deduction"] + deduction})
+
+    def apply_attempt(self, user_data: Dict[str, Any], event: Dict[str, Any]) -> None:
+        progress = self.get_challenge_progress(
+            user_data["ctf_state"], self.get_challenge_id(event["challenge"]), True)
+        progress["attempts"] += 1
+
+    def apply_solved(self, user_data: Dict[str, Any], event: Dict[str, Any]) -> None:
+        ctf_state = user_data["ctf_state"]
+        progress = self.get_challenge_progress(
+            ctf_state, self.get_challenge_id(event["challenge"]), True)
+        if progress["completed"]:
+            # Replayed over a snapshot that already counts it
+            return
+        solved_time = datetime.datetime.fromisoformat(event["ts"])
+
+        progress.update({"completed": True, "end_time": solved_time})
+
+        ctf_state["total_score"] += event["points"]
+        ctf_state.update({"last_score_update": solved_time})
 
     def stage_entry(self, update: Update, context: CallbackContext) -> USERSTATE:
         if self.leaderboard_active and not self.leaderboard:
@@ -171,8 +203,19 @@ class Ctf(Stage):
     def stage_exit(self, update: Update, context: CallbackContext) -> USERSTATE:
         return super().stage_exit(update, context)
 
+    def to_challenge_number(self, arg: str) -> int:
+        """
+        Converts the challenge number in callback_data, raises ValueError if there is no such challenge.
+        """
+
+        challenge_number = int(arg)
+        if not 0 <= challenge_number < len(self.challenges):
+            raise ValueError(f"No challenge {challenge_number}")
+        return challenge_number
+
     def load_challenges(self) -> None:
         self.challenges = []
+        self.challenges_by_id = {}
 
         challenges_names = os.listdir(self.challenges_directory)
         assert functools.reduce(
@@ -217,7 +260,16 @@ class Ctf(Stage):
                 challenge_data = utils.load_yaml_file(
                     challenge_yaml_file, self.bot.logger)
                 if challenge_data:
+                    # The directory name is used as the id of the challenge in ctf_state
+                    challenge_data.update({
+                        "id": name,
+                        "time_based": int(challenge_data["time_based"])
+                        if type(challenge_data["time_based"]) is int else None,
+                        "max_hints_deduction": sum(
+                            hint["deduction"] for hint in challenge_data["hints"]),
+                    })
                     self.challenges.append(challenge_data)
+                    self.challenges_by_id.update({name: challenge_data})
                 else:
                     self.bot.logger.error(
                         "CTF_CHALLENGE_FAILED_TO_LOAD", f"Failed to load the challenge.yaml file for Challenge: {name}.")
@@ -229,18 +281,19 @@ class Ctf(Stage):
 
         user: User = context.user_data.get("user")
         user.logger.info("USER_CTF_LOAD_MENU",
-                         f"User:{user.chatid} has loaded ctf menu")
+                         Lazy("User:{} has loaded ctf menu".format, user.chatid))
         ctf_state = user.data.get("ctf_state")
 
         keyboard = [[]]
         all_challenges_completed = True
         challenges_to_attempt = False
 
-        for idx, challenge in enumerate(ctf_state["challenges"]):
+        for idx, challenge in enumerate(self.challenges):
             if idx % 2 == 0:
                 keyboard.append([])
 
-            is_challenge_completed = challenge["completed"]
+            progress = self.get_challenge_progress(ctf_state, challenge["id"])
+            is_challenge_completed = progress["completed"]
             all_challenges_completed = False if not is_challenge_completed else all_challenges_completed
             challenges_to_attempt = True if (
                 not is_challenge_completed and not challenge["one_try"]) else challenges_to_attempt
@@ -255,7 +308,7 @@ class Ctf(Stage):
                     # button_text += "  ⌛️"
                     # button_text += f""" ({challenge["points"]} pts)"""
                 if challenge["one_try"]:
-                    if challenge["attempts"] == 0:
+                    if progress["attempts"] == 0:
                         challenges_to_attempt = True
                         # button_text += "  ⚠️"
                         # button_text += f""" ({challenge["points"]} pts)"""
@@ -265,14 +318,15 @@ class Ctf(Stage):
             keyboard[-1].append(
                 InlineKeyboardButton(
                     button_text,
-                    callback_data=f"ctf_menu_view_challenge_{idx}"
+                    callback_data=callback_data(
+                        self.stage_id, "view_challenge", idx)
                 )
             )
         if self.leaderboard_active:
             keyboard.append([InlineKeyboardButton(
-                "Leaderboard 📈", callback_data="ctf_view_leaderboard")])
+                "Leaderboard 📈", callback_data=callback_data(self.stage_id, "view_leaderboard"))])
         keyboard.append([InlineKeyboardButton(
-            "Exit 👋", callback_data="ctf_exit")])
+            "Exit 👋", callback_data=callback_data(self.stage_id, "exit"))])
 
         ctf_menu_msg = ""
         if all_challenges_completed:
@@ -307,57 +361,77 @@ class Ctf(Stage):
         query = update.callback_query
         query.answer()
 
-        challenge_number = int(query.data.split('_')[-1])
+        (challenge_number,) = context.args
 
         user: User = context.user_data.get("user")
         user.logger.info(f"USER_CTF_VIEW_CHALLENGE_{challenge_number}",
-                         f"User:{user.chatid} has viewed Challenge {challenge_number}")
+                         Lazy("User:{} has viewed Challenge {}".format, user.chatid, challenge_number))
         ctf_state = user.data.get("ctf_state")
 
-        challenge = ctf_state["challenges"][challenge_number]
-
-        if challenge["time_based"] and not challenge["time_based"]["start_time"]:
-            delay_before_revealing = 5
-            for i in range(delay_before_revealing):
-                self.bot.edit_or_reply_message(
-                    update, context,
-                    "This is a ⌛️ time-based challenge! \nThe faster you solve it, the more points you will receive."
-                    + "\n\nTimer will start as soon as challenge is revealed!\n\n"
-                    + MESSAGE_DIVIDER +
-                    f"Revealing challenge in: <b>{delay_before_revealing-i}</b>",
-                )
-                time.sleep(1)
+        challenge = self.challenges[challenge_number]
+        progress = self.get_challenge_progress(ctf_state, challenge["id"])
 
-            # Updating and saving players data
-            challenge["time_based"].update(
-                {"start_time": datetime.datetime.now()})
-            user.save_to_file()
+        if challenge["time_based"] and not progress["start_time"]:
+            # Counted down by the job queue, the challenge is revealed by the last tick
+            seconds_left = REVEAL_COUNTDOWN
+            self.display_countdown(update, context, seconds_left)
 
-        self.display_challenge(update, context, challenge_number)
+            def countdown_tick(update: Update, context: CallbackContext, job: Job) -> None:
+                nonlocal seconds_left
+                seconds_left -= 1
+                if seconds_left > 0:
+                    self.display_countdown(update, context, seconds_left)
+                else:
+                    self.bot.remove_job(context, job)
+                    self.reveal_challenge(update, context, challenge_number)
+
+            self.bot.run_repeating(update, context, countdown_tick,
+                                   interval=1, state=self.CHALLENGE_VIEW)
+        else:
+            self.display_challenge(update, context, challenge_number)
 
         return self.CHALLENGE_VIEW
 
+    def display_countdown(self, update: Update, context: CallbackContext, seconds_left: int) -> None:
+        self.bot.edit_or_reply_message(
+            update, context,
+            "This is a ⌛️ time-based challenge! \nThe faster you solve it, the more points you will receive."
+            + "\n\nTimer will start as soon as challenge is revealed!\n\n"
+            + MESSAGE_DIVIDER +
+            f"Revealing challenge in: <b>{seconds_left}</b>",
+        )
+
+    def reveal_challenge(self, update: Update, context: CallbackContext, challenge_number: int) -> None:
+        # Refreshed by Bot.run_repeating, the User may have been replaced since the countdown started
+        user: User = context.user_data.get("user")
+        ctf_state = user.data.get("ctf_state")
+        challenge = self.challenges[challenge_number]
+
+        # Updating and saving players data (unless another update started the timer meanwhile)
+        with user.lock:
+            if not self.get_challenge_progress(ctf_state, challenge["id"])["start_time"]:
+                user.apply_event("challenge_started", challenge=challenge["id"])
+
+        self.display_challenge(update, context, challenge_number)
+
     def reveal_hint(self, update: Update, context: CallbackContext) -> USERSTATE:
         query = update.callback_query
         query.answer(do_nothing=True)
 
-        query_info = query.data.split('_')[-1].split(':')
-        hint_number, challenge_number = query_info
-        challenge_number, hint_number = int(challenge_number), int(hint_number)
+        challenge_number, hint_number = context.args
 
         user: User = context.user_data.get("user")
-        user.logger.info(f"USER_CTF_VIEW_HINT_{challenge_number}_{hint_number}",
-                         f"User:{user.chatid} has revealed hint {hint_number} for Challenge {challenge_number}")
-        ctf_state = user.data.get("ctf_state")
+        challenge = self.challenges[challenge_number]
+        if not 0 <= hint_number < len(challenge["hints"]):
+            return None
+        user.logger.event(f"USER_CTF_VIEW_HINT_{challenge_number}_{hint_number}",
+                          Lazy("User:{} has revealed hint {} for Challenge {}".format, user.chatid, hint_number, challenge_number),
+                          action="VIEW_HINT", chatid=user.chatid, challenge=challenge_number + 1,
+                          challenge_id=challenge["id"], hint=hint_number + 1)
 
         # Updating and saving players data
-        challenge = ctf_state["challenges"][challenge_number]
-        hint = challenge["hints"][hint_number]
-
-        hint.update({"used": True})
-        challenge.update(
-            {"total_hints_deduction": challenge["total_hints_deduction"] + hint["deduction"]})
-        user.save_to_file()
+        user.apply_event("hint_used", challenge=challenge["id"],
+                         hint=hint_number, deduction=challenge["hints"][hint_number]["deduction"])
 
         self.display_challenge(update, context, challenge_number)
 
@@ -367,17 +441,15 @@ class Ctf(Stage):
         query = update.callback_query
         query.answer()
 
-        query_info = query.data.split('_')[-1].split(':')
-        choice_number, challenge_number = query_info
-        challenge_number, choice_number = int(
-            challenge_number), int(choice_number)
+        challenge_number, choice_number = context.args
+
+        challenge = self.challenges[challenge_number]
+        if not 0 <= choice_number < len(challenge["multiple_choices"] or []):
+            return None
 
         user: User = context.user_data.get("user")
         user.logger.info(f"USER_CTF_SUBMIT_{challenge_number}",
-                         f"User:{user.chatid} is submitting choiced answer {choice_number} for Challenge {challenge_number}")
-        ctf_state = user.data.get("ctf_state")
-
-        challenge = ctf_state["challenges"][challenge_number]
+                         Lazy("User:{} is submitting choiced answer {} for Challenge {}".format, user.chatid, choice_number, challenge_number))
         choice = challenge["multiple_choices"][choice_number]
 
         return self.check_answer(update, context, challenge_number, choice.lower())
@@ -388,15 +460,15 @@ class Ctf(Stage):
         query = update.callback_query
         query.answer(keep_message=is_first_attempt)
 
-        challenge_number = int(query.data.split('_')[-1])
+        (challenge_number,) = context.args
 
         user: User = context.user_data.get("user")
         user.logger.info(f"USER_CTF_SUBMIT_{challenge_number}",
-                         f"User:{user.chatid} is submitting answer for Challenge {challenge_number}")
+                         Lazy("User:{} is submitting answer for Challenge {}".format, user.chatid, challenge_number))
 
         if is_first_attempt:
             if not self.bot.behavior_remove_inline_markup:
-                query.message.edit_reply_markup()
+                self.bot.send(user.chatid, lambda: query.message.edit_reply_markup())
 
             self.bot.edit_or_reply_message(
                 update, context,
@@ -431,7 +503,7 @@ class Ctf(Stage):
 
         user: User = context.user_data.get("user")
         user.logger.info(f"USER_CTF_VIEW_LEADERBOARd",
-                         f"User:{user.chatid} is viewing the leaderboard.")
+                         Lazy("User:{} is viewing the leaderboard.".format, user.chatid))
         ctf_state = user.data.get("ctf_state")
 
         ctf_user_placing = False
@@ -440,6 +512,7 @@ class Ctf(Stage):
         text_body += f"<b><u>LEADERBOARD (TOP {MAX_LEADERBOARD_VIEW})</u></b>\n\n"
 
         if len(self.leaderboard) > 0:
+            users_index = self.user_manager.get_index()
             for idx, placing_array in enumerate(self.leaderboard):
                 total_score, top_users = placing_array
 
@@ -452,12 +525,13 @@ class Ctf(Stage):
 
                 placing_text = " "
 
-                for top_user in top_users:
-                    if top_user == user:
+                for top_user_chatid in top_users:
+                    if top_user_chatid == user.chatid:
                         placing_text = "⭐️ <b>You</b>," + placing_text
                         ctf_user_placing = idx
                     else:
-                        top_user_name = top_user.data.get("username")
+                        top_user_name = users_index.get(
+                            top_user_chatid, {}).get("username")
 
                         # Leaderboard is stale due to admin modifying in-memory data
                         if not top_user_name:  # meaning top_user_name is either False or ''
@@ -489,7 +563,7 @@ class Ctf(Stage):
             update, context,
             text=text_body,
             reply_markup=InlineKeyboardMarkup(
-                [[InlineKeyboardButton("« Back to Menu", callback_data="ctf_return_to_menu")]])
+                [[InlineKeyboardButton("« Back to Menu", callback_data=callback_data(self.stage_id, "return_to_menu"))]])
         )
         return self.LEADERBOARD_VIEW
     # -
@@ -498,19 +572,20 @@ class Ctf(Stage):
         user: User = context.user_data.get("user")
         ctf_state = user.data.get("ctf_state")
 
-        challenge = ctf_state["challenges"][challenge_number]
-        is_challenge_completed = challenge["completed"]
+        challenge = self.challenges[challenge_number]
+        progress = self.get_challenge_progress(ctf_state, challenge["id"])
+        is_challenge_completed = progress["completed"]
         hints_exist = len(challenge["hints"]) > 0
-        can_attempt = (challenge["one_try"] and challenge["attempts"] == 0) or (
+        can_attempt = (challenge["one_try"] and progress["attempts"] == 0) or (
             not challenge["one_try"])
         is_multiple_choices = challenge["multiple_choices"]
 
         keyboard = []
         text_body = f"<b>Challenge {challenge_number+1}</b>: "
 
-        total_points_deduction = int(challenge["total_hints_deduction"])
+        total_points_deduction = int(progress["total_hints_deduction"])
         challenge_points = int(challenge["points"])
-        number_of_attempts = int(challenge["attempts"]) + 1
+        number_of_attempts = int(progress["attempts"]) + 1
 
         effective_score = challenge_points
 
@@ -527,7 +602,7 @@ class Ctf(Stage):
             if can_attempt:
                 if not is_multiple_choices:
                     keyboard.append([InlineKeyboardButton(
-                        "Submit answer", callback_data=f"ctf_submit_answer_{challenge_number}")])
+                        "Submit answer", callback_data=callback_data(self.stage_id, "submit_answer", challenge_number))])
                 # Creates the RevealHint and  SubmitFlag buttons if challenge is not completed
 
                 else:
@@ -539,27 +614,27 @@ class Ctf(Stage):
 
                         keyboard[-1].append(
                             InlineKeyboardButton(
-                                f"{choice}", callback_data=f"ctf_select_choice_{t_idx}:{challenge_number}")
+                                f"{choice}", callback_data=callback_data(self.stage_id, "select_choice", challenge_number, t_idx))
                         )
 
                 idx = 0
                 for t_idx, hint in enumerate(challenge["hints"]):
                     # Only create a button for RevealHint if the hint is not yet revealed
-                    if not hint["used"]:
+                    if t_idx not in progress["hints_used"]:
                         if idx % 2 == 0:
                             keyboard.append([])
                         idx += 1
 
                         keyboard[-1].append(
                             InlineKeyboardButton(
-                                f"""Hint {t_idx+1} (-{hint["deduction"]} points)""", callback_data=f"ctf_view_hint_{t_idx}:{challenge_number}")
+                                f"""Hint {t_idx+1} (-{hint["deduction"]} points)""", callback_data=callback_data(self.stage_id, "view_hint", challenge_number, t_idx))
                         )
         else:
             text_body += f"You earned <u>{effective_score} points</u>\n\n"
 
         # Create the BackToMenu button
         keyboard.append([InlineKeyboardButton(
-            "« Back", callback_data="ctf_return_to_menu")])
+            "« Back", callback_data=callback_data(self.stage_id, "return_to_menu"))])
 
         text_body += challenge["description"]
         if challenge["additional_info"]:
@@ -574,10 +649,10 @@ class Ctf(Stage):
                 text_body += "\n\n"
 
             if hints_exist:
-                if (is_challenge_completed or not can_attempt) and challenge["total_hints_deduction"] > 0:
+                if (is_challenge_completed or not can_attempt) and progress["total_hints_deduction"] > 0:
                     text_body += "Hints used:\n"
                 for t_idx, hint in enumerate(challenge["hints"]):
-                    is_hint_used = hint["used"]
+                    is_hint_used = t_idx in progress["hints_used"]
 
                     # Displays the hints depending on whether they have been used else placeholder text is used
                     if (not is_challenge_completed and can_attempt) or is_hint_used:
@@ -608,48 +683,72 @@ class Ctf(Stage):
     def check_answer(self, update: Update, context: CallbackContext, challenge_number: int, answer: str) -> USERSTATE:
         user: User = context.user_data.get("user")
         ctf_state = user.data.get("ctf_state")
-        challenge = ctf_state["challenges"][challenge_number]
+        challenge = self.challenges[challenge_number]
 
         answer_key = challenge["answer"].lower()
-        challenge["attempts"] += 1
-
-        if answer == answer_key:
-            challenge["completed"] = True
-
-            challenge_points = int(challenge["points"])
-
-            if challenge["time_based"]:
-                max_time_seconds = int(challenge["time_based"]["limit"])
-                max_hint_deductions = int(challenge["max_hints_deduction"])
-
-                start_time: datetime = challenge["time_based"]["start_time"]
-                end_time = datetime.datetime.now()
-
-                diff = end_time - start_time
-                # Clamp the value for time taken to max allocated time
-                seconds_taken = max(
-                    0, min(diff.total_seconds(), max_time_seconds))
-
-                points_to_award = challenge_points - \
-                    ((seconds_taken / max_time_seconds) *
-                     (challenge_points - max_hint_deductions))
-                challenge_points = int(points_to_award)
 
-                challenge["time_based"]["end_time"] = end_time
-            elif challenge["multiple_choices"]:
-                challenge_points = int(
-                    challenge_points / challenge["attempts"])
+        if challenge["time_based"] and not self.get_challenge_progress(ctf_state, challenge["id"])["start_time"]:
+            # Answered from a stale message while the challenge was never revealed (countdown left
+            # before it ended), the timer has not started
+            self.bot.edit_or_reply_message(
+                update, context,
+                text=f"⌛️ Challenge {challenge_number+1} has not been revealed yet.",
+                reply_markup=InlineKeyboardMarkup([
+                    [InlineKeyboardButton(
+                        "View challenge", callback_data=callback_data(self.stage_id, "return_to_challenge", challenge_number))],
+                    [InlineKeyboardButton(
+                        "« Back to Menu", callback_data=callback_data(self.stage_id, "return_to_menu"))]])
+            )
+            return self.CHALLENGE_WRONG
 
-            challenge_points -= int(challenge["total_hints_deduction"])
-            challenge_points = challenge_points if challenge_points >= 0 else 0
-            ctf_state["total_score"] += challenge_points
-            ctf_state.update({"last_score_update": datetime.datetime.now()})
+        if answer == answer_key:
+            # Attempts, hints and the start time must not change while the points are computed
+            with user.lock:
+                already_solved = self.get_challenge_progress(
+                    ctf_state, challenge["id"])["completed"]
+                if not already_solved:
+                    user.apply_event("attempt", challenge=challenge["id"])
+                    progress = self.get_challenge_progress(ctf_state, challenge["id"])
+
+                    challenge_points = int(challenge["points"])
+
+                    if challenge["time_based"]:
+                        max_time_seconds = int(challenge["time_based"])
+                        max_hint_deductions = int(challenge["max_hints_deduction"])
+
+                        start_time: datetime = progress["start_time"]
+                        end_time = datetime.datetime.now()
+
+                        diff = end_time - start_time
+                        # Clamp the value for time taken to max allocated time
+                        seconds_taken = max(
+                            0, min(diff.total_seconds(), max_time_seconds))
+
+                        points_to_award = challenge_points - \
+                            ((seconds_taken / max_time_seconds) *
+                             (challenge_points - max_hint_deductions))
+                        challenge_points = int(points_to_award)
+                    elif challenge["multiple_choices"]:
+                        challenge_points = int(
+                            challenge_points / progress["attempts"])
+
+                    challenge_points -= int(progress["total_hints_deduction"])
+                    challenge_points = challenge_points if challenge_points >= 0 else 0
+
+                    user.apply_event("solved", challenge=challenge["id"],
+                                     points=challenge_points)
+
+            if already_solved:
+                # Answered again (e.g. a double tap or a stale message) after it was solved
+                self.display_challenge(update, context, challenge_number)
+                return self.CHALLENGE_VIEW
 
-            user.save_to_file()
             self.update_leaderboard()
 
-            user.logger.info(f"USER_CTF_CORRECT_ANSWER_{challenge_number}",
-                             f"""User:{user.chatid} @{ctf_state["total_score"]}@ got the answer CORRECT for Challenge {challenge_number}""")
+            user.logger.event(f"USER_CTF_CORRECT_ANSWER_{challenge_number}",
+                              Lazy("User:{} @{}@ got the answer CORRECT for Challenge {}".format, user.chatid, ctf_state["total_score"], challenge_number),
+                              action="CORRECT_ANSWER", chatid=user.chatid, challenge=challenge_number + 1,
+                              challenge_id=challenge["id"], score=ctf_state["total_score"])
 
             text_body = f"✅  Congratulations on solving Challenge {challenge_number+1} 🎉🥳\n\n"
             text_body += f"Points earned: <b>{challenge_points}</b>\n"
@@ -661,13 +760,15 @@ class Ctf(Stage):
                 update, context,
                 text=text_body,
                 reply_markup=InlineKeyboardMarkup(
-                    [[InlineKeyboardButton("« Back to Menu", callback_data="ctf_return_to_menu")]])
+                    [[InlineKeyboardButton("« Back to Menu", callback_data=callback_data(self.stage_id, "return_to_menu"))]])
             )
             return self.CHALLENGE_SUCCESS
         else:
-            user.save_to_file()
-            user.logger.info(f"USER_CTF_WRONG_ANSWER_{challenge_number}",
-                             f"""User:{user.chatid} @{answer}@ got the answer WRONG for Challenge {challenge_number}""")
+            user.apply_event("attempt", challenge=challenge["id"])
+            user.logger.event(f"USER_CTF_WRONG_ANSWER_{challenge_number}",
+                              Lazy("User:{} @{}@ got the answer WRONG for Challenge {}".format, user.chatid, answer, challenge_number),
+                              action="WRONG_ANSWER", chatid=user.chatid, challenge=challenge_number + 1,
+                              challenge_id=challenge["id"], score=ctf_state["total_score"])
 
             text_body = f"""❌ Your answer: <u>{answer}</u> is <b>incorrect</b>.\n\n"""
 
@@ -681,12 +782,12 @@ class Ctf(Stage):
             if not challenge["one_try"]:
                 if challenge["multiple_choices"]:
                     keyboard.append([InlineKeyboardButton(
-                        f"Retry challenge", callback_data=f"ctf_return_to_challenge_{challenge_number}")])
+                        f"Retry challenge", callback_data=callback_data(self.stage_id, "return_to_challenge", challenge_number))])
                 else:
                     keyboard.append([InlineKeyboardButton(
-                        f"Retry challenge", callback_data=f"ctf_submit_answer_{challenge_number}")])
+                        f"Retry challenge", callback_data=callback_data(self.stage_id, "submit_answer", challenge_number))])
             keyboard.append([InlineKeyboardButton(
-                "« Back to Menu", callback_data="ctf_return_to_menu")])
+                "« Back to Menu", callback_data=callback_data(self.stage_id, "return_to_menu"))])
 
             self.bot.edit_or_reply_message(
                 update, context,
@@ -701,20 +802,17 @@ class Ctf(Stage):
             dict_scoring_list = {}
             scoring_list = []
 
-            users: Dict[str, User] = self.user_manager.get_users()
-
-            for chatid, user in users.items():
-                user: User
+            users_index: Dict[str, Dict[str, Any]] = self.user_manager.get_index()
 
-                ctf_state = user.data.get("ctf_state")
-                user_total_score = str(ctf_state["total_score"])
-                user_name = user.data.get("username")
+            for chatid, index_entry in users_index.items():
+                user_total_score = str(index_entry.get("ctf_total_score") or 0)
+                user_name = index_entry.get("username")
 
                 if int(user_total_score) > 0 and user_name:
                     if user_total_score not in dict_scoring_list:
                         dict_scoring_list.update({user_total_score: []})
 
-                    dict_scoring_list[user_total_score].append(user)
+                    dict_scoring_list[user_total_score].append(chatid)
 
             for total_score, users in dict_scoring_list.items():
                 scoring_list.append([int(total_score), users])
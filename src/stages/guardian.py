@@ -1,10 +1,10 @@
-import time
 
 from telegram import (InlineKeyboardButton, InlineKeyboardMarkup, Update)
 from telegram.ext import (CallbackQueryHandler, CallbackContext)
 
 from constants import (USERSTATE, MESSAGE_DIVIDER)
 from user import User
+from utils.log import Lazy
 from stage import Stage
 
 
@@ -177,10 +177,11 @@ class Guardian(Stage):
                         update: Update, context: CallbackContext,
                         question_number: int, option_selected: str) -> USERSTATE:
         user: User = context.user_data.get("user")
-        guardian_state = user.data.get("guardian_state")
+        with user.lock:
+            guardian_state = user.data.get("guardian_state")
 
-        guardian_state["options_picked"].append(option_selected)
-        user.save_to_file()
+            guardian_state["options_picked"].append(option_selected)
+            user.save_to_file()
 
         if question_number < TOTAL_QUESTIONS - 1:
             if not self.bot.behavior_remove_inline_markup:
@@ -188,7 +189,6 @@ class Guardian(Stage):
                     update, context,
                     "💭 Loading next question..."
                 )
-                time.sleep(0.25)
             return self.bot.proceed_next_stage(
                 current_stage_id=f"{self.question_stage_pattern}{question_number}",
                 next_stage_id=f"{self.question_stage_pattern}{question_number + 1}",
@@ -219,10 +219,11 @@ class Guardian(Stage):
             "Begin", callback_data="guardian_begin")]
 
         if len(guardian_state.get("teams", [])) > 0 or len(guardian_state.get("teams.history", [])) > 0:
-            if len(guardian_state.get("teams", [])) == 0:
-                guardian_state.update(
-                    {"teams": list(guardian_state.get("teams.history"))})
-                user.save_to_file()
+            with user.lock:
+                if len(guardian_state.get("teams", [])) == 0:
+                    guardian_state.update(
+                        {"teams": list(guardian_state.get("teams.history"))})
+                    user.save_to_file()
 
             keyboard.append(InlineKeyboardButton(
                 "Skip", callback_data="guardian_skip"))
@@ -240,11 +241,12 @@ class Guardian(Stage):
         query.answer()
 
         user: User = context.user_data.get("user")
-        guardian_state = user.data.get("guardian_state")
+        with user.lock:
+            guardian_state = user.data.get("guardian_state")
 
-        guardian_state["options_picked"] = []
-        guardian_state["teams"] = []
-        user.save_to_file()
+            guardian_state["options_picked"] = []
+            guardian_state["teams"] = []
+            user.save_to_file()
 
         return self.bot.proceed_next_stage(
             current_stage_id=self.stage_id,
@@ -276,12 +278,13 @@ class Guardian(Stage):
             teams_picked.append(teams_list[1][1])
 
         user.logger.info(
-            "USER_IS_TEAM", f"User:{user.chatid} has gotten the results of {teams_picked}")
+            "USER_IS_TEAM", Lazy("User:{} has gotten the results of {}".format, user.chatid, teams_picked))
 
-        guardian_state.update({"teams": list(teams_picked)})
-        guardian_state.update({"teams.history": list(teams_picked)})
-        guardian_state.update({"teams_str": '+'.join(teams_picked)})
-        user.save_to_file()
+        with user.lock:
+            guardian_state.update({"teams": list(teams_picked)})
+            guardian_state.update({"teams.history": list(teams_picked)})
+            guardian_state.update({"teams_str": '+'.join(teams_picked)})
+            user.save_to_file()
 
     def display_results(self, update: Update, context: CallbackContext) -> USERSTATE:
         query = update.callback_query
@@ -302,7 +305,6 @@ class Guardian(Stage):
             update, context,
             text="💭 Displaying your results..."
         )
-        time.sleep(0.25)
 
         self.bot.edit_or_reply_message(
             update, context,
@@ -0,0 +1,932 @@
+import os
+import time
+import pickle
+import hashlib
+import sqlite3
+import threading
+import multiprocessing
+from abc import (ABC, abstractmethod)
+from concurrent.futures import (ProcessPoolExecutor, ThreadPoolExecutor)
+from typing import (Any, Dict, Iterator, List, Optional, Set, Tuple, Union)
+
+from utils import utils
+
+STORAGE_BACKENDS = ("yaml", "sqlite")
+STORAGE_LAYOUTS = ("flat", "sharded")
+DEFAULT_SQLITE_FILE = os.path.join("users", "users.db")
+DEFAULT_MANIFEST_FILE = os.path.join("users", "manifest.txt")
+DEFAULT_SNAPSHOT_FILE = os.path.join("users", "snapshot.pickle")
+
+
+def user_directory(users_directory: str, chatid: str, layout: str = "flat") -> str:
+    """
+    Returns the path to the directory that holds the files of a user in the given layout.
+    """
+
+    if layout == "sharded":
+        digest = hashlib.sha1(chatid.encode()).hexdigest()
+        return os.path.join(users_directory, digest[:2], digest[2:4], chatid)
+    return os.path.join(users_directory, chatid)
+
+
+def scan_chatids(users_directory: str, layout: str = "flat") -> List[str]:
+    """
+    Returns the chatids of every user directory in the given layout by walking the users directory.
+    """
+
+    if not os.path.isdir(users_directory):
+        return []
+
+    if layout == "flat":
+        return [chatid for chatid in os.listdir(users_directory)
+                if os.path.isdir(os.path.join(users_directory, chatid))]
+
+    chatids = []
+    for shard in os.listdir(users_directory):
+        shard_directory = os.path.join(users_directory, shard)
+        if len(shard) != 2 or not os.path.isdir(shard_directory):
+            continue
+        for sub_shard in os.listdir(shard_directory):
+            sub_shard_directory = os.path.join(shard_directory, sub_shard)
+            if os.path.isdir(sub_shard_directory):
+                chatids.extend(chatid for chatid in os.listdir(sub_shard_directory)
+                               if os.path.isdir(os.path.join(sub_shard_directory, chatid)))
+    return chatids
+
+
+def read_data_file(data_file: Optional[str], file_format: Optional[str]) -> Optional[Dict[str, Any]]:
+    # Runs in the worker processes of FileStorage.load_many
+    if data_file is None:
+        return None
+    return utils.load_file(data_file, file_format)
+
+
+class Storage(ABC):
+    """
+    This object represents a base storage backend for user data.
+
+    `User` and `UserManager` only ever talk to a `Storage` object when reading or writing \
+        `User.data`, which allows the underlying format to be swapped in `config.yaml`.
+
+    ---
+
+    Parameters:
+        - users_directory (:obj:`str`): Path to the users directory (`users/`).
+        - logger (:class:`Log`): Optional. Logging object to report read/write errors to.
+        - layout (:obj:`str`): Optional. Layout of the user directories: `flat` (`users/[chatid]/`) \
+            or `sharded` (`users/ab/cd/[chatid]/`, where `abcd` is the start of the SHA-1 of the chatid). \
+            Defaults to `flat`.
+
+    ---
+
+    Notes:
+        Regardless of the backend in use, every user still has a directory in `users/` \
+            which holds their log file.
+
+        The `sharded` layout keeps the number of entries per directory small when there are \
+            tens of thousands of users.
+
+        A backend must implement:
+
+            >>> exists(chatid) -> bool
+                load(chatid) -> Union[Dict[str, Any], None]
+                save(chatid, data, fields) -> bool
+                delete(chatid) -> None
+                list_chatids() -> List[str]
+
+    ---
+
+    Attributes:
+        - users_directory (:obj:`str`): Path to the users directory.
+        - logger (:class:`Log`): Logging object used by the backend.
+        - partial_writes (:obj:`bool`): Whether the backend is able to write only the changed \
+            fields of a user, in which case `save` is only handed those fields.
+    """
+
+    partial_writes = False
+
+    def __init__(self, users_directory: str, logger=utils.DEFAULT_LOG, layout: str = "flat"):
+        assert layout in STORAGE_LAYOUTS, f"Unknown STORAGE:LAYOUT: {layout}. "\
+            f"Supported layouts are: {', '.join(STORAGE_LAYOUTS)}"
+
+        self.users_directory = users_directory
+        self.logger = logger
+        self.layout = layout
+
+    def user_directory(self, chatid: str) -> str:
+        """
+        Returns the path to the directory that holds the files of a user.
+        """
+
+        return user_directory(self.users_directory, chatid, self.layout)
+
+    def scan_chatids(self) -> List[str]:
+        """
+        Returns the chatids of every user directory by walking the users directory.
+
+        This visits every user directory, prefer `list_chatids`.
+        """
+
+        return scan_chatids(self.users_directory, self.layout)
+
+    @abstractmethod
+    def exists(self, chatid: str) -> bool:
+        """
+        Returns whether there is saved userdata for the given chatid.
+        """
+
+    @abstractmethod
+    def load(self, chatid: str) -> Optional[Dict[str, Any]]:
+        """
+        Returns the saved userdata for the given chatid.
+
+        Returns None if the userdata is missing or could not be read.
+        """
+
+    def load_many(self, chatids: List[str], workers: int = 4) -> Iterator[Tuple[str, Optional[Dict[str, Any]]]]:
+        """
+        Loads the saved userdata of many users in parallel.
+
+        ---
+
+        Parameters:
+            - chatids (:class:`List[str]`): Chatids of the users to load.
+            - workers (:obj:`int`): Optional. Number of users loaded in parallel. Users are loaded one \
+                at a time if lower than 2. Defaults to 4.
+
+        ---
+
+        Returns:
+            (:class:`Iterator[Tuple[str, Optional[Dict[str, Any]]]]`): Yields `(chatid, userdata)` in the \
+                order of `chatids`. The userdata is None if it is missing or could not be read.
+        """
+
+        if workers < 2:
+            for chatid in chatids:
+                yield chatid, self.load(chatid)
+            return
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            yield from zip(chatids, executor.map(self.load, chatids))
+
+    @abstractmethod
+    def save(self, chatid: str, data: Dict[str, Any],
+             fields: Optional[List[str]] = None) -> bool:
+        """
+        Saves the userdata for the given chatid.
+
+        If `fields` is given, only those top-level fields have changed since the last save \
+            (fields that are missing from `data` have been removed). Backends that are able to \
+            (`partial_writes`) may then write only those fields and are only handed those fields in `data`.
+
+        Returns whether the userdata was successfully saved.
+        """
+
+    def modified_at(self, chatid: str) -> Optional[float]:
+        """
+        Returns when the userdata of the given chatid was last saved (as a UNIX timestamp).
+
+        Returns None if it is unknown.
+        """
+
+        return None
+
+    @abstractmethod
+    def delete(self, chatid: str) -> None:
+        """
+        Removes the saved userdata for the given chatid.
+        """
+
+    @abstractmethod
+    def list_chatids(self) -> List[str]:
+        """
+        Returns the chatids of every user known to the backend.
+        """
+
+    def close(self) -> None:
+        """
+        Releases any resources held by the backend.
+        """
+
+
+class FileStorage(Storage):
+    """
+    Storage backend that keeps one file per user: `users/[chatid]/[chatid].[format]`.
+
+    ---
+
+    Parameters:
+        - users_directory (:obj:`str`): Path to the users directory (`users/`).
+        - file_format (:obj:`str`): Optional. Format of the user files: `yaml`, `json` or `pickle`. \
+            Defaults to `yaml`, the original storage format of the bot.
+        - logger (:class:`Log`): Optional. Logging object to report read/write errors to.
+        - layout (:obj:`str`): Optional. Layout of the user directories (see `Storage`). Defaults to `flat`.
+        - manifest_file (:obj:`str`): Optional. Path to the manifest of every chatid. \
+            Defaults to `users/manifest.txt`.
+
+    ---
+
+    Notes:
+        User files in any other format (for example the legacy `[chatid].yaml` files after switching \
+            to `json`) are still read if there is no file in the configured format. They are removed \
+            once the user has been saved in the configured format.
+
+        The manifest holds one chatid per line and is appended to whenever a new user is saved, \
+            so that listing users does not need to walk the users directory. It is rebuilt from \
+            the users directory if it is missing, and reloaded if it was changed by another process.
+    """
+
+    def __init__(self, users_directory: str, file_format: str = "yaml", logger=utils.DEFAULT_LOG,
+                 layout: str = "flat", manifest_file: str = DEFAULT_MANIFEST_FILE):
+        super().__init__(users_directory, logger, layout)
+
+        assert file_format in utils.SERIALIZER_FORMATS, f"Unknown STORAGE:FORMAT: {file_format}. "\
+            f"Supported formats are: {', '.join(utils.SERIALIZER_FORMATS)}"
+
+        self.file_format = file_format
+        self.other_file_formats = [other_file_format for other_file_format in utils.SERIALIZER_FORMATS
+                                   if other_file_format != file_format]
+
+        utils.get_dir_or_create(os.path.dirname(manifest_file) or ".")
+        self.manifest_file = manifest_file
+        self.manifest_lock = threading.Lock()
+        self.manifest: Dict[str, None] = {}
+        self.manifest_mtime = None
+        self.__load_manifest()
+
+    def __load_manifest(self) -> None:
+        with self.manifest_lock:
+            if not os.path.isfile(self.manifest_file):
+                self.manifest = dict.fromkeys(self.scan_chatids())
+                self.__write_manifest()
+                return
+
+            with open(self.manifest_file, 'r', encoding="utf-8") as stream:
+                self.manifest = dict.fromkeys(
+                    line.strip() for line in stream if line.strip())
+            self.manifest_mtime = os.path.getmtime(self.manifest_file)
+
+    def __write_manifest(self) -> None:
+        temp_manifest_file = f"{self.manifest_file}.tmp"
+        with open(temp_manifest_file, 'w', encoding="utf-8") as stream:
+            stream.writelines(f"{chatid}\n" for chatid in self.manifest)
+        os.replace(temp_manifest_file, self.manifest_file)
+        self.manifest_mtime = os.path.getmtime(self.manifest_file)
+
+    def __add_to_manifest(self, chatid: str) -> None:
+        with self.manifest_lock:
+            if chatid in self.manifest:
+                return
+
+            self.manifest.update({chatid: None})
+            with open(self.manifest_file, 'a', encoding="utf-8") as stream:
+                stream.write(f"{chatid}\n")
+            self.manifest_mtime = os.path.getmtime(self.manifest_file)
+
+    def data_file(self, chatid: str, file_format: Optional[str] = None) -> str:
+        return os.path.join(self.user_directory(chatid), f"{chatid}.{file_format or self.file_format}")
+
+    def __find_data_file(self, chatid: str) -> Optional[Tuple[str, str]]:
+        for file_format in [self.file_format] + self.other_file_formats:
+            data_file = self.data_file(chatid, file_format)
+            if os.path.isfile(data_file):
+                return data_file, file_format
+        return None
+
+    def exists(self, chatid: str) -> bool:
+        return self.__find_data_file(chatid) is not None
+
+    def load(self, chatid: str) -> Optional[Dict[str, Any]]:
+        found_data_file = self.__find_data_file(chatid)
+        if found_data_file is None:
+            return None
+
+        data_file, file_format = found_data_file
+        return utils.load_file(data_file, file_format, self.logger)
+
+    def modified_at(self, chatid: str) -> Optional[float]:
+        found_data_file = self.__find_data_file(chatid)
+        return os.path.getmtime(found_data_file[0]) if found_data_file else None
+
+    def load_many(self, chatids: List[str], workers: int = 4) -> Iterator[Tuple[str, Optional[Dict[str, Any]]]]:
+        # Parsing (YAML especially) is CPU-bound, so the files are read by a pool of processes
+        if workers < 2:
+            yield from super().load_many(chatids, workers)
+            return
+
+        found_data_files = [self.__find_data_file(chatid) or (None, None)
+                            for chatid in chatids]
+        # Spawned rather than forked: the writer and log threads already running may hold locks
+        # that a forked child would inherit and never see released
+        with ProcessPoolExecutor(max_workers=workers,
+                                 mp_context=multiprocessing.get_context("spawn")) as executor:
+            yield from zip(chatids, executor.map(
+                read_data_file,
+                [data_file for data_file, _ in found_data_files],
+                [file_format for _, file_format in found_data_files],
+                chunksize=max(1, len(chatids) // (workers * 8))))
+
+    def save(self, chatid: str, data: Dict[str, Any],
+             fields: Optional[List[str]] = None) -> bool:
+        # The document is always rewritten as a whole
+        utils.get_dir_or_create(self.user_directory(chatid))
+        if not utils.dump_to_file(data, self.data_file(chatid), self.file_format, self.logger):
+            return False
+
+        utils.remove_files([self.data_file(chatid, file_format)
+                            for file_format in self.other_file_formats], self.logger)
+        if chatid not in self.manifest:
+            self.__add_to_manifest(chatid)
+        return True
+
+    def delete(self, chatid: str) -> None:
+        utils.remove_files([self.data_file(chatid, file_format)
+                            for file_format in utils.SERIALIZER_FORMATS], self.logger)
+
+        with self.manifest_lock:
+            if chatid in self.manifest:
+                self.manifest.pop(chatid)
+                self.__write_manifest()
+
+    def list_chatids(self) -> List[str]:
+        if os.path.isfile(self.manifest_file) and os.path.getmtime(self.manifest_file) == self.manifest_mtime:
+            return list(self.manifest)
+
+        # Missing or changed by another process (e.g a script running alongside the bot)
+        self.__load_manifest()
+        return list(self.manifest)
+
+
+class YamlStorage(FileStorage):
+    """
+    Storage backend that keeps one YAML document per user: `users/[chatid]/[chatid].yaml`.
+
+    This is the original storage format of the bot.
+    """
+
+    def __init__(self, users_directory: str, logger=utils.DEFAULT_LOG, layout: str = "flat",
+                 manifest_file: str = DEFAULT_MANIFEST_FILE):
+        super().__init__(users_directory, "yaml", logger, layout, manifest_file)
+
+
+class SqliteStorage(Storage):
+    """
+    Storage backend that keeps all userdata in a single SQLite database (WAL mode).
+
+    Each top-level field of `User.data` is stored as its own row (encoded in `file_format`) so that \
+        thousands of users do not translate into thousands of small files. Only the rows of \
+        changed fields are rewritten when a user is saved.
+
+    ---
+
+    Parameters:
+        - users_directory (:obj:`str`): Path to the users directory (`users/`).
+        - database_file (:obj:`str`): Path to the SQLite database file.
+        - file_format (:obj:`str`): Optional. Format that fields are encoded in: `yaml`, `json` or `pickle`. \
+            Defaults to `yaml`.
+        - logger (:class:`Log`): Optional. Logging object to report read/write errors to.
+        - layout (:obj:`str`): Optional. Layout of the user directories (see `Storage`). Defaults to `flat`.
+
+    ---
+
+    Notes:
+        The connection is shared between the dispatcher worker threads and is guarded by a lock.
+
+        Fields are decoded based on what they contain so rows written in a different format \
+            (e.g. before `STORAGE:FORMAT` was changed) are still read.
+    """
+
+    partial_writes = True
+
+    def __init__(self, users_directory: str, database_file: str,
+                 file_format: str = "yaml", logger=utils.DEFAULT_LOG, layout: str = "flat"):
+        super().__init__(users_directory, logger, layout)
+
+        assert file_format in utils.SERIALIZER_FORMATS, f"Unknown STORAGE:FORMAT: {file_format}. "\
+            f"Supported formats are: {', '.join(utils.SERIALIZER_FORMATS)}"
+
+        self.database_file = database_file
+        self.file_format = file_format
+        self.lock = threading.RLock()
+
+        self.connection = sqlite3.connect(
+            database_file, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS users (
+                chatid TEXT PRIMARY KEY,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS user_fields (
+                chatid TEXT NOT NULL REFERENCES users(chatid) ON DELETE CASCADE,
+                field TEXT NOT NULL,
+                value TEXT NOT NULL,
+                PRIMARY KEY (chatid, field)
+            );
+            """
+        )
+        self.connection.execute("PRAGMA foreign_keys=ON")
+
+    def exists(self, chatid: str) -> bool:
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT 1 FROM users WHERE chatid = ?", (chatid,)).fetchone()
+        return row is not None
+
+    def load(self, chatid: str) -> Optional[Dict[str, Any]]:
+        if not self.exists(chatid):
+            return None
+
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT field, value FROM user_fields WHERE chatid = ?", (chatid,)).fetchall()
+
+        data = {}
+        try:
+            for field, value in rows:
+                data.update({field: self.decode(value)})
+        except utils.SERIALIZER_ERRORS as exception:
+            self.logger.error(False, exception)
+            return None
+        return data
+
+    @staticmethod
+    def decode(value: Union[str, bytes]) -> Any:
+        if isinstance(value, bytes):
+            return utils.deserialize(value, "pickle")
+        try:
+            return utils.deserialize(value, "json")
+        except ValueError:
+            return utils.deserialize(value, "yaml")
+
+    def save(self, chatid: str, data: Dict[str, Any],
+             fields: Optional[List[str]] = None) -> bool:
+        try:
+            rows = [(chatid, field, utils.serialize(value, self.file_format))
+                    for field, value in data.items() if fields is None or field in fields]
+        except utils.SERIALIZER_ERRORS as exception:
+            self.logger.error(False, exception)
+            return False
+
+        with self.lock:
+            try:
+                self.connection.execute("BEGIN")
+                self.connection.execute(
+                    "INSERT INTO users (chatid, updated_at) VALUES (?, ?) "
+                    "ON CONFLICT(chatid) DO UPDATE SET updated_at = excluded.updated_at",
+                    (chatid, time.time()))
+                if fields is None:
+                    self.connection.execute(
+                        "DELETE FROM user_fields WHERE chatid = ?", (chatid,))
+                else:
+                    self.connection.executemany(
+                        "DELETE FROM user_fields WHERE chatid = ? AND field = ?",
+                        [(chatid, field) for field in fields if field not in data])
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO user_fields (chatid, field, value) VALUES (?, ?, ?)", rows)
+                self.connection.execute("COMMIT")
+                return True
+            except sqlite3.Error as exception:
+                self.connection.execute("ROLLBACK")
+                self.logger.error(False, exception)
+                return False
+
+    def modified_at(self, chatid: str) -> Optional[float]:
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT updated_at FROM users WHERE chatid = ?", (chatid,)).fetchone()
+        return row[0] if row else None
+
+    def delete(self, chatid: str) -> None:
+        with self.lock:
+            self.connection.execute(
+                "DELETE FROM users WHERE chatid = ?", (chatid,))
+
+    def list_chatids(self) -> List[str]:
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT chatid FROM users").fetchall()
+        return [chatid for (chatid,) in rows]
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
+
+
+class SnapshotStorage(Storage):
+    """
+    Storage decorator that keeps a consolidated snapshot of every user in a single file for fast cold starts.
+
+    The snapshot is written every `interval` seconds (if any user was saved since the last one) and \
+        when the storage is closed. On startup, users are loaded from the snapshot instead of the \
+        wrapped backend unless their userdata was saved after their entry in the snapshot was taken.
+
+    ---
+
+    Parameters:
+        - backend (:class:`Storage`): The storage backend to wrap.
+        - snapshot_file (:obj:`str`): Optional. Path to the snapshot file. Defaults to `users/snapshot.pickle`.
+        - interval (:obj:`float`): Optional. Number of seconds between snapshots. Defaults to 60 seconds.
+        - logger (:class:`Log`): Optional. Logging object to report read/write errors to.
+
+    ---
+
+    Notes:
+        The snapshot is a stream of pickles: a `{"created_at": timestamp}` header followed by one \
+            `(chatid, taken_at, pickled userdata)` record per user.
+
+        The backend remains the source of truth: deleting the snapshot file is always safe. The \
+            snapshot is only held in memory until the users have been loaded on startup (@SnapshotStorage.release), \
+            so it does not undo `USERS:MAX_RESIDENT`.
+
+        A new snapshot is written by streaming the records of the previous one, and only the users \
+            saved since (or missing from it) are read back from the backend.
+
+        Whether the userdata of a user is newer than their entry is decided with `Storage.modified_at` \
+            (the mtime of the user file or the `updated_at` column of the SQLite backend).
+
+    ---
+
+    Attributes:
+        - backend (:class:`Storage`): The wrapped storage backend.
+        - cache (:class:`Dict[str, Tuple[float, bytes]]`): When the entry of every user in the snapshot read \
+            on startup was taken and their pickled userdata, indexed by chatid. Emptied once released.
+        - saved_chatids (:class:`Set[str]`): Users saved (or removed) since the last snapshot was written.
+    """
+
+    def __init__(self, backend: Storage, snapshot_file: str = DEFAULT_SNAPSHOT_FILE,
+                 interval: float = 60.0, logger=utils.DEFAULT_LOG):
+        super().__init__(backend.users_directory, logger, backend.layout)
+
+        self.backend = backend
+        self.partial_writes = backend.partial_writes
+        self.snapshot_file = snapshot_file
+        self.interval = interval
+
+        self.lock = threading.Lock()
+        # Held while a snapshot is being written
+        self.write_lock = threading.Lock()
+        self.cache: Dict[str, Tuple[float, bytes]] = {}
+        self.saved_chatids: Set[str] = set()
+
+        for chatid, taken_at, payload in self.read_records(self.snapshot_file, self.logger):
+            self.cache.update({chatid: (taken_at, payload)})
+        if self.cache:
+            self.logger.info("SNAPSHOT_LOADED",
+                             f"Loaded a snapshot of {len(self.cache)} users from {self.snapshot_file}.")
+        # Users missing from the snapshot are added by the first snapshot
+        self.dirty = True
+
+        self.closed = threading.Event()
+        self.writer = threading.Thread(
+            target=self.__run, name="snapshot-writer", daemon=True)
+        self.writer.start()
+
+    @staticmethod
+    def read_records(snapshot_file: str, logger=utils.DEFAULT_LOG) -> Iterator[Tuple[str, float, bytes]]:
+        """
+        Yields the `(chatid, taken_at, pickled userdata)` record of every user in a snapshot file.
+        """
+
+        if not os.path.isfile(snapshot_file):
+            return
+
+        try:
+            with open(snapshot_file, "rb") as stream:
+                header = pickle.load(stream)
+                if "users" in header:
+                    # Snapshots written as a single pickle by previous versions
+                    for chatid, payload in header["users"].items():
+                        yield chatid, header["created_at"], payload
+                    return
+
+                while True:
+                    try:
+                        record = pickle.load(stream)
+                    except EOFError:
+                        return
+                    yield record
+        except (OSError, pickle.PickleError, EOFError, TypeError, KeyError, ValueError):
+            logger.error("SNAPSHOT_CORRUPTED",
+                         f"Snapshot {snapshot_file} could not be read, users are loaded from storage instead.")
+
+    def __cached(self, chatid: str) -> Optional[bytes]:
+        with self.lock:
+            entry = self.cache.pop(chatid, None)
+        if entry is None:
+            return None
+
+        taken_at, payload = entry
+        modified_at = self.backend.modified_at(chatid)
+        if modified_at is None or modified_at >= taken_at:
+            return None
+        return payload
+
+    def __mark_saved(self, chatid: str) -> None:
+        with self.lock:
+            self.cache.pop(chatid, None)
+            self.saved_chatids.add(chatid)
+            self.dirty = True
+
+    def release(self) -> None:
+        """
+        Drops the snapshot read on startup, users are loaded from the backend from then on.
+        """
+
+        with self.lock:
+            self.cache = {}
+
+    def exists(self, chatid: str) -> bool:
+        with self.lock:
+            if chatid in self.cache:
+                return True
+        return self.backend.exists(chatid)
+
+    def load(self, chatid: str) -> Optional[Dict[str, Any]]:
+        # Entries are dropped once read, the user is saved to the backend from then on
+        payload = self.__cached(chatid)
+        if payload is not None:
+            return pickle.loads(payload)
+        return self.backend.load(chatid)
+
+    def load_many(self, chatids: List[str], workers: int = 4) -> Iterator[Tuple[str, Optional[Dict[str, Any]]]]:
+        payloads = {chatid: self.__cached(chatid) for chatid in chatids}
+        stale_chatids = [chatid for chatid, payload in payloads.items() if payload is None]
+        loaded_users = dict(self.backend.load_many(stale_chatids, workers))
+
+        for chatid in chatids:
+            payload = payloads[chatid]
+            yield chatid, pickle.loads(payload) if payload is not None else loaded_users.get(chatid)
+
+    def save(self, chatid: str, data: Dict[str, Any],
+             fields: Optional[List[str]] = None) -> bool:
+        saved = self.backend.save(chatid, data, fields)
+        if saved:
+            self.__mark_saved(chatid)
+        return saved
+
+    def modified_at(self, chatid: str) -> Optional[float]:
+        return self.backend.modified_at(chatid)
+
+    def delete(self, chatid: str) -> None:
+        self.backend.delete(chatid)
+        self.__mark_saved(chatid)
+
+    def list_chatids(self) -> List[str]:
+        return self.backend.list_chatids()
+
+    def write_snapshot(self) -> bool:
+        """
+        Writes a new snapshot file.
+
+        Records of the previous snapshot are carried over unless the user has been saved since, \
+            every other user is read from the backend.
+        """
+
+        with self.write_lock:
+            with self.lock:
+                saved_chatids = self.saved_chatids
+                self.saved_chatids = set()
+                self.dirty = False
+
+            temp_snapshot_file = f"{self.snapshot_file}.tmp"
+            written_chatids = set()
+            try:
+                with open(temp_snapshot_file, "wb") as stream:
+                    pickle.dump({"created_at": time.time()}, stream, pickle.HIGHEST_PROTOCOL)
+
+                    for chatid, taken_at, payload in self.read_records(self.snapshot_file, self.logger):
+                        if chatid in saved_chatids or chatid in written_chatids:
+                            continue
+                        pickle.dump((chatid, taken_at, payload), stream, pickle.HIGHEST_PROTOCOL)
+                        written_chatids.add(chatid)
+
+                    for chatid in self.backend.list_chatids():
+                        if chatid in written_chatids:
+                            continue
+                        # Saves made while the user is read make their record stale
+                        taken_at = time.time()
+                        data = self.backend.load(chatid)
+                        if data is None:
+                            continue
+                        pickle.dump((chatid, taken_at, pickle.dumps(data, pickle.HIGHEST_PROTOCOL)),
+                                    stream, pickle.HIGHEST_PROTOCOL)
+                        written_chatids.add(chatid)
+
+                    stream.flush()
+                    if utils.fsync_policy != "never":
+                        os.fsync(stream.fileno())
+                os.replace(temp_snapshot_file, self.snapshot_file)
+            except (OSError, pickle.PickleError, TypeError, AttributeError) as exception:
+                self.logger.error("SNAPSHOT_FAILED_TO_SAVE",
+                                  f"Snapshot of users has failed to be saved ({exception}). Trying again later...")
+                with self.lock:
+                    self.saved_chatids.update(saved_chatids)
+                    self.dirty = True
+                return False
+        return True
+
+    def __run(self) -> None:
+        while not self.closed.wait(self.interval):
+            if self.dirty:
+                self.write_snapshot()
+
+    def close(self) -> None:
+        self.closed.set()
+        self.writer.join()
+
+        if self.dirty:
+            self.write_snapshot()
+        self.backend.close()
+
+
+class WriteBehindQueue():
+    """
+    This object represents a write-behind queue for saving users to a storage backend.
+
+    Saves are not written straight away. Users are marked as dirty instead and a background \
+        writer thread persists them once they have been dirty for `window` seconds. Repeated \
+        saves of the same user within that window are merged into a single write.
+
+    ---
+
+    Parameters:
+        - storage (:class:`Storage`): Storage backend to write users to.
+        - window (:obj:`float`): Optional. Number of seconds to wait for more changes before \
+            writing a dirty user. Defaults to 1 second.
+
+    ---
+
+    Notes:
+        Call `flush` to synchronously write pending users (for example when a user ends the \
+            conversation) and `close` to flush everything and stop the writer thread on shutdown.
+
+        Users that fail to be saved are marked as dirty again and retried after another window.
+
+        Users whose userdata has not changed since their last save (`UserData.changed_fields`) \
+            are not written at all.
+
+    ---
+
+    Attributes:
+        - storage (:class:`Storage`): Storage backend that users are written to.
+        - window (:obj:`float`): Number of seconds a user is left dirty before being written.
+        - pending (:class:`Dict[str, Tuple[User, float]]`): Dirty users (and the time they were \
+            first marked dirty) indexed by chatid.
+    """
+
+    def __init__(self, storage: Storage, window: float = 1.0):
+        self.storage = storage
+        self.window = window
+
+        self.pending: Dict[str, Tuple[Any, float]] = {}
+        self.closed = False
+
+        self.condition = threading.Condition()
+        # Held while taking a snapshot and writing it so that writes land in the order
+        # that their snapshots were taken.
+        self.write_lock = threading.Lock()
+
+        self.writer = threading.Thread(
+            target=self.__run, name="write-behind-queue", daemon=True)
+        self.writer.start()
+
+    def mark_dirty(self, user) -> None:
+        """
+        Marks a user to be written by the background writer thread.
+        """
+
+        with self.condition:
+            if user.chatid not in self.pending:
+                self.pending.update({user.chatid: (user, time.monotonic())})
+                self.condition.notify()
+
+    def flush(self, chatid: Optional[str] = None) -> None:
+        """
+        Synchronously writes a pending user (or every pending user if no chatid is given).
+        """
+
+        with self.write_lock:
+            with self.condition:
+                chatids = [chatid] if chatid else list(self.pending.keys())
+                users = [self.pending.pop(pending_chatid)[0]
+                         for pending_chatid in chatids if pending_chatid in self.pending]
+
+            for user in users:
+                self.__write(user)
+
+    def discard(self, chatid: str) -> None:
+        """
+        Forgets a pending user without writing it (e.g. once it has been written by another thread).
+        """
+
+        with self.condition:
+            self.pending.pop(chatid, None)
+
+    def close(self) -> None:
+        """
+        Flushes every pending user and stops the background writer thread.
+        """
+
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.writer.join()
+
+        self.flush()
+
+    def __due_chatids(self) -> List[str]:
+        deadline = time.monotonic() - self.window
+        return [chatid for chatid, (_, marked_at) in self.pending.items()
+                if marked_at <= deadline]
+
+    def __next_timeout(self) -> Optional[float]:
+        if not self.pending:
+            return None
+        oldest_marked_at = min(marked_at for _, marked_at in self.pending.values())
+        return max(0, oldest_marked_at + self.window - time.monotonic())
+
+    def __run(self) -> None:
+        while True:
+            with self.condition:
+                while not self.closed and not self.__due_chatids():
+                    self.condition.wait(self.__next_timeout())
+                if self.closed:
+                    return
+
+            with self.write_lock:
+                with self.condition:
+                    users = [self.pending.pop(chatid)[0]
+                             for chatid in self.__due_chatids()]
+
+                for user in users:
+                    # Users locked by a handler are written on the next window instead
+                    self.__write(user, blocking=False)
+
+    def __write(self, user, blocking: bool = True) -> None:
+        try:
+            user_saved = user.write_to_storage(blocking)
+        except RuntimeError:
+            # User.data was being modified by another thread, try again on the next window.
+            self.mark_dirty(user)
+            return
+
+        if not user_saved:
+            user.logger.error("USERDATA_FAILED_TO_SAVE",
+                              f"User:{user.chatid} userdata has failed to be saved. Trying again later...")
+            self.mark_dirty(user)
+
+
+def from_config(users_directory: str,
+                storage_config: Optional[Dict[str, Any]] = None,
+                logger=utils.DEFAULT_LOG) -> Storage:
+    """
+    Creates the storage backend described by the `STORAGE` section of `config.yaml`.
+
+    ---
+
+    Parameters:
+        - users_directory (:obj:`str`): Path to the users directory (`users/`).
+        - storage_config (:class:`Dict[str, Any]`): Optional. The `STORAGE` section of `config.yaml`. \
+            Defaults to the YAML backend.
+        - logger (:class:`Log`): Optional. Logging object used by the backend.
+
+    ---
+
+    Returns:
+        (:class:`Storage`): Returns the storage backend.
+
+    ---
+
+    Example:
+        >>> storage: Storage = from_config(
+                users_directory="users",
+                storage_config={"BACKEND": "sqlite", "SQLITE_FILE": "users/users.db", "FORMAT": "json",
+                                "LAYOUT": "sharded"}
+            )
+    """
+
+    storage_config = storage_config or {}
+    backend = storage_config.get("BACKEND", "yaml")
+
+    assert backend in STORAGE_BACKENDS, f"Unknown STORAGE:BACKEND: {backend}. "\
+        f"Supported backends are: {', '.join(STORAGE_BACKENDS)}"
+
+    file_format = storage_config.get("FORMAT", "yaml")
+    layout = storage_config.get("LAYOUT", "flat")
+
+    if backend == "sqlite":
+        return SqliteStorage(
+            users_directory,
+            storage_config.get("SQLITE_FILE", DEFAULT_SQLITE_FILE),
+            file_format,
+            logger,
+            layout)
+    return FileStorage(
+        users_directory,
+        file_format,
+        logger,
+        layout,
+        storage_config.get("MANIFEST_FILE", DEFAULT_MANIFEST_FILE))
@@ -1,15 +1,301 @@
 import sys
 import os
 import copy
+import time
 import logging
-
-from typing import (List, Dict, Any, Union)
-
+import datetime
+import functools
+import threading
+import contextlib
+from collections import OrderedDict
+from concurrent.futures import (Future, ThreadPoolExecutor)
+
+from typing import (List, Dict, Any, Callable, Iterable, Set, Union, Optional)
+
+import storage
+import journal
+from storage import (Storage, SnapshotStorage, WriteBehindQueue)
+from journal import Journal
+from ban_list import (BanList, DEFAULT_BAN_LOG_FILE)
 from utils import utils
-from utils.log import Log
+from utils.log import (Log, LogFilePool, PooledFileHandler, PooledLog, EventFileHandler,
+                       FORMATTER, async_handler)
 
 users_directory = utils.get_dir_or_create(os.path.join("users"))
 banned_users_yaml_file = os.path.join(users_directory, "banned_users.yaml")
+DEFAULT_INDEX_FILE = os.path.join(users_directory, "index.json")
+DEFAULT_EVENTS_FILE = os.path.join("logs", "events.jsonl")
+# Values that are never modified in place and do not need to be copied
+IMMUTABLE_TYPES = (str, int, float, bool, type(None), bytes, datetime.date, datetime.time)
+
+
+class TrackedDict(dict):
+    """
+    A `dict` nested in `UserData` that reports its changes to the top-level field it belongs to.
+
+    Dicts and lists stored in it are converted to tracked containers as well, and copies of it \
+        (`copy.copy`, `copy.deepcopy`, `pickle`) are plain dicts.
+    """
+
+    def __init__(self, touch: Callable[[], None], value: Dict[str, Any]):
+        super().__init__()
+        self.touch = touch
+        for key, item in value.items():
+            super().__setitem__(key, track(item, touch))
+
+    def __setitem__(self, key, value) -> None:
+        super().__setitem__(key, track(value, self.touch))
+        self.touch()
+
+    def __delitem__(self, key) -> None:
+        super().__delitem__(key)
+        self.touch()
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def update(self, *args, **kwargs) -> None:
+        for key, value in dict(*args, **kwargs).items():
+            super().__setitem__(key, track(value, self.touch))
+        self.touch()
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def pop(self, *args):
+        self.touch()
+        return super().pop(*args)
+
+    def popitem(self):
+        self.touch()
+        return super().popitem()
+
+    def clear(self) -> None:
+        super().clear()
+        self.touch()
+
+    def __copy__(self) -> Dict[str, Any]:
+        return dict(self)
+
+    def __deepcopy__(self, memo) -> Dict[str, Any]:
+        return untrack(self)
+
+    def __reduce__(self):
+        return (dict, (untrack(self),))
+
+
+class TrackedList(list):
+    """
+    A `list` nested in `UserData` that reports its changes to the top-level field it belongs to.
+
+    Dicts and lists stored in it are converted to tracked containers as well, and copies of it \
+        (`copy.copy`, `copy.deepcopy`, `pickle`) are plain lists.
+    """
+
+    def __init__(self, touch: Callable[[], None], value: List[Any]):
+        super().__init__(track(item, touch) for item in value)
+        self.touch = touch
+
+    def __setitem__(self, index, value) -> None:
+        if isinstance(index, slice):
+            value = [track(item, self.touch) for item in value]
+        else:
+            value = track(value, self.touch)
+        super().__setitem__(index, value)
+        self.touch()
+
+    def __delitem__(self, index) -> None:
+        super().__delitem__(index)
+        self.touch()
+
+    def __iadd__(self, other):
+        self.extend(other)
+        return self
+
+    def __imul__(self, other):
+        super().__imul__(other)
+        self.touch()
+        return self
+
+    def append(self, value) -> None:
+        super().append(track(value, self.touch))
+        self.touch()
+
+    def extend(self, values) -> None:
+        super().extend(track(value, self.touch) for value in values)
+        self.touch()
+
+    def insert(self, index, value) -> None:
+        super().insert(index, track(value, self.touch))
+        self.touch()
+
+    def pop(self, *args):
+        self.touch()
+        return super().pop(*args)
+
+    def remove(self, value) -> None:
+        super().remove(value)
+        self.touch()
+
+    def clear(self) -> None:
+        super().clear()
+        self.touch()
+
+    def sort(self, *args, **kwargs) -> None:
+        super().sort(*args, **kwargs)
+        self.touch()
+
+    def reverse(self) -> None:
+        super().reverse()
+        self.touch()
+
+    def __copy__(self) -> List[Any]:
+        return list(self)
+
+    def __deepcopy__(self, memo) -> List[Any]:
+        return untrack(self)
+
+    def __reduce__(self):
+        return (list, (untrack(self),))
+
+
+def track(value: Any, touch: Callable[[], None]) -> Any:
+    """
+    Returns the value with its dicts and lists converted to tracked containers that call `touch` \
+        when they are modified.
+    """
+
+    if isinstance(value, dict):
+        return TrackedDict(touch, value)
+    if isinstance(value, list):
+        return TrackedList(touch, value)
+    return value
+
+
+def untrack(value: Any) -> Any:
+    """
+    Returns a deep copy of the value made of plain dicts and lists.
+    """
+
+    if isinstance(value, dict):
+        return {key: untrack(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [untrack(item) for item in value]
+    if isinstance(value, IMMUTABLE_TYPES):
+        return value
+    return copy.deepcopy(value)
+
+
+class UserData(dict):
+    """
+    This object represents the userdata of a User (`User.data`).
+
+    It behaves exactly like a `dict` but also keeps track of the top-level fields (`username`, \
+        `ctf_state`, `guardian_state`, ...) that have been modified since they were last persisted. \
+        This lets `User.save_to_file` skip saves when nothing has changed and only hand the changed \
+        fields to the storage backend.
+
+    ---
+
+    Parameters:
+        - Same as :class:`dict`.
+
+    ---
+
+    Notes:
+        Nested changes (for example `user.data["ctf_state"]["total_score"] = 10`) are detected \
+            too: dicts and lists stored in the userdata are converted to tracked containers \
+            (`TrackedDict`, `TrackedList`) that mark their top-level field as changed.
+
+        As they are converted, containers are copied when they are stored. Read them back from the \
+            userdata before modifying them:
+
+            >>> challenges_progress.update({challenge_id: progress})
+                progress = challenges_progress[challenge_id]
+
+        Fields that are removed from the userdata are reported as changed so that backends can \
+            remove them as well.
+
+    ---
+
+    Attributes:
+        - changed (:class:`Set[str]`): Top-level fields modified since they were last persisted.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__()
+        self.changed: Set[str] = set()
+        self.update(*args, **kwargs)
+
+    def __toucher(self, field: str) -> Callable[[], None]:
+        return functools.partial(self.changed.add, field)
+
+    def __setitem__(self, field, value) -> None:
+        super().__setitem__(field, track(value, self.__toucher(field)))
+        self.changed.add(field)
+
+    def __delitem__(self, field) -> None:
+        super().__delitem__(field)
+        self.changed.add(field)
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def update(self, *args, **kwargs) -> None:
+        for field, value in dict(*args, **kwargs).items():
+            self[field] = value
+
+    def setdefault(self, field, default=None):
+        if field not in self:
+            self[field] = default
+        return self[field]
+
+    def pop(self, field, *args):
+        self.changed.add(field)
+        return super().pop(field, *args)
+
+    def popitem(self):
+        field, value = super().popitem()
+        self.changed.add(field)
+        return field, value
+
+    def clear(self) -> None:
+        self.changed.update(self)
+        super().clear()
+
+    def changed_fields(self) -> List[str]:
+        """
+        Returns the top-level fields that have changed (or been removed) since they were last persisted.
+        """
+
+        return list(self.changed)
+
+    def mark_changed(self, fields: Iterable[str]) -> None:
+        """
+        Records the given fields as changed, for example when they failed to be persisted.
+        """
+
+        self.changed.update(fields)
+
+    def mark_saved(self, fields: Iterable[str]) -> None:
+        """
+        Records the given fields as persisted.
+        """
+
+        self.changed.difference_update(fields)
+
+    def snapshot(self, fields: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+        """
+        Returns a deep copy made of plain dicts and lists of the given fields (or of every field), \
+            leaving out the fields that have been removed.
+        """
+
+        fields = self.keys() if fields is None else fields
+        return {field: untrack(self[field]) for field in fields if field in self}
 
 
 class User():
@@ -40,53 +326,80 @@ class User():
     ---
 
     Attributes:
-        - logger (:class:`Log`): Logging object that only this User object will use.
+        - logger (:class:`PooledLog`): Logging object that only this User object will use (writes to \
+            `log_file` through `UserManager.user_log_handler`).
         - user_manager: (:class:`UserManager`): UserManager object that this User object is part of.
 
         - chatid (:obj:`str`): Unique chatid of the user account (in relation to the bot).
-        - data (:class:`Dict[str, Any]`): Dict of userdata, typically data is bundled into states.
-        - is_banned: (:obj:`bool`): Whether the User is a banned user.
+        - data (:class:`UserData`): Dict of userdata, typically data is bundled into states.
+        - lock (:class:`threading.RLock`): Lock held while User.data is modified or saved. Stages \
+            should hold it around any read-modify-write of User.data (see `Notes`).
+        - is_banned: (:obj:`bool`): Whether the User is a banned user (read from `UserManager.banned_users`).
 
         - answered_callback_queries: (:class:`List[str]`): List of CallbackQuery that have been answered.
 
         - directory (:obj:`str`): Path to User files in the users directory.
         - log_file (:obj:`str`): Path to log file in the User directory.
-        - yaml_file (:obj:`str`): Path to data file in the User directory.
 
+    ---
+
+    Notes:
+        Updates of different users are handled in parallel, and other users (e.g. admins) may \
+            modify a user at the same time. Changes that read User.data before writing to it \
+            should therefore hold the user's lock:
+
+            >>> with user.lock:
+                    guardian_state = user.data.get("guardian_state")
+                    guardian_state["options_picked"].append(option_selected)
+                    user.save_to_file()
+
+        The lock is reentrant, @User.apply_event, @User.update_user_data and @User.save_to_file \
+            already hold it.
     """
 
     def __init__(self, chatid: str,
                  application_logfilehandler: logging.FileHandler,
                  user_manager):
-        self.logger = Log(
-            name=f"user:{chatid}",
-            stream_handle=sys.stdout,
-            log_level=logging.INFO
-        )
         self.user_manager = user_manager
 
         self.chatid = chatid
-        self.data: Dict[str, Any] = {}
-        self.is_banned = False
+        self.data: UserData = UserData()
+        self.lock = threading.RLock()
 
         self.answered_callback_queries: List[str] = []
 
-        self.directory = os.path.join(users_directory, chatid)
-        user_exists = os.path.isdir(self.directory)
+        self.directory = user_manager.storage.user_directory(chatid)
+        user_exists = os.path.isdir(
+            self.directory) or user_manager.storage.exists(chatid)
         self.directory = utils.get_dir_or_create(self.directory)
 
         self.log_file = os.path.join(self.directory, f"{self.chatid}.log")
-        self.logger.add_filehandle(self.log_file)
+        self.logger = PooledLog(
+            name=f"user:{chatid}",
+            file_path=self.log_file,
+            file_handler=user_manager.user_log_handler,
+            stream_handler=user_manager.user_stream_handler,
+            log_level=logging.INFO
+        )
+        self.logger.add_filehandler(user_manager.user_event_handler)
 
         if user_exists:
-            self.yaml_file = self.__load_from_file()
+            self.__load_from_file()
         else:
-            self.yaml_file = self.__set_to_default_user_data()
+            self.__set_to_default_user_data()
+
+        if user_manager.journal:
+            self.__replay_journal()
 
+        # Only writes the user if they are new or their userdata had to be reset / updated
         self.save_to_file()
         if user_manager.log_user_logs_to_app_logs:
             self.logger.add_filehandler(application_logfilehandler)
 
+    @property
+    def is_banned(self) -> bool:
+        return self.chatid in self.user_manager.banned_users
+
     def __set_to_default_user_data(self) -> None:
         """
         Internal private function to set its user data to default values.
@@ -107,25 +420,54 @@ class User():
             It is better to call @User.reset_user if you wish to reset user's data as \
                 it also includes saving the changes to file.
         """
-        self.logger.info("CREATING_NEW_USER",
-                         f"User:{self.chatid} is a new user. Creating their files...")
-
-        user_data: Dict[str, Any] = copy.deepcopy(
-            self.user_manager.data_fields)
+        self.logger.event("CREATING_NEW_USER",
+                          f"User:{self.chatid} is a new user. Creating their files...",
+                          action="INIT_USER", chatid=self.chatid)
+
+        user_data = UserData(copy.deepcopy(self.user_manager.data_fields))
+        user_data.update(
+            {"_schema_version": self.user_manager.get_schema_version()})
+        # Fields of the previous userdata are reported as changed so that stale fields are removed
+        user_data.mark_changed(self.data.keys())
+        user_data.mark_changed(self.data.changed_fields())
         self.data = user_data
 
-        return os.path.join(self.directory, f"{self.chatid}.yaml")
+    def __update_user_data_from_file(self) -> None:
+        """
+        Internal private function to bring userdata loaded from file up to date.
+
+        Applies the migrations (`UserManager.add_migration`) that the loaded userdata is missing and \
+            adds any data field (`UserManager.add_data_field`) registered since it was saved.
+
+        ---
+
+        Parameters:
+            - None
+
+        ---
+
+        Returns:
+            (:obj:`None`)
+        """
 
-    def __update_user_data_from_file(self, user_data: Dict[str, Any]) -> Dict:
-        # TODO Update outdated user data with new data fields (user_manager.data_fields)
-        return user_data
+        schema_version = self.data.get("_schema_version", 0)
+        try:
+            migrations_applied = self.user_manager.migrate_user_data(self.data)
+        except Exception as exception:
+            self.logger.error("USERDATA_FAILED_TO_MIGRATE",
+                              f"""User:{self.chatid} userdata failed to be migrated from schema version {self.data.get("_schema_version", 0)}: {exception}""")
+            return
+
+        if migrations_applied:
+            self.logger.info("USERDATA_MIGRATED",
+                             f"""User:{self.chatid} userdata was migrated from schema version {schema_version} to {self.data["_schema_version"]}.""")
 
     def __load_from_file(self) -> None:
         """
         Internal private function to load user from file.
 
-        This function will read existing user/[chatid]/[chatid].yaml file and load its content \
-            into user.data if successful.
+        This function will read the existing userdata from storage (`UserManager.storage`) and load \
+            its content into user.data if successful.
 
         ---
 
@@ -148,21 +490,20 @@ class User():
         self.logger.info(
             "NEW_SESSION", f"User:{self.chatid} is starting a new session and resuming their progress...")
 
-        user_yaml_file = os.path.join(self.directory, f"{self.chatid}.yaml")
-        user_yaml_file_exists = os.path.isfile(user_yaml_file)
+        user_data_exists = self.user_manager.storage.exists(self.chatid)
+        user_data = self.user_manager.storage.load(
+            self.chatid) if user_data_exists else None
 
-        user_data = utils.load_yaml_file(
-            user_yaml_file, self.logger) if user_yaml_file_exists else None
+        if user_data_exists and user_data is not None:
+            self.data = UserData(user_data)
+            self.data.mark_saved(user_data.keys())
 
-        if user_yaml_file_exists and user_data is not None:
             # Update their saved data in case of format changes
-            self.data = self.__update_user_data_from_file(user_data)
+            self.__update_user_data_from_file()
             self.logger.info("LOADED_USER_FROM_FILE",
                              f"Loaded User:{self.chatid} from file.")
-
-            return user_yaml_file
         else:
-            if not user_yaml_file_exists:
+            if not user_data_exists:
                 self.logger.error(
                     "USERDATA_MISSING", f"User:{self.chatid} userdata is missing. Creating a new one...")
             else:
@@ -170,13 +511,136 @@ class User():
                     "USERDATA_CORRUPTED", f"User:{self.chatid} userdata is corrupted! Resetting his/her state...")
 
             # Create new user since their old data could not be found / loaded
-            return self.__set_to_default_user_data()
+            self.__set_to_default_user_data()
+
+    def __reduce_event(self, event: Dict[str, Any]) -> None:
+        self.user_manager.event_reducers[event["event"]](self.data, event)
+
+    def __replay_journal(self) -> None:
+        """
+        Internal private function to replay the events in the journal that are not yet part of \
+            the loaded userdata (snapshot).
+
+        ---
+
+        Parameters:
+            - None
+
+        ---
+
+        Returns:
+            (:obj:`None`)
+
+        ---
+
+        Notes:
+            The replayed userdata is written to storage straight away (while the journal is locked) \
+                so that the replayed events can be safely compacted.
+        """
+
+        user_journal = self.user_manager.journal
+        with user_journal.lock:
+            events = user_journal.pop_tail(self.chatid)
+            last_seq = self.data.get("_journal_seq", 0)
+
+            replayed_events = 0
+            for event in events:
+                if event["seq"] <= last_seq:
+                    continue
+                try:
+                    self.__reduce_event(event)
+                except Exception as exception:
+                    self.logger.error("JOURNAL_EVENT_FAILED_TO_REPLAY",
+                                      f"User:{self.chatid} event {event} could not be replayed: {exception}")
+                self.data.update({"_journal_seq": event["seq"]})
+                replayed_events += 1
+
+            if replayed_events:
+                self.logger.info("REPLAYED_JOURNAL",
+                                 f"User:{self.chatid} has {replayed_events} events replayed from the journal.")
+                if not self.write_to_storage():
+                    # Keep the events around so that they are not compacted away
+                    user_journal.tail.update({self.chatid: events})
+
+    def apply_event(self, event: str, **payload: Any) -> Dict[str, Any]:
+        """
+        Helper function to modify user data through a state-change event.
+
+        The event is reduced into User.data by the reducer registered for it (`UserManager.add_event_reducer`).
+
+        If the journal is enabled (`STORAGE:JOURNAL`), the event is appended to the journal instead of \
+            saving the userdata to file. The userdata is then only saved when the journal is compacted.
+        Otherwise, this function will save changes to file for you (@User.save_to_file).
+
+        ---
+
+        Parameters:
+            - event (:obj:`str`): Name of the event (e.g `solved`).
+            - payload (:class:`Any`): Keyword arguments that make up the payload of the event. \
+                Must be JSON serializable.
+
+        ---
+
+        Returns:
+            (:class:`Dict[str, Any]`): Returns the applied event.
+
+        ---
+
+        Notes:
+            Reducers must only depend on the event and the userdata, as they are also used to replay \
+                the journal when the bot is restarted. Anything else (e.g. points awarded) should be \
+                part of the payload.
+
+            The timestamp of the event is available to reducers as `event["ts"]` (ISO 8601 string).
+
+        ---
+
+        Example:
+            >>> user: User = ....
+                user.apply_event("solved", challenge=challenge_number, points=10)
+        """
+
+        assert event in self.user_manager.event_reducers, f"No reducer registered for event: {event}"
+
+        event_data: Dict[str, Any] = {
+            "ts": datetime.datetime.now().isoformat(),
+            "chatid": self.chatid,
+            "event": event,
+            **payload
+        }
+
+        user_journal = self.user_manager.journal
+        if not user_journal:
+            with self.lock:
+                self.__reduce_event(event_data)
+                self.save_to_file()
+            return event_data
+
+        with self.lock:
+            with user_journal.lock:
+                user_journal.append(event_data)
+                self.__reduce_event(event_data)
+                self.data.update({"_journal_seq": event_data["seq"]})
+            self.user_manager.update_index(self.chatid, self.data)
+
+        if user_journal.needs_compaction():
+            # Compacted by UserManager.compactor, off the handler's thread
+            self.user_manager.compaction_requested.set()
+        return event_data
 
     def save_to_file(self) -> None:
         """
         Helper function to save user to file.
 
-        This function will dump User.data into its yaml file: users/[chatid]/[chatid].yaml
+        This function will dump User.data into the storage backend (`UserManager.storage`).
+
+        With the default backend, this is its yaml file: users/[chatid]/[chatid].yaml
+
+        Only the top-level fields of User.data that have changed since the last save are handed \
+            to the storage backend and nothing is written at all if no field has changed.
+
+        If the write-behind queue is enabled (`STORAGE:WRITE_BEHIND`), the user is only marked as dirty \
+            and written shortly after by a background thread (`UserManager.save_queue`).
 
         ---
 
@@ -193,7 +657,7 @@ class User():
         Notes:
             Currently if data fails to be saved to file, only an error message is shown.
 
-            It will not retry to save the user's data.
+            It will not retry to save the user's data unless the write-behind queue is enabled.
 
         ---
 
@@ -203,10 +667,65 @@ class User():
                 user.save_to_file()
         """
 
-        if not utils.dump_to_yaml_file(
-                self.data, self.yaml_file, self.logger):
-            self.logger.error("USERDATA_FAILED_TO_SAVE",
-                              f"User:{self.chatid} userdata has failed to be saved. Trying again later...")
+        with self.lock:
+            self.user_manager.update_index(self.chatid, self.data)
+
+            if self.user_manager.save_queue:
+                self.user_manager.save_queue.mark_dirty(self)
+            elif not self.write_to_storage():
+                self.logger.error("USERDATA_FAILED_TO_SAVE",
+                                  f"User:{self.chatid} userdata has failed to be saved. Trying again later...")
+
+    def write_to_storage(self, blocking: bool = True) -> bool:
+        """
+        Synchronously writes the changed fields of User.data to the storage backend.
+
+        ---
+
+        Parameters:
+            - blocking (:obj:`bool`): Optional. Whether to wait for the user's lock if another thread \
+                holds it. Defaults to True.
+
+        ---
+
+        Returns:
+            (:obj:`bool`): Returns whether the userdata is saved (True if nothing has changed).
+
+        ---
+
+        Notes:
+            This bypasses the write-behind queue, use @User.save_to_file instead.
+
+            If the journal is enabled, the snapshot is taken and written while the journal is \
+                locked so that it is always consistent with `User.data["_journal_seq"]`.
+
+            Raises a RuntimeError if `blocking` is False and User.data is being modified by another \
+                thread. Background threads (write-behind queue, journal compaction, eviction) never wait \
+                for the lock so that they cannot deadlock with a handler holding it.
+        """
+
+        if not self.lock.acquire(blocking=blocking):
+            raise RuntimeError(f"User:{self.chatid} is locked by another thread.")
+
+        user_journal = self.user_manager.journal
+        user_storage = self.user_manager.storage
+        try:
+            with user_journal.lock if user_journal else contextlib.nullcontext():
+                changed_fields = self.data.changed_fields()
+                if not changed_fields:
+                    return True
+
+                # Only the fields being written are copied
+                data = self.data.snapshot(
+                    changed_fields if user_storage.partial_writes else None)
+                # Marked before writing so that changes made meanwhile are written next time
+                self.data.mark_saved(changed_fields)
+                if not user_storage.save(self.chatid, data, changed_fields):
+                    self.data.mark_changed(changed_fields)
+                    return False
+                return True
+        finally:
+            self.lock.release()
 
     def update_user_data(self, data_label: str, data_value: Any) -> None:
         """
@@ -277,8 +796,9 @@ class User():
             Refer to Notes section above.
         """
 
-        self.data.update({data_label: data_value})
-        self.save_to_file()
+        with self.lock:
+            self.data.update({data_label: data_value})
+            self.save_to_file()
 
     def reset_user(self) -> None:
         """
@@ -303,8 +823,9 @@ class User():
                 user.reset_user()
         """
 
-        self.__set_to_default_user_data()
-        self.save_to_file()
+        with self.lock:
+            self.__set_to_default_user_data()
+            self.save_to_file()
 
 
 class UserManager():
@@ -336,18 +857,56 @@ class UserManager():
         This is due to `UserManager` being a `Singleton` class, we would want to prevent \
             multiple initialization of the class object.
 
+        Users are loaded on demand (@UserManager.new_user / @UserManager.get_from_chatid) and only \
+            the `USERS:MAX_RESIDENT` most recently used users are kept in memory. Code that needs to go \
+            through every user (e.g. leaderboards) should use the user index (@UserManager.get_index) \
+            instead of loading every user.
+
     ---
 
     Attributes:
         - logger (:class:`Log`): Logging object that the UserManager will use (same Logger used by Bot).
         - application_logfilehandler (:class:`logging.FileHandler`): Log file handler used by Bot.
+        - user_log_handler (:class:`PooledFileHandler`|:class:`QueuedHandler`): Handler shared by every User to write to their \
+            own log file. At most `USERS:LOG_MAX_OPEN_FILES` user log files are kept open and files idle \
+            for `USERS:LOG_IDLE_TIMEOUT` seconds are closed.
+        - user_stream_handler (:class:`logging.StreamHandler`|:class:`QueuedHandler`): Handler shared by \
+            every User to log to stdout.
+        - user_event_handler (:class:`EventFileHandler`|:class:`QueuedHandler`): Handler shared by every \
+            User to write their events (@Log.event) to `LOGGING:EVENTS_FILE`.
         - log_user_logs_to_app_logs (:obj:`bool`): Whether to log user logs to application logs as well \
             (can cause too much logs if set to True).
 
-        - users (:class:`Dict[str, User`): Dict of registered User objects where chatid is used as the key.
+        - storage (:class:`Storage`): Storage backend used to read and write User.data.
+        - save_queue (:class:`WriteBehindQueue`|:obj:`None`): Write-behind queue used to save users \
+            if enabled (`STORAGE:WRITE_BEHIND`), else None.
+        - journal (:class:`Journal`|:obj:`None`): Journal of user state-change events if enabled \
+            (`STORAGE:JOURNAL`), else None.
+        - compactor (:class:`threading.Thread`|:obj:`None`): Thread that compacts the journal once \
+            `compaction_requested` is set (@UserManager.compact_journal), None without a journal.
+
+        - users (:class:`OrderedDict[str, User]`): Resident User objects where chatid is used as the key \
+            (least recently used first).
+        - users_lock (:class:`threading.RLock`): Lock held while adding or removing resident users. \
+            It is never held while a user is being loaded or written to storage.
+        - loading_users (:class:`Dict[str, Future]`): Users being loaded (@UserManager.new_user), \
+            resolved to the User once loaded (or to None once reset, see @UserManager.reset_user).
+        - max_resident_users (:obj:`int`): Maximum number of resident users (`USERS:MAX_RESIDENT`), 0 for no limit.
         - data_fields (:class:`Dict[str, Any]`):  Dict of user data that is used by registered `stages`.
-
-        - banned_users (:class:`List[str]`):  List of chatids belonging to banned users.
+        - event_reducers (:class:`Dict[str, Callable]`):  Dict of reducers (indexed by event) that apply \
+            state-change events to user data (`User.apply_event`).
+        - migrations (:class:`Dict[int, Callable]`):  Dict of migrations (indexed by schema version) that \
+            upgrade saved user data to the latest schema (`UserManager.add_migration`).
+
+        - index (:class:`Dict[str, Dict[str, Any]]`): Index of every known user (resident or not), \
+            indexed by chatid. Each entry holds the values of the index fields (@UserManager.add_index_field).
+        - index_fields (:class:`Dict[str, Callable]`): Functions that compute each index field from user data.
+        - index_file (:obj:`str`): Path to the file that the index is persisted to (`USERS:INDEX_FILE`).
+        - index_writer (:class:`threading.Thread`): Thread that persists the index every \
+            `USERS:INDEX_WRITE_INTERVAL` seconds if it has changed (@UserManager.write_index).
+
+        - banned_users (:class:`BanList`):  Set of chatids belonging to banned users (`users/banned_users.yaml` \
+            and the log of bans / unbans made since it was last compacted).
     """
 
     def new_user(self, chatid: str) -> User:
@@ -356,6 +915,12 @@ class UserManager():
 
         This function will a new User object with the given chatid and keep a reference to it.
 
+        Existing users are loaded from storage, and the least recently used users are evicted if \
+            there are more than `USERS:MAX_RESIDENT` resident users.
+
+        Users are loaded outside of `users_lock` so that different users load in parallel. Concurrent \
+            calls for a user that is being loaded wait for that load instead of loading it again.
+
         ---
 
         Parameters:
@@ -381,26 +946,110 @@ class UserManager():
                 user: User = user_manager.new_user(chatid="CHATID")
         """
 
-        # self.update_banned_list()
-        if chatid not in self.users:
-            self.logger.info("CREATING_USER_CLASS",
-                             f"Creating UserClass for User:{chatid}.")
-            user = User(chatid, self.application_logfilehandler, self)
+        while True:
+            with self.users_lock:
+                user = self.users.get(chatid)
+                if user:
+                    self.users.move_to_end(chatid)
+                    break
+
+                loading = self.loading_users.get(chatid)
+                if loading is None:
+                    loading = Future()
+                    self.loading_users.update({chatid: loading})
+                    break
+
+            # Another thread is loading (or resetting) the user, retried if it failed to or once reset
+            try:
+                loaded_user = loading.result()
+            except Exception:
+                continue
+            if loaded_user:
+                return loaded_user
 
-            if chatid in self.banned_users:
-                user.is_banned = True
+        if user:
+            self.logger.debug("USING_CACHED_USER_CLASS",
+                              f"Using cached UserClass for User:{chatid}.")
+            return user
 
+        self.logger.info("CREATING_USER_CLASS",
+                         f"Creating UserClass for User:{chatid}.")
+        try:
+            user = User(chatid, self.application_logfilehandler, self)
+        except Exception as exception:
+            with self.users_lock:
+                self.loading_users.pop(chatid)
+            loading.set_exception(exception)
+            raise
+
+        with self.users_lock:
             self.users.update({chatid: user})
-            return user
-        else:
-            self.logger.info("USING_CACHED_USER_CLASS",
-                             f"Using cached UserClass for User:{chatid}.")
-            return self.users.get(chatid)
+            self.loading_users.pop(chatid)
+        loading.set_result(user)
+
+        self.__evict_idle_users()
+        return user
+
+    def __evict_idle_users(self) -> None:
+        """
+        Internal private function to evict the least recently used users above `USERS:MAX_RESIDENT`.
+
+        ---
+
+        Parameters:
+            - None
+
+        ---
+
+        Returns:
+            (:obj:`None`)
+
+        ---
+
+        Notes:
+            Evicted users are written to storage first. A user that fails to be written, or whose \
+                lock is held by another thread (in use), is kept in memory and eviction is retried \
+                the next time a user is loaded.
+        """
+
+        while True:
+            with self.users_lock:
+                if not self.max_resident_users or len(self.users) <= self.max_resident_users:
+                    return
+                chatid, user = next(iter(self.users.items()))
+
+            user_saved = user.lock.acquire(blocking=False)
+            if user_saved:
+                try:
+                    # Written here rather than flushed through the write-behind queue, which would
+                    # wait for its write_lock while holding the user's lock
+                    user_saved = user.write_to_storage()
+                    if user_saved and self.save_queue:
+                        self.save_queue.discard(chatid)
+                finally:
+                    user.lock.release()
+
+            with self.users_lock:
+                if not user_saved:
+                    self.logger.error("USER_FAILED_TO_EVICT",
+                                      f"User:{chatid} could not be saved and will not be evicted.")
+                    if self.users.get(chatid) is user:
+                        self.users.move_to_end(chatid)
+                    return
+
+                if self.users.get(chatid) is not user:
+                    continue
+                self.users.pop(chatid)
+            user.logger.quit()
+            self.logger.debug("EVICTED_USER_CLASS",
+                              f"Evicted idle UserClass for User:{chatid}.")
 
     def get_from_chatid(self, chatid: str) -> Union[User, None]:
         """
         Returns an existing User by chatid if found, else None.
 
+        Users that are not resident are loaded from storage.
+
         ---
 
         Parameters:
@@ -424,14 +1073,24 @@ class UserManager():
                 # target_user1 --> None
         """
 
-        return self.users.get(chatid)
+        with self.users_lock:
+            user_exists = chatid in self.users or chatid in self.loading_users
+        with self.index_lock:
+            user_exists = user_exists or chatid in self.index
+
+        if user_exists or self.storage.exists(chatid):
+            return self.new_user(chatid)
+        return None
 
     def get_users(self) -> Dict[str, User]:
         """
-        Get a Dict containing all the created users.
+        Get a Dict containing all the resident (loaded) users.
 
         Each user can be indexed using their chatid.
 
+        Users that are not used often may not be resident, use @UserManager.get_index to go through \
+            every user instead.
+
         ---
 
         Parameters:
@@ -440,7 +1099,8 @@ class UserManager():
         ---
 
         Returns:
-            (:class:`Dict[str, User]`): Returns a Dict containing all created users, indexed with their chatid.
+            (:class:`Dict[str, User]`): Returns a copy of the Dict containing all resident users, indexed \
+                with their chatid.
 
         ---
 
@@ -455,7 +1115,173 @@ class UserManager():
                     # ...
         """
 
-        return self.users
+        with self.users_lock:
+            return dict(self.users)
+
+    def get_index(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Get the index of every known user (resident or not).
+
+        Each entry holds the index fields (@UserManager.add_index_field) of a user and is indexed \
+            using their chatid.
+
+        ---
+
+        Parameters:
+            - None
+
+        ---
+
+        Returns:
+            (:class:`Dict[str, Dict[str, Any]]`): Returns a copy of the user index.
+
+        ---
+
+        Example:
+            >>> user_manager.add_index_field("username", lambda user_data: user_data.get("username"))
+                # ...
+                for chatid, index_entry in user_manager.get_index().items():
+                    print(chatid, index_entry.get("username"))
+        """
+
+        with self.index_lock:
+            return dict(self.index)
+
+    def add_index_field(self, label: str, getter: Callable[[Dict[str, Any]], Any]) -> None:
+        """
+        Adds a field to the user index.
+
+        The index holds a few small values for every user so that going through every user \
+            (e.g. for a leaderboard) does not require them to be loaded.
+
+        ---
+
+        Parameters:
+            - label (:obj:`str`): Key of the field in each index entry.
+            - getter (:class:`Callable[[Dict[str, Any]], Any]`): Function that returns the value of \
+                the field from user data.
+
+        ---
+
+        Returns:
+            (:obj:`None`)
+
+        ---
+
+        Notes:
+            This function is generally called within a Stage (@init_users_data).
+
+            Index fields are updated whenever a user is saved (@User.save_to_file) or applies \
+                an event (@User.apply_event), values should therefore be small and cheap to compute.
+
+        ---
+
+        Example:
+            >>> self.user_manager.add_index_field(
+                    "total_score", lambda user_data: user_data["ctf_state"]["total_score"])
+        """
+
+        self.index_fields.update({label: getter})
+
+    def update_index(self, chatid: str, user_data: Dict[str, Any]) -> None:
+        """
+        Updates the index entry of a user from their user data.
+
+        Only the in-memory index is updated, it is persisted by the `index-writer` thread at most \
+            once every `USERS:INDEX_WRITE_INTERVAL` seconds (and when the UserManager quits).
+        """
+
+        index_entry = {}
+        for label, getter in self.index_fields.items():
+            try:
+                index_entry.update({label: getter(user_data)})
+            except (KeyError, IndexError, TypeError):
+                index_entry.update({label: None})
+
+        with self.index_lock:
+            if self.index.get(chatid) == index_entry:
+                return
+            self.index.update({chatid: index_entry})
+            self.index_dirty = True
+
+    def write_index(self) -> None:
+        """
+        Writes the user index to file (`USERS:INDEX_FILE`) if it has changed.
+        """
+
+        with self.index_lock:
+            if not self.index_dirty:
+                return
+            index = dict(self.index)
+            self.index_dirty = False
+
+        if not utils.dump_to_file(index, self.index_file, "json", self.logger):
+            self.logger.error("USER_INDEX_FAILED_TO_SAVE",
+                              "User index has failed to be saved. Trying again later...")
+            with self.index_lock:
+                self.index_dirty = True
+
+    def __run_index_writer(self) -> None:
+        while not self.index_writer_closed.wait(self.index_write_interval):
+            self.write_index()
+
+    def reset_user(self, chatid: str) -> None:
+        """
+        Resets a user (resident or not) to default values.
+
+        Users that are not resident are reset directly in storage, without being loaded.
+
+        ---
+
+        Parameters:
+            - chatid (:obj:`str`): Unique chatid of the user account (in relation to the bot).
+
+        ---
+
+        Returns:
+            (:obj:`None`)
+        """
+
+        with self.users_lock:
+            user_is_loaded = chatid in self.users or chatid in self.loading_users
+            if not user_is_loaded:
+                # Loads of the user wait for the reset (see @UserManager.new_user)
+                resetting = Future()
+                self.loading_users.update({chatid: resetting})
+
+        if user_is_loaded:
+            self.new_user(chatid).reset_user()
+            return
+
+        try:
+            self.__reset_stored_user(chatid)
+        finally:
+            with self.users_lock:
+                self.loading_users.pop(chatid)
+            resetting.set_result(None)
+
+    def __reset_stored_user(self, chatid: str) -> None:
+        """
+        Internal private function to reset a user that is not resident directly in storage.
+
+        Called while the user is registered in `loading_users` so that the user cannot be loaded \
+            while being reset.
+        """
+
+        user_data: Dict[str, Any] = copy.deepcopy(self.data_fields)
+        user_data.update({"_schema_version": self.get_schema_version()})
+        with self.journal.lock if self.journal else contextlib.nullcontext():
+            if self.journal:
+                # Events of the user in the journal are outdated by the reset
+                self.journal.pop_tail(chatid)
+                user_data.update({"_journal_seq": self.journal.last_seq})
+
+            if not self.storage.save(chatid, user_data):
+                self.logger.error("USERDATA_FAILED_TO_SAVE",
+                                  f"User:{chatid} userdata has failed to be reset.")
+                return
+
+        self.update_index(chatid, user_data)
 
     def ban_user(self, chatid: str) -> None:
         """
@@ -487,16 +1313,7 @@ class UserManager():
                     user_manager.ban_user(user.chatid)
         """
 
-        self.__update_banned_list()
-
-        user: User = self.get_from_chatid(chatid)
-        if user:
-            # user.reset_user()
-            user.is_banned = True
-
-        self.banned_users.append(chatid)
-        utils.dump_to_yaml_file(
-            self.banned_users, banned_users_yaml_file, self.logger)
+        self.banned_users.ban(chatid)
 
     def unban_user(self, chatid: str) -> None:
         """
@@ -534,50 +1351,7 @@ class UserManager():
                     user_manager.unban_user(user.chatid)
         """
 
-        self.__update_banned_list()
-
-        if chatid in self.banned_users:
-            self.banned_users.remove(chatid)
-            utils.dump_to_yaml_file(
-                self.banned_users, banned_users_yaml_file, self.logger)
-            self.__update_banned_list()
-
-            user: User = self.get_from_chatid(chatid)
-            if user:
-                user.is_banned = False
-
-    def __update_banned_list(self) -> None:
-        """
-        Internal private function to update banned list.
-
-        Reads and writes to file users/banned_users.yaml.
-
-        ---
-
-        Parameters:
-            - None
-
-        ---
-
-        Returns:
-            (:obj:`None`)
-        """
-
-        banned_users = utils.load_yaml_file(
-            banned_users_yaml_file, self.logger) if os.path.isfile(banned_users_yaml_file) else False
-        if banned_users or isinstance(banned_users, List):
-            self.banned_users = banned_users
-
-            for chatid in banned_users:
-                user: User = self.get_from_chatid(chatid)
-                if user:
-                    user.is_banned = True
-        else:
-            self.logger.warning("BAN_LIST_CORRUPTED_OR_MISSING",
-                                "Creating and overwriting to an empty list.")
-            self.banned_users = []
-            utils.dump_to_yaml_file(
-                self.banned_users, banned_users_yaml_file, self.logger)
+        self.banned_users.unban(chatid)
 
     def add_data_field(self, data_label: str, value: Any):
         """
@@ -633,11 +1407,291 @@ class UserManager():
 
         self.data_fields.update({data_label: copy.deepcopy(value)})
 
+    def add_event_reducer(self, event: str,
+                          reducer: Callable[[Dict[str, Any], Dict[str, Any]], None]) -> None:
+        """
+        Registers the reducer of a state-change event (`User.apply_event`).
+
+        ---
+
+        Parameters:
+            - event (:obj:`str`): Name of the event (e.g `hint_used`).
+            - reducer (:class:`Callable[[Dict[str, Any], Dict[str, Any]], None]`): Function that \
+                applies the event to the given user data: `reducer(user_data, event)`.
+
+        ---
+
+        Returns:
+            (:obj:`None`)
+
+        ---
+
+        Notes:
+            This function is generally called within a Stage (@init_users_data).
+
+            Reducers are used both when an event is applied and when the journal is replayed on restart, \
+                so they should only read from `user_data` and `event`.
+
+        ---
+
+        Example:
+            >>> class SomeStage(Stage):
+                    def init_users_data(self) -> None:
+                        self.user_manager.add_data_field("stage_state", {"points": 0})
+                        self.user_manager.add_event_reducer("points_awarded", self.apply_points_awarded)
+                        return super().init_users_data()
+
+                    def apply_points_awarded(self, user_data: Dict[str, Any], event: Dict[str, Any]) -> None:
+                        user_data["stage_state"]["points"] += event["points"]
+
+                    def some_handler_callback(self, update: Update, context: CallbackContext) -> USERSTATE:
+                        user: User = context.user_data.get("user")
+                        user.apply_event("points_awarded", points=10)
+        """
+
+        self.event_reducers.update({event: reducer})
+
+    def add_migration(self, version: int,
+                      migration: Callable[[Dict[str, Any]], None]) -> None:
+        """
+        Registers a migration of saved user data.
+
+        Every user data is stamped with the schema version it was saved with (`_schema_version`). \
+            Migrations with a higher version are applied (in order of their version) the first time \
+            the user is loaded, or by `UserManager.migrate_users`.
+
+        ---
+
+        Parameters:
+            - version (:obj:`int`): Schema version the migration upgrades user data to. Versions are \
+                shared by every stage, so use the next unused version.
+            - migration (:class:`Callable[[Dict[str, Any]], None]`): Function that upgrades the given \
+                user data in place: `migration(user_data)`.
+
+        ---
+
+        Returns:
+            (:obj:`None`)
+
+        ---
+
+        Notes:
+            This function is generally called within a Stage (@init_users_data).
+
+            Data fields added with `UserManager.add_data_field` do not need a migration, they are added \
+                to existing user data with their default value when it is loaded.
+
+        ---
+
+        Example:
+            >>> class SomeStage(Stage):
+                    def init_users_data(self) -> None:
+                        self.user_manager.add_data_field("stage_state", {"points": 0, "bonus": 0})
+                        self.user_manager.add_migration(2, self.migrate_bonus_points)
+                        return super().init_users_data()
+
+                    def migrate_bonus_points(self, user_data: Dict[str, Any]) -> None:
+                        # Bonus points used to be counted in the points
+                        stage_state = user_data["stage_state"]
+                        stage_state.update({"bonus": stage_state.pop("bonus_points", 0)})
+        """
+
+        assert version > 0, "Schema versions start from 1."
+        assert version not in self.migrations, f"A migration is already registered for schema version {version}."
+        self.migrations.update({version: migration})
+
+    def get_schema_version(self) -> int:
+        return max(self.migrations, default=0)
+
+    def migrate_user_data(self, user_data: Dict[str, Any]) -> int:
+        """
+        Upgrades user data (in place) to the latest schema version.
+
+        ---
+
+        Parameters:
+            - user_data (:class:`Dict[str, Any]`): The user data to upgrade.
+
+        ---
+
+        Returns:
+            (:obj:`int`): Returns the number of migrations that were applied.
+
+        ---
+
+        Notes:
+            The schema version is stamped after every successful migration so that a failing migration \
+                is retried (without re-applying the previous ones) the next time.
+        """
+
+        schema_version = user_data.get("_schema_version", 0)
+        migrations_applied = 0
+
+        for version in sorted(self.migrations):
+            if version > schema_version:
+                self.migrations[version](user_data)
+                user_data.update({"_schema_version": version})
+                migrations_applied += 1
+
+        for data_label, value in self.data_fields.items():
+            if data_label not in user_data:
+                user_data.update({data_label: copy.deepcopy(value)})
+        user_data.setdefault("_schema_version", schema_version)
+
+        return migrations_applied
+
+    def __migrate_stored_user(self, chatid: str) -> bool:
+        user_data = self.storage.load(chatid)
+        if user_data is None:
+            return False
+
+        data = UserData(user_data)
+        data.mark_saved(user_data.keys())
+        try:
+            self.migrate_user_data(data)
+        except Exception as exception:
+            self.logger.error("USERDATA_FAILED_TO_MIGRATE",
+                              f"User:{chatid} userdata failed to be migrated: {exception}")
+            return False
+
+        changed_fields = data.changed_fields()
+        if not changed_fields:
+            return False
+
+        if not self.storage.save(chatid, data.snapshot(changed_fields if self.storage.partial_writes else None),
+                                 changed_fields):
+            self.logger.error("USERDATA_FAILED_TO_SAVE",
+                              f"User:{chatid} migrated userdata has failed to be saved.")
+            return False
+
+        self.update_index(chatid, data)
+        return True
+
+    def migrate_users(self, workers: int = 4) -> int:
+        """
+        Migrates the saved user data of every user that is not loaded to the latest schema version.
+
+        Users are otherwise migrated lazily the first time they are loaded, this is only needed to \
+            upgrade every user at once (e.g `python main.py --migrate-users`).
+
+        ---
+
+        Parameters:
+            - workers (:obj:`int`): Optional. Number of users migrated in parallel. Defaults to 4.
+
+        ---
+
+        Returns:
+            (:obj:`int`): Returns the number of users whose user data was changed.
+        """
+
+        with self.users_lock:
+            chatids = [chatid for chatid in self.storage.list_chatids()
+                       if chatid not in self.users]
+
+        self.logger.info("MIGRATING_USERS",
+                         f"Migrating {len(chatids)} users to schema version {self.get_schema_version()}...")
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            migrated_users = sum(executor.map(self.__migrate_stored_user, chatids))
+
+        self.logger.info("MIGRATED_USERS",
+                         f"Migrated {migrated_users} users ({len(chatids) - migrated_users} already up to date or failed).")
+        self.write_index()
+        return migrated_users
+
+    def compact_journal(self) -> None:
+        """
+        Compacts the journal into snapshots.
+
+        Every loaded user is written to storage (only if changed) and the events that are now part \
+            of those snapshots are removed from the journal.
+
+        ---
+
+        Parameters:
+            - None
+
+        ---
+
+        Returns:
+            (:obj:`None`)
+
+        ---
+
+        Notes:
+            Users are written one at a time without holding `users_lock` or the journal, so handlers \
+                are only held up while their own user is written.
+
+            Users that are in use (their lock is held by another thread) or fail to be written are \
+                skipped, their events are kept in the journal until a later compaction.
+
+            Called by the `journal-compactor` thread every `STORAGE:JOURNAL_COMPACT_EVENTS` events.
+        """
+
+        if not self.journal:
+            return
+
+        with self.users_lock:
+            users = list(self.users.values())
+
+        # Seq of the last event of each user that is part of their snapshot
+        snapshot_seqs: Dict[str, int] = {}
+        for user in users:
+            if not user.lock.acquire(blocking=False):
+                continue
+            try:
+                snapshot_seq = user.data.get("_journal_seq", 0)
+                if user.write_to_storage():
+                    snapshot_seqs.update({user.chatid: snapshot_seq})
+                else:
+                    self.logger.error("JOURNAL_FAILED_TO_COMPACT",
+                                      f"User:{user.chatid} could not be snapshotted. Keeping their events for later...")
+            finally:
+                user.lock.release()
+
+        with self.journal.compaction_lock:
+            with self.journal.lock:
+                # Events of users loaded since are appended to the new journal file. Users that
+                # are not resident were snapshotted when they were evicted.
+                with self.users_lock:
+                    resident_chatids = set(self.users) | set(self.loading_users)
+                self.journal.rotate()
+
+            def keep(event: Dict[str, Any]) -> bool:
+                chatid = event["chatid"]
+                if chatid in snapshot_seqs:
+                    return event["seq"] > snapshot_seqs[chatid]
+                return chatid in resident_chatids
+
+            # Only the rotation above holds up handlers appending events
+            self.journal.compact(keep, rotate=False)
+
+        skipped_users = len(users) - len(snapshot_seqs)
+        if skipped_users:
+            self.logger.info("JOURNAL_COMPACTION_SKIPPED_USERS",
+                             f"{skipped_users} users were not snapshotted, their events are kept in the journal.")
+
+    def __run_compactor(self) -> None:
+        while True:
+            self.compaction_requested.wait()
+            self.compaction_requested.clear()
+            if self.compactor_closed.is_set():
+                return
+
+            try:
+                self.compact_journal()
+            except Exception as exception:
+                self.logger.error("JOURNAL_FAILED_TO_COMPACT",
+                                  f"Journal could not be compacted: {exception}")
+
     def load_users_from_file(self):
         """
-        Loads all existing users from files.
+        Loads the index of all existing users from files.
 
-        It will create a `User` object for each existing user retrieved from files.
+        Users are loaded on demand afterwards. Users that are missing from the index (e.g. the first \
+            time the bot is started with an existing users directory) are read from storage in parallel \
+            (`USERS:LOAD_WORKERS`) and added to the index. A `User` object is only created here for users \
+            that have events in the journal left to replay.
 
         ---
 
@@ -652,7 +1706,7 @@ class UserManager():
         ---
 
         Notes:
-            Existing users are retrieved from the users directory: `users/`
+            Existing users are retrieved from the storage backend (by default the users directory: `users/`).
 
             If part of the user files are missing or corrupted (incorrected format etc), \
                 then it will overwrite and load the default values for them.
@@ -660,11 +1714,148 @@ class UserManager():
             This function should not be called anywhere else but in `@Bot.start`.
         """
 
-        for chatid in os.listdir(users_directory):
-            if os.path.isdir(os.path.join(users_directory, chatid)):
+        if os.path.isfile(self.index_file):
+            self.index = utils.load_file(
+                self.index_file, "json", self.logger) or {}
+
+        # Users that still have events in the journal (or that only exist in the journal)
+        journal_chatids = list(self.journal.tail) if self.journal else []
+        # Users missing from the index, or indexed before an index field was added
+        chatids = [chatid for chatid in self.storage.list_chatids()
+                   if not set(self.index_fields).issubset(self.index.get(chatid, {}))
+                   and chatid not in journal_chatids]
+
+        self.logger.info("LOADING_USER_INDEX",
+                         f"Loaded {len(self.index)} users from the index, loading {len(chatids) + len(journal_chatids)} more users...")
+        self.__index_stored_users(chatids)
+        for chatid in journal_chatids:
+            self.new_user(chatid)
+
+        self.compact_journal()
+        self.write_index()
+        if isinstance(self.storage, SnapshotStorage):
+            # Only needed to load users on startup, users are loaded from storage from now on
+            self.storage.release()
+
+    def __index_stored_users(self, chatids: List[str]) -> None:
+        """
+        Internal private function to add users to the index straight from storage.
+
+        The userdata of the users is read by `USERS:LOAD_WORKERS` workers in parallel (see \
+            `Storage.load_many`) and no `User` object is created, users are still loaded on demand.
+
+        ---
+
+        Parameters:
+            - chatids (:class:`List[str]`): Chatids of the users to index.
+
+        ---
+
+        Returns:
+            (:obj:`None`)
+        """
+
+        if not chatids:
+            return
+
+        start_time = time.perf_counter()
+        progress_every = max(1, len(chatids) // 10)
+
+        for loaded_users, (chatid, user_data) in enumerate(
+                self.storage.load_many(chatids, self.load_workers), 1):
+            if user_data is None:
+                # Missing or corrupted userdata is reset the same way as when the user is loaded
                 self.new_user(chatid)
+            else:
+                try:
+                    # Only used for the index, the user is migrated for good once they are loaded
+                    self.migrate_user_data(user_data)
+                except Exception as exception:
+                    self.logger.error("USERDATA_FAILED_TO_MIGRATE",
+                                      f"User:{chatid} userdata failed to be migrated for the index: {exception}")
+                self.update_index(chatid, user_data)
+
+            if loaded_users % progress_every == 0 or loaded_users == len(chatids):
+                self.logger.info("LOADING_USERS_PROGRESS",
+                                 f"Loaded {loaded_users}/{len(chatids)} users ({time.perf_counter() - start_time:.2f}s)")
+
+        elapsed_time = time.perf_counter() - start_time
+        self.logger.info("LOADED_USERS",
+                         f"Loaded {len(chatids)} users in {elapsed_time:.2f}s "
+                         f"({len(chatids) / max(elapsed_time, 1e-6):.0f} users/s, {self.load_workers} workers).")
+
+    def flush(self, chatid: Optional[str] = None) -> None:
+        """
+        Writes any pending (write-behind) saves of a user to storage immediately.
+
+        ---
 
-    def init(self, logger: Log, log_user_logs_to_app_logs: bool = False) -> None:
+        Parameters:
+            - chatid (:obj:`str`): Optional. Unique chatid of the user account (in relation to the bot). \
+                Defaults to flushing every user.
+
+        ---
+
+        Returns:
+            (:obj:`None`)
+
+        ---
+
+        Notes:
+            Does nothing if the write-behind queue is disabled as saves are already written immediately.
+
+        ---
+
+        Example:
+            >>> user_manager.flush(chatid="CHATID")
+        """
+
+        if self.save_queue:
+            self.save_queue.flush(chatid)
+
+    def quit(self) -> None:
+        """
+        Releases the resources held by the UserManager (write-behind queue, journal, storage backend and ban list).
+
+        Any pending saves are written (and the journal compacted) before the storage backend is closed and any writes \
+            still waiting on a batched fsync (`STORAGE:FSYNC`) are synced.
+
+        ---
+
+        Parameters:
+            - None
+
+        ---
+
+        Returns:
+            (:obj:`None`)
+
+        ---
+
+        Notes:
+            This function should not be called anywhere else but in `@Bot.start` (after the bot has stopped).
+        """
+
+        if self.save_queue:
+            self.save_queue.close()
+        self.index_writer_closed.set()
+        self.index_writer.join()
+        self.write_index()
+        if self.journal:
+            self.compactor_closed.set()
+            self.compaction_requested.set()
+            self.compactor.join()
+
+            self.compact_journal()
+            self.journal.close()
+        self.storage.close()
+        self.banned_users.close()
+        self.user_log_handler.close()
+        self.user_event_handler.close()
+        utils.sync_pending_files()
+
+    def init(self, logger: Log, log_user_logs_to_app_logs: bool = False,
+             config: Optional[Dict[str, Any]] = None) -> None:
         """
         Initializes the UserManager class.
 
@@ -674,6 +1865,9 @@ class UserManager():
             - logger (:class:`Log`): Logger object to use for logging purposes of the bot.
             - log_user_logs_to_app_logs (:obj:`bool`): Whether to log user logs to application logs \
             as well (can cause too much logs if set to True).
+            - config (:class:`Dict[str, Any]`): Optional. Configurations values loaded from `config.yaml`. \
+            Only the `STORAGE` and `USERS` sections are used. Defaults to the YAML storage backend without write-behind \
+            or fsync.
 
         ---
 
@@ -698,7 +1892,8 @@ class UserManager():
                 user_manager.init(
                     logger=logger,
                     log_user_logs_to_app_logs=("LOG_USER_TO_APP_LOGS" in config
-                                   and config["LOG_USER_TO_APP_LOGS"]))
+                                   and config["LOG_USER_TO_APP_LOGS"]),
+                    config=config
                 )
         """
 
@@ -706,12 +1901,69 @@ class UserManager():
         self.application_logfilehandler: str = logger.file_handlers[0]
         self.logger: Log = logger
 
-        self.data_fields: Dict[str, Any] = {}
-
-        self.users: Dict[str, User] = {}
+        storage_config: Dict[str, Any] = (config or {}).get("STORAGE") or {}
+        utils.set_fsync_policy(storage_config.get("FSYNC", "never"),
+                               storage_config.get("FSYNC_INTERVAL", 1.0), logger)
+        self.storage: Storage = storage.from_config(
+            users_directory, storage_config, logger)
+        if storage_config.get("SNAPSHOT", False):
+            self.storage = SnapshotStorage(
+                self.storage,
+                storage_config.get("SNAPSHOT_FILE", storage.DEFAULT_SNAPSHOT_FILE),
+                storage_config.get("SNAPSHOT_INTERVAL", 60.0),
+                logger)
+        self.save_queue: Optional[WriteBehindQueue] = WriteBehindQueue(
+            self.storage, storage_config.get("WRITE_BEHIND_WINDOW", 1.0)
+        ) if storage_config.get("WRITE_BEHIND", False) else None
+        self.journal: Optional[Journal] = journal.from_config(
+            storage_config, logger)
+        self.compaction_requested = threading.Event()
+        self.compactor_closed = threading.Event()
+        self.compactor: Optional[threading.Thread] = None
+        if self.journal:
+            self.compactor = threading.Thread(
+                target=self.__run_compactor, name="journal-compactor", daemon=True)
+            self.compactor.start()
 
-        self.banned_users: List[str] = []
-        self.__update_banned_list()
+        self.data_fields: Dict[str, Any] = {}
+        self.event_reducers: Dict[str, Callable[[
+            Dict[str, Any], Dict[str, Any]], None]] = {}
+        self.migrations: Dict[int, Callable[[Dict[str, Any]], None]] = {}
+
+        users_config: Dict[str, Any] = (config or {}).get("USERS") or {}
+        self.user_log_handler = async_handler(PooledFileHandler(LogFilePool(
+            users_config.get("LOG_MAX_OPEN_FILES", 64),
+            users_config.get("LOG_IDLE_TIMEOUT", 60.0))))
+        self.user_log_handler.setFormatter(FORMATTER)
+        self.user_stream_handler = async_handler(logging.StreamHandler(sys.stdout))
+        self.user_stream_handler.setFormatter(FORMATTER)
+        self.user_event_handler = async_handler(EventFileHandler(
+            ((config or {}).get("LOGGING") or {}).get("EVENTS_FILE", DEFAULT_EVENTS_FILE)))
+
+        self.users: OrderedDict[str, User] = OrderedDict()
+        self.users_lock = threading.RLock()
+        self.loading_users: Dict[str, Future] = {}
+        self.max_resident_users: int = users_config.get("MAX_RESIDENT", 0)
+        self.load_workers: int = users_config.get(
+            "LOAD_WORKERS", min(4, os.cpu_count() or 1))
+
+        self.index: Dict[str, Dict[str, Any]] = {}
+        self.index_fields: Dict[str, Callable[[Dict[str, Any]], Any]] = {}
+        self.index_file: str = users_config.get("INDEX_FILE", DEFAULT_INDEX_FILE)
+        self.index_lock = threading.Lock()
+        self.index_dirty = False
+        self.index_write_interval: float = users_config.get(
+            "INDEX_WRITE_INTERVAL", 5.0)
+        self.index_writer_closed = threading.Event()
+        self.index_writer = threading.Thread(
+            target=self.__run_index_writer, name="index-writer", daemon=True)
+        self.index_writer.start()
+
+        self.banned_users: BanList = BanList(
+            banned_users_yaml_file,
+            users_config.get("BAN_LOG_FILE", DEFAULT_BAN_LOG_FILE),
+            users_config.get("BAN_LOG_COMPACT_CHANGES", 100),
+            logger=logger)
 
     def __new__(cls, *_):
         if not hasattr(cls, "instance"):
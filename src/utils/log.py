@@ -1,11 +1,336 @@
+import time
+import json
+import queue
 import logging
-from typing import (TextIO, Union, Any, Callable, Optional)
+import logging.handlers
+import fnmatch
+import itertools
+import threading
+from collections import OrderedDict
+from typing import (TextIO, Union, Any, Callable, Dict, Iterator, Optional, Tuple)
 
 from utils import utils
+from utils import log_rotation
+from utils.log_rotation import (LogSegments, RotatingLogFileHandler)
 
 FORMATTER = logging.Formatter("%(asctime)s [%(levelname)s] %(message)s")
 
 
+class Lazy:
+    """
+    Part of a log message that is only computed (`function(*args)`) if the record is written.
+
+    Messages logged on every update should be passed as a format string and its arguments \
+        rather than an f-string, so that they are not formatted when the record is dropped.
+
+    Example:
+        >>> logger.debug("USERS", "Resident users:", Lazy(lambda: len(user_manager.users)))
+            user.logger.info("USER_CTF_LOAD_MENU", Lazy("User:{} has loaded ctf menu".format, user.chatid))
+    """
+
+    __slots__ = ("function", "args")
+
+    def __init__(self, function: Callable[..., Any], *args: Any):
+        self.function = function
+        self.args = args
+
+    def __str__(self) -> str:
+        return str(self.function(*self.args))
+
+
+class LogMessage:
+    """
+    Message of a record logged by `Log`, only built when a handler formats the record.
+    """
+
+    __slots__ = ("code", "output")
+
+    def __init__(self, code: Union[bool, str], output: Tuple):
+        self.code = code
+        self.output = output
+
+    def __str__(self) -> str:
+        if self.code:
+            return "$CODE::" + self.code + " || " + utils.concat_tuple(self.output)
+        return utils.concat_tuple(self.output)
+
+
+# code pattern -> (log 1 record in every N, counter)
+SAMPLING: Dict[str, Tuple[int, Iterator[int]]] = {}
+# code -> pattern in SAMPLING it matches (None if it matches none)
+SAMPLED_CODES: Dict[str, Optional[str]] = {}
+
+
+def set_sampling(code: str, every: int) -> None:
+    """
+    Only logs 1 in every `every` records logged with `code` (across every `Log`). `code` can \
+        be a pattern (e.g `USER_CTF_VIEW_CHALLENGE_*`). Set `every` to 1 or less to log every record.
+    """
+
+    if every > 1:
+        SAMPLING[code] = (every, itertools.count())
+    else:
+        SAMPLING.pop(code, None)
+    SAMPLED_CODES.clear()
+
+
+def is_sampled_out(code: str) -> bool:
+    if code not in SAMPLED_CODES:
+        SAMPLED_CODES[code] = next(
+            (pattern for pattern in SAMPLING if fnmatch.fnmatchcase(code, pattern)), None)
+
+    pattern = SAMPLED_CODES[code]
+    if pattern is None:
+        return False
+
+    every, counter = SAMPLING[pattern]
+    return next(counter) % every != 0
+
+
+class QueuedHandler(logging.handlers.QueueHandler):
+    """
+    Handler that puts records on the queue of a `LogPipeline` to be handled by `target` on the \
+        pipeline's listener thread.
+    """
+
+    def __init__(self, pipeline: "LogPipeline", target: logging.Handler):
+        super().__init__(pipeline.queue)
+        self.pipeline = pipeline
+        self.target = target
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        # Records logged after the pipeline was stopped are written synchronously
+        if not self.pipeline.running:
+            if record.levelno >= self.target.level:
+                self.target.handle(record)
+            return
+
+        try:
+            self.queue.put((self.target, record), block=self.pipeline.block_when_full)
+        except queue.Full:
+            self.pipeline.dropped += 1
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Queued as is, the message (LogMessage, Lazy) is formatted by the target on the listener thread
+        return record
+
+    def setFormatter(self, fmt: Optional[logging.Formatter]) -> None:
+        self.target.setFormatter(fmt)
+
+    def close(self) -> None:
+        # Closed on the listener thread, after the records queued before it were written
+        if self.pipeline.running:
+            self.queue.put((self.target, None))
+        else:
+            self.target.close()
+        super().close()
+
+
+class LogListener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self) -> None:
+        # Waits for room in the queue instead of failing if it is full
+        self.queue.put(self._sentinel)
+
+    def handle(self, item) -> None:
+        target, record = item
+        if record is None:
+            target.close()
+        elif record.levelno >= target.level:
+            target.handle(record)
+
+
+class LogPipeline:
+    """
+    Bounded queue of log records that are written by a background listener thread, so that logging \
+        does not block on formatting and file writes.
+
+    When the queue is full records are dropped (and counted in `dropped`), unless `block_when_full` \
+        is set in which case the logging thread waits for room in the queue.
+    """
+
+    def __init__(self, max_queued: int = 10000, block_when_full: bool = False):
+        self.queue = queue.Queue(max_queued)
+        self.block_when_full = block_when_full
+        self.dropped = 0
+
+        self.listener = LogListener(self.queue)
+        self.listener.start()
+        self.running = True
+
+    def wrap(self, handler: logging.Handler) -> QueuedHandler:
+        return QueuedHandler(self, handler)
+
+    def stop(self) -> None:
+        """
+        Writes every queued record and stops the listener thread.
+        """
+
+        self.running = False
+        self.listener.stop()
+
+
+PIPELINE: Optional[LogPipeline] = None
+
+
+def start_async_logging(max_queued: int = 10000, block_when_full: bool = False) -> LogPipeline:
+    """
+    Makes handlers added to `Log` objects from now on write their records from a background \
+        thread (see `LogPipeline`).
+    """
+
+    global PIPELINE
+    if PIPELINE is None:
+        PIPELINE = LogPipeline(max_queued, block_when_full)
+    return PIPELINE
+
+
+def stop_async_logging() -> int:
+    """
+    Flushes the queued records and goes back to writing records synchronously.
+
+    Returns the number of records that were dropped because the queue was full.
+    """
+
+    global PIPELINE
+    if PIPELINE is None:
+        return 0
+
+    pipeline, PIPELINE = PIPELINE, None
+    pipeline.stop()
+    return pipeline.dropped
+
+
+def async_handler(handler: logging.Handler) -> logging.Handler:
+    """
+    Returns `handler` wrapped to write through the logging pipeline if async logging is started, \
+        else `handler` itself.
+    """
+
+    return PIPELINE.wrap(handler) if PIPELINE else handler
+
+
+class EventFormatter(logging.Formatter):
+    """
+    Formats the event attached to a record (see @Log.event) as a JSON line.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        return json.dumps({"ts": record.created, **record.event}, default=str)
+
+
+class EventFileHandler(RotatingLogFileHandler):
+    """
+    Handler that appends the events logged with @Log.event to a JSON-lines file and ignores \
+        any other record.
+
+    The file is rotated if log rotation is enabled (see `log_rotation.set_rotation`).
+    """
+
+    def __init__(self, file_path: str):
+        super().__init__(file_path, log_rotation.ROTATION, encoding="utf-8")
+        self.setFormatter(EventFormatter())
+        self.addFilter(lambda record: hasattr(record, "event"))
+
+
+class LogFilePool:
+    """
+    Keeps a bounded number of log files open for appending.
+
+    Files are closed when more than `max_open_files` are open (least recently written first) \
+        or once they have not been written to for `idle_timeout` seconds, and are reopened on \
+        the next write. Files are rotated if log rotation is enabled (see `log_rotation.set_rotation`).
+    """
+
+    def __init__(self, max_open_files: int = 64, idle_timeout: float = 60.0):
+        self.max_open_files = max(1, max_open_files)
+        self.idle_timeout = idle_timeout
+
+        self.rotation = log_rotation.ROTATION
+        self.files: OrderedDict[str, TextIO] = OrderedDict()
+        self.segments: Dict[str, LogSegments] = {}
+        self.written_at = {}
+        self.checked_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def write(self, file_path: str, text: str) -> None:
+        with self.lock:
+            stream = self.files.pop(file_path, None)
+            if stream is None:
+                stream = open(file_path, "a", encoding="utf-8")
+            self.files[file_path] = stream
+
+            if self.rotation:
+                stream = self.__rotate_if_due(file_path, stream)
+
+            stream.write(text)
+            stream.flush()
+            if self.rotation:
+                self.segments[file_path].started(time.time())
+
+            now = time.monotonic()
+            self.written_at[file_path] = now
+
+            while len(self.files) > self.max_open_files:
+                self.__close(next(iter(self.files)))
+
+            if now - self.checked_at >= self.idle_timeout:
+                self.checked_at = now
+                for idle_file_path in [idle_file_path for idle_file_path in self.files
+                                       if now - self.written_at[idle_file_path] >= self.idle_timeout]:
+                    self.__close(idle_file_path)
+
+    def __rotate_if_due(self, file_path: str, stream: TextIO) -> TextIO:
+        segments = self.segments.get(file_path)
+        if segments is None:
+            segments = self.segments[file_path] = log_rotation.open_segments(
+                file_path, self.rotation.compress)
+
+        if not self.rotation.is_due(stream.tell(), segments.active_start, time.time()):
+            return stream
+
+        stream.close()
+        segments.rotate()
+        stream = self.files[file_path] = open(file_path, "a", encoding="utf-8")
+        return stream
+
+    def __close(self, file_path: str) -> None:
+        self.files.pop(file_path).close()
+        self.written_at.pop(file_path, None)
+        self.segments.pop(file_path, None)
+
+    def close(self, file_path: Optional[str] = None) -> None:
+        with self.lock:
+            for open_file_path in ([file_path] if file_path else list(self.files)):
+                if open_file_path in self.files:
+                    self.__close(open_file_path)
+
+
+class PooledFileHandler(logging.Handler):
+    """
+    Handler that writes each record to its own log file (`record.log_file`) through a `LogFilePool`.
+
+    A single PooledFileHandler is shared by every `PooledLog`.
+    """
+
+    def __init__(self, pool: LogFilePool):
+        super().__init__()
+        self.pool = pool
+
+    def emit(self, record: logging.LogRecord) -> None:
+        log_file = getattr(record, "log_file", None)
+        if not log_file:
+            return
+
+        try:
+            self.pool.write(log_file, self.format(record) + "\n")
+        except Exception:
+            self.handleError(record)
+
+    def close(self) -> None:
+        self.pool.close()
+        super().close()
+
+
 class Log:
 
     def __init__(self, name: str, stream_handle: Optional[TextIO] = None, file_handle: Optional[str] = None, log_level: int = logging.INFO):
@@ -16,6 +341,8 @@ class Log:
 
         self.stream_handlers = []
         self.file_handlers = []
+        # Handlers owned by another Log (see add_filehandler), these are not closed on quit
+        self.shared_file_handlers = []
 
         if stream_handle:
             self.add_streamhandle(stream_handle)
@@ -33,40 +360,63 @@ class Log:
 
         for file_handler in self.file_handlers:
             self.logger.removeHandler(file_handler)
+            file_handler.close()
+
+        for file_handler in self.shared_file_handlers:
+            self.logger.removeHandler(file_handler)
 
     def add_streamhandle(self, stream_handle: TextIO):
-        stream_output = logging.StreamHandler(stream_handle)
+        stream_output = async_handler(logging.StreamHandler(stream_handle))
         stream_output.setFormatter(FORMATTER)
         self.logger.addHandler(stream_output)
         self.stream_handlers.append(stream_output)
 
     def add_filehandle(self, file_handle: str):
-        file_output = logging.FileHandler(file_handle)
+        file_output = async_handler(RotatingLogFileHandler(file_handle, log_rotation.ROTATION)
+                                    if log_rotation.ROTATION else logging.FileHandler(file_handle))
         file_output.setFormatter(FORMATTER)
         self.logger.addHandler(file_output)
         self.file_handlers.append(file_output)
 
     def add_filehandler(self, file_handler: logging.FileHandler):
         self.logger.addHandler(file_handler)
+        self.shared_file_handlers.append(file_handler)
 
-    def _log(self, log_type: Callable, with_code: Union[bool, Any], *output: Any) -> None:
-        if with_code:
-            log_type("$CODE::" + with_code + " || " +
-                     utils.concat_tuple(output))
-        else:
-            log_type(utils.concat_tuple(output))
+    def _log(self, level: int, with_code: Union[bool, Any], *output: Any) -> None:
+        # The message is only built if a handler writes the record
+        if not self.logger.isEnabledFor(level):
+            return
+        if with_code and SAMPLING and is_sampled_out(with_code):
+            return
+
+        self.logger.log(level, LogMessage(with_code, output))
 
     def info(self, with_code: Union[bool, Any], *output: Any) -> None:
-        self._log(self.logger.info, with_code, *output)
+        self._log(logging.INFO, with_code, *output)
+
+    def event(self, code: str, *output: Any, **fields: Any) -> None:
+        """
+        Logs `output` at INFO level like @Log.info, along with a structured event made of `code` \
+            and `fields` that is written as a JSON line by event handlers (`EventFileHandler`).
+
+        Example:
+            >>> user.logger.event("USER_CTF_CORRECT_ANSWER_0", f"User:{chatid} ...",
+                                  action="CORRECT_ANSWER", chatid=chatid, challenge=1, score=40)
+        """
+
+        # Events are never sampled out
+        if self.logger.isEnabledFor(logging.INFO):
+            self.logger.info(LogMessage(code, output),
+                             extra={"event": {"code": code, **fields}})
 
     def debug(self, with_code: Union[bool, Any], *output: Any) -> None:
-        self._log(self.logger.debug, with_code, *output)
+        self._log(logging.DEBUG, with_code, *output)
 
     def error(self, with_code: Union[bool, Any], *output: Any) -> None:
-        self._log(self.logger.error, with_code, *output)
+        self._log(logging.ERROR, with_code, *output)
 
     def warning(self, with_code: Union[bool, Any], *output: Any) -> None:
-        self._log(self.logger.warning, with_code, *output)
+        self._log(logging.WARNING, with_code, *output)
 
     def info_if(self, condition: bool, *output: Any) -> None:
         if condition:
@@ -83,3 +433,39 @@ class Log:
     def warning_if(self, condition: bool, *output: Any) -> None:
         if condition:
             self.warning(*output)
+
+
+class PooledLog(Log):
+    """
+    Log that writes to `file_path` through a shared `PooledFileHandler` instead of keeping its own \
+        file open.
+
+    The underlying logger is not registered with `logging.getLogger`, so it is freed together with \
+        its owner. Handlers passed in are shared and are not closed on quit.
+    """
+
+    def __init__(self, name: str, file_path: str, file_handler: logging.Handler,
+                 stream_handler: Optional[logging.Handler] = None, log_level: int = logging.INFO):
+        logger = logging.Logger(name, log_level)
+        logger.propagate = False
+
+        self.logger = logger
+        self.name = name
+        self.file_path = file_path
+
+        self.stream_handlers = []
+        self.file_handlers = []
+        self.shared_file_handlers = []
+
+        logger.addFilter(self.__add_log_file)
+        self.add_filehandler(file_handler)
+        if stream_handler:
+            self.add_filehandler(stream_handler)
+
+    def __add_log_file(self, record: logging.LogRecord) -> bool:
+        record.log_file = self.file_path
+        return True
+
+    def quit(self):
+        super().quit()
+        self.logger.removeFilter(self.__add_log_file)
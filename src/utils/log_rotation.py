@@ -0,0 +1,338 @@
+import os
+import gzip
+import time
+import queue
+import shutil
+import logging
+import logging.handlers
+import threading
+import weakref
+from typing import (Any, Dict, Iterator, Optional)
+
+from utils import utils
+
+
+class LogRotation:
+    """
+    When log files are rotated.
+
+    The active file of a log is rotated once it is `max_bytes` big or once its first record is \
+        `interval` seconds old (0 disables either). Rotated segments are gzipped if `compress` is set.
+    """
+
+    def __init__(self, max_bytes: int = 0, interval: float = 0.0, compress: bool = True):
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.compress = compress
+
+    def is_due(self, size: int, started_at: Optional[float], now: float) -> bool:
+        if self.max_bytes and size >= self.max_bytes:
+            return True
+        return bool(self.interval and started_at is not None and now - started_at >= self.interval)
+
+
+ROTATION: Optional[LogRotation] = None
+
+
+def set_rotation(max_bytes: int = 0, interval: float = 0.0, compress: bool = True) -> None:
+    """
+    Rotates the log files opened from now on (see `LogRotation`).
+    """
+
+    global ROTATION
+    ROTATION = LogRotation(max_bytes, interval, compress) if max_bytes or interval else None
+
+
+def segments_index_file(log_file: str) -> str:
+    return f"{log_file}.segments.json"
+
+
+class LogSegments:
+    """
+    This object represents the rotated segments of a log file.
+
+    Segments are kept next to the log file (`<log_file>.<n>[.gz]`) and listed, along with the \
+        time range of the records in each of them, in `<log_file>.segments.json`:
+
+        >>> {
+                "active_start": 1653027373.5, # time of the first record in the active file
+                "segments": [
+                    {"file": "main.log.1.gz", "start": 1653020000.1, "end": 1653027373.4}
+                ]
+            }
+
+    Times are epoch seconds. `start` is None for segments written before the log was rotated. \
+        `active_start` is 0 if the active file holds records that were never indexed (e.g written \
+        before rotation was enabled), as their time is unknown.
+
+    Segments are compressed by a background thread (see `SegmentCompressor`) and listed without \
+        their `.gz` extension until they are. Writers should get the segments of a log file through \
+        `open_segments` so that the index is only ever updated through one object.
+    """
+
+    def __init__(self, log_file: str, compress: bool = True):
+        self.log_file = log_file
+        self.index_file = segments_index_file(log_file)
+        self.compress = compress
+        self.lock = threading.RLock()
+
+        index = utils.load_file(self.index_file, "json") if os.path.isfile(
+            self.index_file) else None
+        if not index and os.path.isfile(log_file) and os.path.getsize(log_file):
+            index = {"active_start": 0.0, "segments": []}
+        self.index: Dict[str, Any] = index or {"active_start": None, "segments": []}
+
+    @property
+    def active_start(self) -> Optional[float]:
+        return self.index["active_start"]
+
+    def save(self) -> None:
+        with self.lock:
+            utils.dump_to_file(self.index, self.index_file, "json")
+
+    def segment_path(self, segment_file: str) -> str:
+        return os.path.join(os.path.dirname(self.log_file), segment_file)
+
+    def started(self, created_at: float) -> None:
+        """
+        Records the time of the first record written to the active file.
+        """
+
+        if self.index["active_start"] is not None:
+            return
+
+        with self.lock:
+            if self.index["active_start"] is None:
+                # Saved straight away as the file may be closed (LogFilePool) or the bot restarted
+                # long before the log is rotated
+                self.index["active_start"] = created_at
+                self.save()
+
+    def rotate(self, now: Optional[float] = None) -> None:
+        """
+        Moves the active file to a new segment, which is then compressed in the background if enabled.
+        """
+
+        if not os.path.isfile(self.log_file):
+            return
+
+        with self.lock:
+            segment_file = f"{self.log_file}.{len(self.index['segments']) + 1}"
+            os.replace(self.log_file, segment_file)
+
+            self.index["segments"].append({
+                "file": os.path.basename(segment_file),
+                "start": self.index["active_start"],
+                "end": now or time.time()
+            })
+            self.index["active_start"] = None
+            self.save()
+
+        if self.compress:
+            compress_segment(self, segment_file)
+
+    def compressed(self, segment_file: str) -> None:
+        """
+        Lists a segment under the name of its compressed file (`<segment_file>.gz`).
+        """
+
+        with self.lock:
+            for segment in self.index["segments"]:
+                if segment["file"] == os.path.basename(segment_file):
+                    segment.update({"file": f"{segment['file']}.gz"})
+            self.save()
+
+    def uncompressed_segments(self) -> Iterator[str]:
+        """
+        Yields the path of every segment that has not been compressed yet.
+        """
+
+        for segment in self.index["segments"]:
+            segment_file = self.segment_path(segment["file"])
+            if not segment_file.endswith(".gz") and os.path.isfile(segment_file):
+                yield segment_file
+
+
+# Log file -> its LogSegments, shared by every writer of the log file
+OPEN_SEGMENTS: "weakref.WeakValueDictionary[str, LogSegments]" = weakref.WeakValueDictionary()
+OPEN_SEGMENTS_LOCK = threading.Lock()
+
+
+def open_segments(log_file: str, compress: bool = True) -> LogSegments:
+    """
+    Returns the `LogSegments` of a log file, shared with any other writer of the same file.
+
+    Segments left uncompressed (e.g. the bot stopped while they were being compressed) are compressed again.
+    """
+
+    log_file = os.path.abspath(log_file)
+    with OPEN_SEGMENTS_LOCK:
+        segments = OPEN_SEGMENTS.get(log_file)
+        if segments is not None:
+            return segments
+        segments = OPEN_SEGMENTS[log_file] = LogSegments(log_file, compress)
+
+    if compress:
+        for segment_file in segments.uncompressed_segments():
+            compress_segment(segments, segment_file)
+    return segments
+
+
+class SegmentCompressor:
+    """
+    Background thread that gzips rotated segments, so that writing a record never waits for a \
+        whole segment to be compressed.
+
+    The compressed file is written next to the segment (`<segment>.gz`) and listed in the index \
+        before the segment itself is removed, so readers (`read_lines`) always find one of them.
+    """
+
+    def __init__(self):
+        self.queue: "queue.Queue" = queue.Queue()
+        # Segments being compressed or waiting to be
+        self.pending = set()
+        self.thread = threading.Thread(
+            target=self.__run, name="log-compressor", daemon=True)
+        self.thread.start()
+
+    def submit(self, segments: LogSegments, segment_file: str) -> None:
+        if segment_file in self.pending:
+            return
+        self.pending.add(segment_file)
+        self.queue.put((segments, segment_file))
+
+    def wait(self) -> None:
+        """
+        Waits for every submitted segment to be compressed.
+        """
+
+        self.queue.join()
+
+    def __run(self) -> None:
+        while True:
+            segments, segment_file = self.queue.get()
+            try:
+                self.__compress(segments, segment_file)
+            except OSError as exception:
+                utils.DEFAULT_LOG.error("LOG_SEGMENT_FAILED_TO_COMPRESS",
+                                        f"Log segment {segment_file} could not be compressed: {exception}")
+            finally:
+                self.pending.discard(segment_file)
+                self.queue.task_done()
+
+    @staticmethod
+    def __compress(segments: LogSegments, segment_file: str) -> None:
+        compressed_file = f"{segment_file}.gz"
+        temp_compressed_file = f"{compressed_file}.tmp"
+        with open(segment_file, "rb") as source, gzip.open(temp_compressed_file, "wb") as destination:
+            shutil.copyfileobj(source, destination)
+        os.replace(temp_compressed_file, compressed_file)
+
+        segments.compressed(segment_file)
+        os.remove(segment_file)
+
+
+COMPRESSOR: Optional[SegmentCompressor] = None
+COMPRESSOR_LOCK = threading.Lock()
+
+
+def compress_segment(segments: LogSegments, segment_file: str) -> None:
+    """
+    Compresses a segment of a log file in the background (see `SegmentCompressor`).
+    """
+
+    global COMPRESSOR
+    with COMPRESSOR_LOCK:
+        if COMPRESSOR is None:
+            COMPRESSOR = SegmentCompressor()
+        COMPRESSOR.submit(segments, segment_file)
+
+
+def wait_for_compression() -> None:
+    """
+    Waits for the segments being compressed in the background, e.g. before the bot exits.
+    """
+
+    if COMPRESSOR:
+        COMPRESSOR.wait()
+
+
+class RotatingLogFileHandler(logging.handlers.BaseRotatingHandler):
+    """
+    FileHandler that rotates its file according to a `LogRotation` (never if `rotation` is None).
+    """
+
+    def __init__(self, file_path: str, rotation: Optional[LogRotation] = None, encoding: Optional[str] = None):
+        super().__init__(file_path, "a", encoding=encoding)
+        self.rotation = rotation
+        self.segments = open_segments(
+            self.baseFilename, rotation.compress) if rotation else None
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if not self.rotation:
+            return False
+
+        if self.stream is None:
+            self.stream = self._open()
+        return self.rotation.is_due(self.stream.tell(), self.segments.active_start, record.created)
+
+    def doRollover(self) -> None:
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+
+        self.segments.rotate()
+        self.stream = self._open()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        super().emit(record)
+        if self.segments:
+            self.segments.started(record.created)
+
+
+def has_log(log_file: str) -> bool:
+    return os.path.isfile(log_file) or os.path.isfile(segments_index_file(log_file))
+
+
+def read_lines(log_file: str, since: Optional[float] = None, until: Optional[float] = None) -> Iterator[str]:
+    """
+    Yields the lines of a log file, oldest segment first.
+
+    Segments that only hold records from before `since` or after `until` (epoch seconds) are \
+        skipped without being read. Lines of the segments that are read are not filtered.
+    """
+
+    segments = LogSegments(log_file)
+    directory = os.path.dirname(log_file)
+
+    for segment in segments.index["segments"]:
+        if since is not None and segment["end"] < since:
+            continue
+        if until is not None and segment["start"] is not None and segment["start"] > until:
+            continue
+
+        segment_file = os.path.join(directory, segment["file"])
+        if not os.path.isfile(segment_file) and os.path.isfile(f"{segment_file}.gz"):
+            # Compressed since the index was read
+            segment_file = f"{segment_file}.gz"
+        opener = gzip.open if segment_file.endswith(".gz") else open
+        with opener(segment_file, "rt", encoding="utf-8") as stream:
+            yield from stream
+
+    active_start = segments.active_start
+    if os.path.isfile(log_file) and not (until is not None and active_start is not None and active_start > until):
+        with open(log_file, "r", encoding="utf-8") as stream:
+            yield from stream
+
+
+def remove_log(log_file: str, log=utils.DEFAULT_LOG) -> None:
+    """
+    Removes a log file along with its segments and segments index.
+    """
+
+    directory = os.path.dirname(log_file)
+    segment_files = [os.path.join(directory, segment["file"])
+                     for segment in LogSegments(log_file).index["segments"]]
+    utils.remove_files([log_file, segments_index_file(log_file)] + segment_files + [
+        f"{segment_file}.gz" for segment_file in segment_files if not segment_file.endswith(".gz")
+    ], log)
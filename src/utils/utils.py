@@ -2,9 +2,22 @@ import shutil
 import os
 import yaml
 import re
-from typing import (Any, List, Dict, Tuple, Union)
+import json
+import pickle
+import threading
+from typing import (Any, List, Dict, Set, Tuple, Union)
 from datetime import (date, datetime)
 
+# Use the libyaml bindings (C) when PyYAML was built with them, they are many times faster
+try:
+    from yaml import (CSafeLoader as YamlLoader, CSafeDumper as YamlDumper)
+except ImportError:
+    from yaml import (SafeLoader as YamlLoader, SafeDumper as YamlDumper)
+
+SERIALIZER_FORMATS = ("yaml", "json", "pickle")
+SERIALIZER_ERRORS = (yaml.YAMLError, ValueError, TypeError,
+                     EOFError, pickle.PickleError)
+
 
 class DEFAULT_LOG:
     def info(*args: Any) -> None:
@@ -19,10 +32,14 @@ class DEFAULT_LOG:
     def warn(*args: Any) -> None:
         print("[WARN]", concat_tuple(args))
 
+    def warning(*args: Any) -> None:
+        print("[WARN]", concat_tuple(args))
+
 
 def get_dir_or_create(dir_path: str) -> str:
     if not os.path.isdir(dir_path):
-        os.mkdir(dir_path)
+        # Sharded user directories (users/ab/cd/[chatid]) need their parents created as well
+        os.makedirs(dir_path, exist_ok=True)
     return os.path.join(dir_path)
 
 
@@ -32,22 +49,199 @@ def load_yaml_file(file_path: str, log=DEFAULT_LOG) -> Union[Any, None]:
     with open(file_path, 'r') as stream:
         config = {}
         try:
-            config = yaml.safe_load(stream)
+            config = yaml.load(stream, Loader=YamlLoader)
         except yaml.YAMLError as exception:
             log.error(False, exception)
             config = None
         return config
 
 
+FSYNC_POLICIES = ("always", "batch", "never")
+
+
+class FsyncBatcher:
+    """
+    Group commits the fsync of files written by `dump_to_yaml_file` (`FSYNC: batch`).
+
+    Written files are queued and a background thread fsyncs all of them (and their \
+        directories) once every `interval` seconds, so that many saves share the cost of a \
+        single round of fsyncs.
+    """
+
+    def __init__(self, interval: float = 1.0, log=DEFAULT_LOG):
+        self.interval = interval
+        self.log = log
+
+        self.pending: Set[str] = set()
+        self.condition = threading.Condition()
+        self.closed = False
+
+        self.thread = threading.Thread(
+            target=self.__run, name="fsync-batcher", daemon=True)
+        self.thread.start()
+
+    def add(self, file_path: str) -> None:
+        with self.condition:
+            self.pending.add(file_path)
+
+    def flush(self) -> None:
+        with self.condition:
+            file_paths, self.pending = self.pending, set()
+
+        directories = set()
+        for file_path in file_paths:
+            try:
+                fsync_path(file_path)
+            except OSError as exception:
+                self.log.error(False, exception)
+            directories.add(os.path.dirname(file_path) or ".")
+        for directory in directories:
+            fsync_directory(directory)
+
+    def close(self) -> None:
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+        self.flush()
+
+    def __run(self) -> None:
+        while True:
+            with self.condition:
+                self.condition.wait(self.interval)
+                if self.closed:
+                    return
+            self.flush()
+
+
+fsync_policy = "never"
+fsync_batcher: Union[FsyncBatcher, None] = None
+
+
+def set_fsync_policy(policy: str = "never", interval: float = 1.0, log=DEFAULT_LOG) -> None:
+    global fsync_policy, fsync_batcher
+
+    assert policy in FSYNC_POLICIES, f"Unknown fsync policy: {policy}. "\
+        f"Supported policies are: {', '.join(FSYNC_POLICIES)}"
+
+    if fsync_batcher:
+        fsync_batcher.close()
+        fsync_batcher = None
+
+    fsync_policy = policy
+    if policy == "batch":
+        fsync_batcher = FsyncBatcher(interval, log)
+
+
+def sync_pending_files() -> None:
+    if fsync_batcher:
+        fsync_batcher.flush()
+
+
+def fsync_path(file_path: str) -> None:
+    fd = os.open(file_path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def fsync_directory(directory: str) -> None:
+    # Persists the rename itself, not supported on every platform (e.g. Windows)
+    try:
+        fsync_path(directory)
+    except OSError:
+        pass
+
+
 def dump_to_yaml_file(data: Dict[str, Any], file_path: str, log=DEFAULT_LOG) -> bool:
-    with open(file_path, 'w') as file:
-        write_status = True
+    return dump_to_file(data, file_path, "yaml", log)
+
+
+def encode_json_value(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return {"__datetime__": value.isoformat()}
+    if isinstance(value, date):
+        return {"__date__": value.isoformat()}
+    if isinstance(value, (set, tuple)):
+        return list(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def decode_json_object(obj: Dict[str, Any]) -> Any:
+    if len(obj) == 1:
+        if "__datetime__" in obj:
+            return datetime.fromisoformat(obj["__datetime__"])
+        if "__date__" in obj:
+            return date.fromisoformat(obj["__date__"])
+    return obj
+
+
+def serialize(data: Any, file_format: str = "yaml") -> Union[str, bytes]:
+    if file_format == "json":
+        return json.dumps(data, default=encode_json_value, separators=(',', ':'))
+    if file_format == "pickle":
+        return pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+    return yaml.dump(data, Dumper=YamlDumper)
+
+
+def deserialize(payload: Union[str, bytes], file_format: str = "yaml") -> Any:
+    if file_format == "json":
+        return json.loads(payload, object_hook=decode_json_object)
+    if file_format == "pickle":
+        return pickle.loads(payload)
+    return yaml.load(payload, Loader=YamlLoader)
+
+
+def load_file(file_path: str, file_format: str = "yaml", log=DEFAULT_LOG) -> Union[Any, None]:
+    if not os.path.isfile(file_path):
+        raise Exception(f"No file found at {file_path}")
+    with open(file_path, 'rb' if file_format == "pickle" else 'r') as stream:
         try:
-            yaml.dump(data, file)
-        except yaml.YAMLError as exception:
+            return deserialize(stream.read(), file_format)
+        except SERIALIZER_ERRORS as exception:
             log.error(False, exception)
-            write_status = False
-        return write_status
+            return None
+
+
+def dump_to_file(data: Any, file_path: str, file_format: str = "yaml", log=DEFAULT_LOG) -> bool:
+    try:
+        payload = serialize(data, file_format)
+    except SERIALIZER_ERRORS as exception:
+        log.error(False, exception)
+        return False
+
+    # Written to a temporary file first and then renamed over the target so that readers
+    # never see a truncated or half-written file
+    temp_file_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+    write_status = True
+    try:
+        with open(temp_file_path, 'wb' if isinstance(payload, bytes) else 'w') as file:
+            file.write(payload)
+            if fsync_policy == "always":
+                file.flush()
+                os.fsync(file.fileno())
+        os.replace(temp_file_path, file_path)
+    except OSError as exception:
+        log.error(False, exception)
+        write_status = False
+
+    if not write_status:
+        remove_files([temp_file_path], log)
+    elif fsync_policy == "always":
+        fsync_directory(os.path.dirname(file_path) or ".")
+    elif fsync_policy == "batch" and fsync_batcher:
+        fsync_batcher.add(file_path)
+    return write_status
+
+
+def load_yaml_str(yaml_str: str) -> Any:
+    return deserialize(yaml_str, "yaml")
+
+
+def dump_to_yaml_str(data: Any) -> str:
+    return serialize(data, "yaml")
 
 
 def create_template_from(target_template: str, destination: str) -> Union[bool, str]:
@@ -0,0 +1,202 @@
+import hmac
+import json
+import signal
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import (BaseHTTPRequestHandler, HTTPServer)
+from queue import Queue
+from typing import (Optional, Set, Tuple)
+from urllib.parse import urlparse
+
+import telegram
+from telegram import Update
+
+from utils import utils
+
+SECRET_TOKEN_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+# Updates are a few KB at most
+MAX_UPDATE_BYTES = 1024 * 1024
+
+
+class WebhookRequestHandler(BaseHTTPRequestHandler):
+    """
+    Handles the POST requests made by Telegram to the webhook of the bot.
+
+    Each request holds a single update, which is put on the dispatcher's update queue as soon as it \
+        is parsed. Telegram is answered straight away, the update is handled by the dispatcher.
+    """
+
+    server: "WebhookServer"
+
+    # Telegram keeps connections open between updates
+    protocol_version = "HTTP/1.1"
+    timeout = 60
+
+    def do_POST(self) -> None:
+        # Telegram does not add a query string, but the url registered with the webhook may have one
+        if urlparse(self.path).path != self.server.url_path:
+            self.respond(404)
+            return
+
+        secret_token = (self.headers.get(SECRET_TOKEN_HEADER) or "").encode()
+        if not hmac.compare_digest(secret_token, self.server.secret_token.encode()):
+            self.server.logger.warning("WEBHOOK_INVALID_SECRET_TOKEN",
+                                       f"Rejected an update from {self.client_address[0]} with an invalid secret token.")
+            self.respond(403)
+            return
+
+        try:
+            content_length = int(self.headers.get("Content-Length"))
+        except (TypeError, ValueError):
+            self.respond(411)
+            return
+        if not 0 < content_length <= MAX_UPDATE_BYTES:
+            self.respond(413)
+            return
+
+        try:
+            update = Update.de_json(json.loads(self.rfile.read(content_length)), self.server.bot)
+        except (ValueError, KeyError, TypeError) as e:
+            self.server.logger.error("WEBHOOK_INVALID_UPDATE", f"Could not parse update: {e}")
+            update = None
+        if update is None:
+            self.respond(400)
+            return
+
+        self.server.update_queue.put(update)
+        self.respond(200)
+
+    def do_GET(self) -> None:
+        self.respond(405)
+
+    def respond(self, status: int) -> None:
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format: str, *args) -> None:
+        self.server.logger.debug("WEBHOOK_REQUEST", format % args)
+
+
+class WebhookServer(HTTPServer):
+    """
+    Embedded HTTP server that receives updates from Telegram (webhook mode) and feeds them to the \
+        dispatcher's update queue.
+
+    Connections are handled by a pool of `workers` threads, so that Telegram can deliver updates \
+        over up to `workers` connections at once (`max_connections` of the webhook).
+
+    ---
+
+    Parameters:
+        - listen (:obj:`str`): Address to listen on (e.g `0.0.0.0`).
+        - port (:obj:`int`): Port to listen on.
+        - url_path (:obj:`str`): Path that updates are posted to (e.g `/telegram`), other paths \
+            are answered with 404. The query string of requests is ignored.
+        - secret_token (:obj:`str`): Secret token registered with the webhook. Requests without \
+            it in their `X-Telegram-Bot-Api-Secret-Token` header are answered with 403.
+        - update_queue (:class:`Queue`): Update queue of the dispatcher.
+        - bot (:class:`telegram.Bot`): Bot that the updates are bound to.
+        - workers (:obj:`int`): Optional. Number of threads handling connections. Defaults to 4.
+        - logger (:class:`Log`): Optional. Logging object to report rejected requests to.
+
+    ---
+
+    Notes:
+        Telegram only posts to HTTPS urls, TLS is expected to be terminated by a reverse proxy \
+            in front of the server.
+
+        >>> server = WebhookServer("0.0.0.0", 8443, "/telegram", secret_token,
+                                   dispatcher.update_queue, dispatcher.bot)
+            server.start()
+            # ...
+            server.stop()
+    """
+
+    allow_reuse_address = True
+
+    def __init__(self, listen: str, port: int, url_path: str, secret_token: str,
+                 update_queue: Queue, bot: telegram.Bot, workers: int = 4,
+                 logger=utils.DEFAULT_LOG):
+        super().__init__((listen, port), WebhookRequestHandler)
+
+        self.url_path = url_path
+        self.secret_token = secret_token
+        self.update_queue = update_queue
+        self.bot = bot
+        self.workers = workers
+        self.logger = logger
+
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="WebhookServer")
+        self.thread: Optional[threading.Thread] = None
+
+        self.connections_lock = threading.Lock()
+        self.connections: Set[socket.socket] = set()
+
+    def process_request(self, request: socket.socket, client_address: Tuple[str, int]) -> None:
+        self.executor.submit(self.__process_request, request, client_address)
+
+    def __process_request(self, request: socket.socket, client_address: Tuple[str, int]) -> None:
+        with self.connections_lock:
+            self.connections.add(request)
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            with self.connections_lock:
+                self.connections.discard(request)
+            self.shutdown_request(request)
+
+    def handle_error(self, request, client_address: Tuple[str, int]) -> None:
+        self.logger.error("WEBHOOK_REQUEST_FAILED",
+                          f"Request from {client_address[0]} failed.")
+
+    def start(self) -> None:
+        """
+        Starts accepting connections in a background thread.
+        """
+
+        self.thread = threading.Thread(
+            target=self.serve_forever, name="webhook-listener", daemon=True)
+        self.thread.start()
+        self.logger.info("WEBHOOK_LISTENING",
+                         f"Listening for updates on {self.server_address[0]}:{self.server_address[1]}{self.url_path}.")
+
+    def stop(self) -> None:
+        """
+        Stops accepting connections and waits for the requests being handled.
+        """
+
+        if self.thread:
+            self.shutdown()
+            self.thread.join()
+
+        # Idle keep-alive connections would otherwise hold the workers until they time out
+        with self.connections_lock:
+            for connection in self.connections:
+                try:
+                    connection.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+        self.executor.shutdown(wait=True)
+        self.server_close()
+
+
+def wait_for_stop_signal() -> None:
+    """
+    Blocks until the process receives SIGINT, SIGTERM or SIGABRT (same as `Updater.idle`).
+
+    Must be called from the main thread.
+    """
+
+    stopped = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM, signal.SIGABRT):
+        signal.signal(signum, lambda *_: stopped.set())
+
+    # Waits in short steps so that signals are handled promptly
+    while not stopped.wait(1):
+        pass
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The modules of the bot are imported from src, as main.py does
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
@@ -0,0 +1,97 @@
+import time
+import datetime
+import threading
+from types import SimpleNamespace
+
+from telegram import (Chat, Message, Update)
+
+from chat_scheduler import ChatScheduler
+
+
+def test_functions_of_a_chat_run_in_order_one_at_a_time():
+    scheduler = ChatScheduler(workers=4, stats_interval=0)
+    lock = threading.Lock()
+    ran, running = [], []
+
+    def work(idx: int) -> None:
+        with lock:
+            running.append(idx)
+            assert len(running) == 1
+        time.sleep(0.01)
+        with lock:
+            running.remove(idx)
+            ran.append(idx)
+
+    for idx in range(10):
+        assert scheduler.submit("chat", lambda idx=idx: work(idx))
+    scheduler.shutdown()
+
+    assert ran == list(range(10))
+
+
+def test_chats_run_in_parallel():
+    scheduler = ChatScheduler(workers=2, stats_interval=0)
+    # Each function only returns once the function of the other chat is running as well
+    barrier = threading.Barrier(2, timeout=5)
+    passed = []
+
+    for chat in ("a", "b"):
+        scheduler.submit(chat, lambda: passed.append(barrier.wait()))
+    scheduler.shutdown()
+
+    assert sorted(passed) == [0, 1]
+
+
+def test_functions_beyond_max_pending_per_chat_are_dropped():
+    scheduler = ChatScheduler(workers=2, max_pending_per_chat=2, stats_interval=0)
+    release = threading.Event()
+    ran, dropped = [], []
+
+    scheduler.submit("chat", lambda: release.wait(5))
+    for idx in range(3):
+        scheduler.submit("chat", lambda idx=idx: ran.append(idx),
+                         on_drop=lambda idx=idx: dropped.append(idx))
+    # Other chats are not affected
+    assert scheduler.submit("other", lambda: ran.append("other"))
+
+    release.set()
+    scheduler.shutdown()
+
+    assert dropped == [2]
+    assert scheduler.dropped == 1
+    assert sorted(ran, key=str) == [0, 1, "other"]
+    assert ran.index(0) < ran.index(1)
+
+
+def test_dropped_promises_are_resolved():
+    scheduler = ChatScheduler(workers=1, max_pending_per_chat=0, stats_interval=0)
+    release = threading.Event()
+    update = Update(1, message=Message(1, datetime.datetime.now(), Chat(1, Chat.PRIVATE)))
+
+    first = scheduler.run_async(lambda: release.wait(5), update=update)
+    second = scheduler.run_async(lambda: "state", update=update)
+
+    # The conversation of the chat would otherwise wait for it forever
+    assert second.done.is_set()
+    assert not first.done.is_set()
+
+    release.set()
+    scheduler.shutdown()
+    assert first.done.is_set()
+
+
+def test_prepare_and_finish_run_around_handlers():
+    scheduler = ChatScheduler(workers=1, stats_interval=0)
+    calls = []
+    scheduler.attach(
+        SimpleNamespace(),
+        prepare=lambda *args: calls.append(("prepare", args)),
+        finish=lambda state, *args: calls.append(("finish", state, args)))
+
+    promise = scheduler.run_async(lambda *args: calls.append(("handler", args)) or "state", "update", "context")
+    scheduler.shutdown()
+
+    assert promise.result() == "state"
+    assert calls == [("prepare", ("update", "context")),
+                     ("handler", ("update", "context")),
+                     ("finish", "state", ("update", "context"))]
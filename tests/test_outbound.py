@@ -0,0 +1,93 @@
+import time
+import threading
+
+from telegram.error import RetryAfter
+
+from outbound import (OutboundScheduler, TokenBucket, PRIORITY_CALLBACK_ANSWER)
+
+
+def test_bucket_allows_bursts_then_refills_at_rate():
+    bucket = TokenBucket(rate=2, capacity=3)
+    now = bucket.updated_at
+
+    for _ in range(3):
+        assert bucket.wait_time(now) == 0
+        bucket.take(now)
+    assert bucket.wait_time(now) == 0.5
+    assert bucket.wait_time(now + 0.25) == 0.25
+    assert bucket.wait_time(now + 0.5) == 0
+
+    # Never refills beyond its capacity
+    assert bucket.is_full(now + 60)
+    bucket.take(now + 60)
+    assert bucket.tokens == 2
+
+
+def test_messages_of_a_chat_are_rate_limited():
+    outbound = OutboundScheduler(senders=2, chat_rate=10, chat_burst=2)
+    sent_at = []
+
+    for _ in range(4):
+        outbound.submit("chat", lambda: sent_at.append(time.monotonic()))
+    outbound.stop()
+
+    assert len(sent_at) == 4
+    # The burst goes out at once, the rest one every 1 / chat_rate seconds
+    assert sent_at[1] - sent_at[0] < 0.05
+    assert sent_at[3] - sent_at[1] >= 0.15
+
+
+def test_retry_after_puts_the_call_back_at_the_front_of_its_chat():
+    outbound = OutboundScheduler(senders=2, chat_rate=100, chat_burst=100, max_jitter=0)
+    sent = []
+    rejected_at = []
+
+    def flooded() -> None:
+        if not rejected_at:
+            rejected_at.append(time.monotonic())
+            raise RetryAfter(0.2)
+        sent.append(("first", time.monotonic()))
+
+    outbound.submit("chat", flooded)
+    outbound.submit("chat", lambda: sent.append(("second", time.monotonic())))
+    outbound.submit("other", lambda: sent.append(("other", time.monotonic())))
+    outbound.stop()
+
+    assert [name for name, _ in sent] == ["other", "first", "second"]
+    assert sent[1][1] - rejected_at[0] >= 0.2
+    assert outbound.stats()["retried"] == 1
+    assert outbound.stats()["sent"] == 3
+
+
+def test_callback_answers_skip_the_chat_rate_limit():
+    outbound = OutboundScheduler(senders=1, chat_rate=1, chat_burst=1)
+    sent = []
+
+    for idx in range(2):
+        outbound.submit("chat", lambda idx=idx: sent.append(f"message {idx}"))
+    outbound.submit("chat", lambda: sent.append("answer"), priority=PRIORITY_CALLBACK_ANSWER)
+    outbound.stop()
+
+    assert sent.index("answer") < sent.index("message 1")
+
+
+def test_stop_drops_calls_it_cannot_send_in_time():
+    outbound = OutboundScheduler(senders=2, max_jitter=0)
+    attempted = threading.Event()
+
+    def flooded() -> None:
+        attempted.set()
+        raise RetryAfter(60)
+
+    outbound.submit("chat", flooded)
+    outbound.submit("chat", lambda: None)
+    assert attempted.wait(5)
+
+    started_at = time.monotonic()
+    outbound.stop(timeout=0.2)
+
+    assert time.monotonic() - started_at < 1
+    assert outbound.stats()["dropped"] == 2
+    for sender in outbound.senders:
+        sender.join(1)
+        assert not sender.is_alive()
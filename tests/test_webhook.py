@@ -0,0 +1,52 @@
+import json
+import http.client
+from queue import Queue
+
+import pytest
+
+from webhook import (WebhookServer, SECRET_TOKEN_HEADER)
+
+SECRET_TOKEN = "secret-token"
+
+
+@pytest.fixture
+def server():
+    server = WebhookServer("127.0.0.1", 0, "/telegram", SECRET_TOKEN, Queue(), None, workers=2)
+    server.start()
+    yield server
+    server.stop()
+
+
+def post(server: WebhookServer, path: str, secret_token=SECRET_TOKEN, method: str = "POST") -> int:
+    connection = http.client.HTTPConnection(*server.server_address, timeout=5)
+    headers = {"Content-Type": "application/json"}
+    if secret_token is not None:
+        headers.update({SECRET_TOKEN_HEADER: secret_token})
+    try:
+        connection.request(method, path, body=json.dumps({"update_id": 1}), headers=headers)
+        return connection.getresponse().status
+    finally:
+        connection.close()
+
+
+def test_updates_are_queued(server):
+    assert post(server, "/telegram") == 200
+    assert server.update_queue.get_nowait().update_id == 1
+
+
+def test_query_string_is_ignored(server):
+    assert post(server, "/telegram?source=telegram") == 200
+    assert server.update_queue.qsize() == 1
+
+
+def test_other_paths_are_not_found(server):
+    assert post(server, "/other") == 404
+    assert post(server, "/telegram/other?source=telegram") == 404
+    assert post(server, "/telegram", method="GET") == 405
+    assert server.update_queue.empty()
+
+
+@pytest.mark.parametrize("secret_token", [None, "", "wrong-token", SECRET_TOKEN + "0"])
+def test_invalid_secret_tokens_are_rejected(server, secret_token):
+    assert post(server, "/telegram", secret_token) == 403
+    assert server.update_queue.empty()